@@ -0,0 +1,86 @@
+import io
+from typing import Final, Self
+
+import aiohttp
+from attrs import define, field
+
+from .dmg import DMGMetadata
+from .xar import XARMetadata
+
+__all__ = [
+    "AsyncHTTPFile",
+    "open_dmg_metadata",
+    "open_xar_metadata",
+    "shared_session",
+]
+
+
+def shared_session(max_conns: int = 64) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=max_conns, limit_per_host=max_conns)
+    return aiohttp.ClientSession(connector=connector)
+
+
+@define
+class AsyncHTTPFile:
+    url: Final[str]
+    _ses: Final[aiohttp.ClientSession]
+    _sz: Final[int]
+    _idx: int = field(init=False, default=0)
+
+    @classmethod
+    async def open(cls, url: str, ses: aiohttp.ClientSession) -> Self:
+        async with ses.head(url) as r:
+            r.raise_for_status()
+            sz = int(r.headers["Content-Length"])
+        return cls(url, ses, sz)
+
+    @property
+    def sz(self) -> int:
+        return self._sz
+
+    async def pread(self, offset: int, size: int) -> bytes:
+        if offset < 0 or size < 0 or offset + size > self._sz:
+            raise ValueError("out of bounds read")
+        if size == 0:
+            return b""
+        rng = f"bytes={offset}-{offset + size - 1}"
+        async with self._ses.get(self.url, headers={"Range": rng}) as r:
+            r.raise_for_status()
+            if r.status != 206:
+                raise OSError(f"server ignored range request for {self.url}")
+            buf = await r.read()
+        if len(buf) != size:
+            raise OSError(f"short fetch: wanted {size} bytes got {len(buf)}")
+        return buf
+
+    async def read(self, size: int = -1) -> bytes:
+        if size == -1:
+            size = self._sz - self._idx
+        buf = await self.pread(self._idx, size)
+        self._idx += size
+        return buf
+
+    def tell(self) -> int:
+        return self._idx
+
+    async def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
+        elif whence == io.SEEK_END:
+            idx = self._sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if not (0 <= idx <= self._sz):
+            raise ValueError("out of bounds seek")
+        self._idx = idx
+        return self._idx
+
+
+async def open_xar_metadata(url: str, ses: aiohttp.ClientSession) -> XARMetadata:
+    return await XARMetadata.from_async(await AsyncHTTPFile.open(url, ses))
+
+
+async def open_dmg_metadata(url: str, ses: aiohttp.ClientSession) -> DMGMetadata:
+    return await DMGMetadata.from_async(await AsyncHTTPFile.open(url, ses))
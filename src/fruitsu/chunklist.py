@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import collections
+import hashlib
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Final, Optional, Self
+
+from attrs import define, field
+from construct import Bytes, Const, Container, Int8ul, Int32ul, Int64ul, Struct
+from packaging.version import Version
+from rich.console import Console
+from rich.logging import RichHandler
+
+from . import _version
+from .fast_struct import FastStruct
+from .io_ext import FancyRawIOBase, ReadableBuffer, open_source
+
+__all__ = [
+    "CHUNKLIST_MAGIC",
+    "Chunklist",
+    "ChunklistChunk",
+    "ChunklistHeader",
+    "VerifyStats",
+]
+
+LOG_FORMAT = "%(message)s"
+logging.basicConfig(
+    level=logging.WARNING,
+    format=LOG_FORMAT,
+    datefmt="[%X]",
+    handlers=[RichHandler(console=Console(stderr=True), rich_tracebacks=True)],
+)
+
+program_name = "fruitsu-chunklist-mod"
+
+log = logging.getLogger(program_name)
+
+CHUNKLIST_MAGIC: Final[int] = 0x4C4B4E43
+CHUNKLIST_FILE_VERSION_10: Final[int] = 1
+CHUNKLIST_CHUNK_METHOD_10: Final[int] = 1
+CHUNKLIST_SIGNATURE_METHOD_REV1: Final[int] = 1
+CHUNKLIST_SIGNATURE_LEN: Final[int] = 2048 // 8
+
+ChunklistHeader = Struct(
+    "cl_magic" / Const(CHUNKLIST_MAGIC, Int32ul),
+    "cl_header_size" / Int32ul,
+    "cl_file_ver" / Int8ul,
+    "cl_chunk_method" / Int8ul,
+    "cl_sig_method" / Int8ul,
+    "__unused1" / Int8ul,
+    "cl_chunk_count" / Int64ul,
+    "cl_chunk_offset" / Int64ul,
+    "cl_sig_offset" / Int64ul,
+)
+
+ChunklistChunk = Struct(
+    "chunk_size" / Int32ul,
+    "chunk_sha256" / Bytes(32),
+)
+
+ChunklistHeaderFast: Final[FastStruct] = FastStruct(ChunklistHeader)
+ChunklistChunkFast: Final[FastStruct] = FastStruct(ChunklistChunk)
+
+
+@define
+class VerifyStats:
+    chunks: int = 0
+    total_chunks: int = 0
+    bytes_hashed: int = 0
+    total_bytes: int = 0
+    # payload size, which must match the sum of the chunk sizes
+    src_size: int = 0
+    bad_chunk: Optional[int] = None
+    bad_offset: Optional[int] = None
+    start: float = field(factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.bad_chunk is None and self.src_size == self.total_bytes
+
+    @property
+    def throughput(self) -> float:
+        # hashed bytes per second
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        return self.bytes_hashed / elapsed if elapsed > 0 else 0.0
+
+
+@define
+class Chunklist:
+    hdr: Container[Any]
+    chunks: list[Container[Any]]
+    signature: Optional[bytes] = None
+    # payload offset of each chunk plus the total size
+    offsets: list[int] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self.offsets = [0, *itertools.accumulate(c.chunk_size for c in self.chunks)]
+
+    @classmethod
+    def from_buffer(cls, buf: ReadableBuffer) -> Self:
+        hdr = ChunklistHeaderFast.parse(buf)
+        if hdr.cl_chunk_method != CHUNKLIST_CHUNK_METHOD_10:
+            raise ValueError(f"unsupported chunk method {hdr.cl_chunk_method}")
+        chunks = ChunklistChunkFast.parse_array(
+            buf, hdr.cl_chunk_count, hdr.cl_chunk_offset
+        )
+        signature = None
+        if hdr.cl_sig_offset:
+            end = hdr.cl_sig_offset + CHUNKLIST_SIGNATURE_LEN
+            sig = bytes(buf[hdr.cl_sig_offset : end])
+            signature = sig if len(sig) == CHUNKLIST_SIGNATURE_LEN else None
+        return cls(hdr, chunks, signature)
+
+    @classmethod
+    def from_file(cls, fh: Any) -> Self:
+        fh = FancyRawIOBase(fh)
+        return cls.from_buffer(fh.pread(0, fh.size()))
+
+    @property
+    def total_size(self) -> int:
+        return self.offsets[-1]
+
+    def chunk_index(self, offset: int) -> int:
+        # chunk holding a payload offset
+        if not (0 <= offset < self.total_size):
+            raise ValueError(f"offset {offset} outside of the payload")
+        return bisect.bisect_right(self.offsets, offset) - 1
+
+    def check_chunk(self, src: Any, idx: int, buf: bytearray) -> bool:
+        chunk = self.chunks[idx]
+        size = chunk.chunk_size
+        off = self.offsets[idx]
+        mv = memoryview(buf)[:size]
+        try:
+            n = src.readinto_at(off, mv)
+        except (OSError, ValueError):
+            return False
+        # hashlib drops the GIL for big buffers so workers hash in parallel
+        return n == size and hashlib.sha256(mv).digest() == chunk.chunk_sha256
+
+    def verify(
+        self,
+        src: Any,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[VerifyStats], None]] = None,
+        max_inflight: Optional[int] = None,
+    ) -> VerifyStats:
+        src = FancyRawIOBase(src)
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_inflight is None:
+            max_inflight = 2 * workers
+        stats = VerifyStats(
+            total_chunks=len(self.chunks),
+            total_bytes=self.total_size,
+            src_size=src.size(),
+        )
+        max_chunk = max((c.chunk_size for c in self.chunks), default=0)
+        # one reusable read buffer per worker thread
+        local = threading.local()
+
+        def check(idx: int) -> bool:
+            buf = getattr(local, "buf", None)
+            if buf is None:
+                buf = local.buf = bytearray(max_chunk)
+            return self.check_chunk(src, idx, buf)
+
+        inflight: collections.deque[tuple[int, Future]] = collections.deque()
+        chunk_iter = iter(range(len(self.chunks)))
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                for idx in itertools.islice(chunk_iter, max_inflight - len(inflight)):
+                    inflight.append((idx, pool.submit(check, idx)))
+                if not inflight:
+                    break
+                # retired in order so the first failure is the first bad chunk
+                idx, fut = inflight.popleft()
+                if not fut.result():
+                    stats.bad_chunk = idx
+                    stats.bad_offset = self.offsets[idx]
+                    for _, pending in inflight:
+                        pending.cancel()
+                    break
+                stats.chunks += 1
+                stats.bytes_hashed += self.chunks[idx].chunk_size
+                if progress is not None:
+                    progress(stats)
+        stats.elapsed = time.perf_counter() - stats.start
+        return stats
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=program_name)
+    parser.add_argument("-v", "--verbose", action="store_true", help="be verbose")
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s version: {Version(_version.version)}",
+    )
+    subparsers = parser.add_subparsers(dest="cmd")
+    verify_parser = subparsers.add_parser(
+        "verify", help="verify a payload against its chunklist"
+    )
+    verify_parser.add_argument(
+        "chunklist", help="chunklist path or URL", metavar="CHUNKLIST"
+    )
+    verify_parser.add_argument("payload", help="payload path or URL", metavar="PAYLOAD")
+    verify_parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="hashing threads"
+    )
+    return parser
+
+
+def verify_main(args: argparse.Namespace) -> int:
+    def progress(stats: VerifyStats) -> None:
+        log.info(
+            f"{stats.chunks}/{stats.total_chunks} chunks "
+            f"{stats.bytes_hashed}/{stats.total_bytes} bytes "
+            f"{stats.throughput / (1024 * 1024):.1f} MiB/s"
+        )
+
+    with open_source(args.chunklist) as cl_fh:
+        chunklist = Chunklist.from_file(cl_fh)
+    with open_source(args.payload) as payload_fh:
+        stats = chunklist.verify(payload_fh, workers=args.jobs, progress=progress)
+    if stats.bad_chunk is not None:
+        print(f"bad chunk {stats.bad_chunk} at offset {stats.bad_offset}")
+        return 1
+    if not stats.ok:
+        print(f"payload is {stats.src_size} bytes, expected {stats.total_bytes}")
+        return 1
+    print(
+        f"verified {stats.chunks} chunks, {stats.bytes_hashed} bytes "
+        f"in {stats.elapsed:.3f}s ({stats.throughput / (1024 * 1024):.1f} MiB/s)"
+    )
+    return 0
+
+
+def real_main(args: argparse.Namespace) -> int:
+    verbose: Final[bool] = args.verbose
+    if verbose:
+        log.setLevel(logging.INFO)
+        log.info(f"{program_name}: verbose mode enabled")
+    if args.cmd == "verify":
+        return verify_main(args)
+    return 0
+
+
+def main() -> int:
+    try:
+        args = get_arg_parser().parse_args()
+        return real_main(args)
+    except Exception:
+        log.exception(f"Received an unexpected exception when running {program_name}")
+        return 1
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+import bisect
+import bz2
+import io
+import lzma
+import struct
+import zlib
+from typing import Callable, Final, Iterable, Iterator, Optional, Protocol, Self
+
+from attrs import define
+
+from .io_ext import ReadableBuffer, WritableBuffer
+
+try:
+    import liblzfse
+except ImportError:
+    liblzfse = None
+
+__all__ = [
+    "Checkpoint",
+    "DecompressingRawIO",
+    "Decompressor",
+    "ZlibDecompressor",
+    "adc_decompress",
+    "iter_decompress",
+    "lzfse_decompress",
+    "lzvn_decompress",
+    "new_decompressor",
+]
+
+
+class Decompressor(Protocol):
+    eof: bool
+    needs_input: bool
+    unused_data: bytes
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes: ...
+
+
+class PositionalSource(Protocol):
+    sz: int
+
+    def pread(self, offset: int, size: int) -> bytes: ...
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int: ...
+
+
+class ZlibDecompressor:
+    # zlib.decompressobj with the needs_input interface of bz2/lzma decompressors
+    def __init__(self, dec: Optional["zlib._Decompress"] = None) -> None:
+        self._dec = zlib.decompressobj() if dec is None else dec
+        self._drained = True
+
+    @property
+    def eof(self) -> bool:
+        return self._dec.eof
+
+    @property
+    def needs_input(self) -> bool:
+        return self._drained and not self._dec.unconsumed_tail
+
+    @property
+    def unused_data(self) -> bytes:
+        return self._dec.unused_data
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        if self._dec.unconsumed_tail:
+            data = self._dec.unconsumed_tail + data
+        max_length = max(max_length, 0)
+        out = self._dec.decompress(data, max_length)
+        # a full output buffer may leave output pending inside zlib
+        self._drained = max_length == 0 or len(out) < max_length
+        return out
+
+    def copy(self) -> Self:
+        dup = type(self)(self._dec.copy())
+        dup._drained = self._drained
+        return dup
+
+
+DECOMPRESSORS: Final[dict[str, Callable[[], Decompressor]]] = {
+    "zlib": ZlibDecompressor,
+    "gzip": lambda: ZlibDecompressor(zlib.decompressobj(zlib.MAX_WBITS | 16)),
+    "bzip2": bz2.BZ2Decompressor,
+    "lzma": lzma.LZMADecompressor,
+}
+
+
+def new_decompressor(codec: str) -> Decompressor:
+    try:
+        return DECOMPRESSORS[codec]()
+    except KeyError:
+        raise ValueError(f"unsupported codec: {codec}") from None
+
+
+def iter_decompress(
+    chunks: Iterable[bytes], codec: str, out_chunk_sz: int = 1024 * 1024
+) -> Iterator[bytes]:
+    # one-shot streaming decode, output is yielded in pieces of at most out_chunk_sz
+    dec = new_decompressor(codec)
+    for chunk in chunks:
+        data = chunk
+        while data or not dec.needs_input:
+            if dec.eof:
+                if not data:
+                    break
+                # concatenated streams
+                dec = new_decompressor(codec)
+            out = dec.decompress(data, out_chunk_sz)
+            data = dec.unused_data if dec.eof else b""
+            if out:
+                yield out
+    if not dec.eof:
+        raise ValueError("truncated compressed stream")
+
+
+@define
+class Checkpoint:
+    out_off: int
+    src_off: int
+    # None means a fresh decompressor starting a new stream at src_off
+    dec: Optional[Decompressor] = None
+
+
+class DecompressingRawIO(io.RawIOBase):
+    def __init__(
+        self,
+        src: PositionalSource,
+        size: int,
+        codec: Optional[str],
+        src_chunk_sz: int = 256 * 1024,
+        out_chunk_sz: int = 1024 * 1024,
+        checkpoint_interval: int = 8 * 1024 * 1024,
+        max_checkpoints: int = 64,
+    ) -> None:
+        super().__init__()
+        self.src = src
+        self.size = size
+        self.codec = codec
+        self.src_chunk_sz = src_chunk_sz
+        self.out_chunk_sz = out_chunk_sz
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints: list[Checkpoint] = [Checkpoint(0, 0)]
+        self._pos = 0
+        self._dec: Optional[Decompressor] = None
+        self._dec_off = 0
+        self._src_off = 0
+        self._pending = memoryview(b"")
+        self._pending_off = 0
+        self.restores = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self._pos = pos
+        return self._pos
+
+    def _restore(self, cp: Checkpoint) -> None:
+        self._dec = new_decompressor(self.codec) if cp.dec is None else cp.dec.copy()
+        self._dec_off = cp.out_off
+        self._src_off = cp.src_off
+        self._pending = memoryview(b"")
+        self._pending_off = cp.out_off
+        self.restores += 1
+
+    def _checkpoint_due(self) -> bool:
+        return self._dec_off - self.checkpoints[-1].out_off >= self.checkpoint_interval
+
+    def _add_checkpoint(self, dec: Optional[Decompressor]) -> None:
+        if self._dec_off <= self.checkpoints[-1].out_off:
+            return
+        self.checkpoints.append(Checkpoint(self._dec_off, self._src_off, dec))
+        if len(self.checkpoints) > self.max_checkpoints:
+            # thin out to keep checkpoint memory bounded on huge members
+            self.checkpoints = self.checkpoints[::2]
+            self.checkpoint_interval *= 2
+
+    def _position_decoder(self, pos: int) -> None:
+        idx = bisect.bisect_right([cp.out_off for cp in self.checkpoints], pos) - 1
+        cp = self.checkpoints[idx]
+        if self._dec is None or pos < self._dec_off or cp.out_off > self._dec_off:
+            self._restore(cp)
+
+    def _decode_block(self) -> bytes:
+        while True:
+            if self._dec.eof:
+                # concatenated streams (pbzip2, multi-stream xz) restart cleanly
+                self._src_off -= len(self._dec.unused_data)
+                if self._src_off >= self.src.sz or self._dec_off >= self.size:
+                    return b""
+                self._dec = new_decompressor(self.codec)
+                self._add_checkpoint(None)
+            data = b""
+            if self._dec.needs_input:
+                if self._src_off >= self.src.sz:
+                    raise ValueError("truncated compressed stream")
+                chunk_sz = min(self.src_chunk_sz, self.src.sz - self._src_off)
+                data = self.src.pread(self._src_off, chunk_sz)
+                self._src_off += len(data)
+            out = self._dec.decompress(data, self.out_chunk_sz)
+            self._dec_off += len(out)
+            copyable = hasattr(self._dec, "copy")
+            if copyable and self._dec.needs_input and self._checkpoint_due():
+                self._add_checkpoint(self._dec.copy())
+            if out:
+                return out
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        size = min(len(buf), self.size - self._pos)
+        if size <= 0:
+            return 0
+        if self.codec is None:
+            n = self.src.readinto_at(self._pos, memoryview(buf)[:size])
+            self._pos += n
+            return n
+        pend_idx = self._pos - self._pending_off
+        if not (0 <= pend_idx < len(self._pending)):
+            self._position_decoder(self._pos)
+            while True:
+                self._pending_off = self._dec_off
+                self._pending = memoryview(self._decode_block())
+                if not self._pending:
+                    raise ValueError("compressed stream ended early")
+                pend_idx = self._pos - self._pending_off
+                if pend_idx < len(self._pending):
+                    break
+        n = min(size, len(self._pending) - pend_idx)
+        memoryview(buf)[:n] = self._pending[pend_idx : pend_idx + n]
+        self._pos += n
+        return n
+
+
+def _copy_match(out: bytearray, dist: int, size: int) -> None:
+    start = len(out) - dist
+    if dist <= 0 or start < 0:
+        raise ValueError(f"invalid match distance {dist} at output offset {len(out)}")
+    if dist >= size:
+        out += out[start : start + size]
+    else:
+        # overlapping match repeats the last dist bytes
+        pattern = out[start:]
+        out += (pattern * (size // dist + 1))[:size]
+
+
+def adc_decompress(src: ReadableBuffer, out_sz: int) -> bytes:
+    # Apple Data Compression, used by old UDCO images
+    src = bytes(src)
+    out = bytearray()
+    pos = 0
+    while pos < len(src) and len(out) < out_sz:
+        op = src[pos]
+        if op & 0x80:
+            size = (op & 0x7F) + 1
+            out += src[pos + 1 : pos + 1 + size]
+            pos += 1 + size
+            continue
+        if op & 0x40:
+            size = (op & 0x3F) + 4
+            dist = (src[pos + 1] << 8 | src[pos + 2]) + 1
+            pos += 3
+        else:
+            size = ((op & 0x3F) >> 2) + 3
+            dist = ((op & 0x03) << 8 | src[pos + 1]) + 1
+            pos += 2
+        _copy_match(out, dist, size)
+    return bytes(out)
+
+
+def _lzvn_op_len(op: int) -> int:
+    # opcode plus operand bytes, literals excluded
+    hi, lo3 = op >> 4, op & 7
+    if hi in (0xE, 0xF):
+        return 2 if op & 0xF == 0 else 1
+    if hi in (0x7, 0xD) or lo3 == 6:
+        return 1
+    if hi in (0xA, 0xB) or lo3 == 7:
+        return 3
+    return 2
+
+
+_LZVN_OP_LEN: Final[bytes] = bytes(_lzvn_op_len(op) for op in range(256))
+
+
+def lzvn_decompress(src: ReadableBuffer, out_sz: int) -> bytes:
+    src = bytes(src)
+    out = bytearray()
+    pos = 0
+    dist = 0
+    # stop at the first op that overflows, a run of long matches would
+    # otherwise grow out far past out_sz
+    while pos < len(src) and len(out) <= out_sz:
+        op = src[pos]
+        if pos + _LZVN_OP_LEN[op] > len(src):
+            raise ValueError("truncated LZVN stream")
+        hi = op >> 4
+        lo3 = op & 7
+        if hi == 0xE:
+            # literals only
+            if op == 0xE0:
+                lit, pos = src[pos + 1] + 16, pos + 2
+            else:
+                lit, pos = op & 0xF, pos + 1
+            if pos + lit > len(src):
+                raise ValueError("truncated LZVN stream")
+            out += src[pos : pos + lit]
+            pos += lit
+            continue
+        if hi == 0xF:
+            # match with the previous distance only
+            if op == 0xF0:
+                size, pos = src[pos + 1] + 16, pos + 2
+            else:
+                size, pos = op & 0xF, pos + 1
+            _copy_match(out, dist, size)
+            continue
+        if hi in (0xA, 0xB):
+            lit = (op >> 3) & 3
+            opc23 = src[pos + 1] | src[pos + 2] << 8
+            size = ((op & 7) << 2 | (opc23 & 3)) + 3
+            dist = opc23 >> 2
+            pos += 3
+        elif hi in (0x7, 0xD):
+            raise ValueError(f"invalid LZVN opcode {op:#04x} at {pos}")
+        elif lo3 == 7:
+            lit = op >> 6
+            size = ((op >> 3) & 7) + 3
+            dist = src[pos + 1] | src[pos + 2] << 8
+            pos += 3
+        elif lo3 == 6:
+            if op < 0x40:
+                if op == 0x06:
+                    break
+                if op in (0x0E, 0x16):
+                    pos += 1
+                    continue
+                raise ValueError(f"invalid LZVN opcode {op:#04x} at {pos}")
+            lit = op >> 6
+            size = ((op >> 3) & 7) + 3
+            pos += 1
+        else:
+            lit = op >> 6
+            size = ((op >> 3) & 7) + 3
+            dist = lo3 << 8 | src[pos + 1]
+            pos += 2
+        if pos + lit > len(src):
+            raise ValueError("truncated LZVN stream")
+        out += src[pos : pos + lit]
+        pos += lit
+        _copy_match(out, dist, size)
+    if len(out) > out_sz:
+        raise ValueError(f"LZVN output overflow: {len(out)} > {out_sz}")
+    return bytes(out)
+
+
+LZFSE_ENDOFSTREAM_MAGIC: Final[bytes] = b"bvx$"
+LZFSE_UNCOMPRESSED_MAGIC: Final[bytes] = b"bvx-"
+LZFSE_LZVN_MAGIC: Final[bytes] = b"bvxn"
+
+
+def lzfse_decompress(src: ReadableBuffer, out_sz: int) -> bytes:
+    if liblzfse is not None:
+        return liblzfse.decompress(bytes(src))
+    # without liblzfse only the raw and LZVN block types can be decoded
+    src = memoryview(src)
+    out = bytearray()
+    pos = 0
+    while pos + 4 <= len(src):
+        magic = bytes(src[pos : pos + 4])
+        if magic == LZFSE_ENDOFSTREAM_MAGIC:
+            return bytes(out)
+        if magic == LZFSE_UNCOMPRESSED_MAGIC:
+            (n_raw,) = struct.unpack_from("<I", src, pos + 4)
+            out += src[pos + 8 : pos + 8 + n_raw]
+            pos += 8 + n_raw
+        elif magic == LZFSE_LZVN_MAGIC:
+            n_raw, n_payload = struct.unpack_from("<II", src, pos + 4)
+            payload = src[pos + 12 : pos + 12 + n_payload]
+            out += lzvn_decompress(payload, n_raw)
+            pos += 12 + n_payload
+        elif magic in (b"bvx1", b"bvx2"):
+            raise ValueError(
+                "LZFSE entropy coded blocks need the pyliblzfse package "
+                "(pip install fruitsu[lzfse])"
+            )
+        else:
+            raise ValueError(f"bad LZFSE block magic {magic!r} at {pos}")
+    raise ValueError("truncated LZFSE stream")
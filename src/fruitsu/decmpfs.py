@@ -0,0 +1,269 @@
+import collections
+import enum
+import io
+import struct
+import threading
+import zlib
+from typing import Any, Final, Optional, Self
+
+from attrs import define, field
+from construct import Const, Int32ul, Int64ul, Struct
+
+from .compression import lzfse_decompress, lzvn_decompress
+from .fast_struct import FastStruct
+from .io_ext import (
+    BlockCacheStats,
+    ReadableBuffer,
+    SeekContextIOBaseMixin,
+    SubscriptedIOBaseMixin,
+    WritableBuffer,
+)
+
+__all__ = [
+    "DECMPFS_CHUNK_SZ",
+    "DECMPFS_XATTR_NAME",
+    "UF_COMPRESSED",
+    "DecmpfsFile",
+    "DecmpfsHeader",
+    "DecmpfsHeaderFast",
+    "DecmpfsType",
+    "decode_decmpfs_chunk",
+]
+
+DECMPFS_XATTR_NAME: Final[str] = "com.apple.decmpfs"
+DECMPFS_CHUNK_SZ: Final[int] = 64 * 1024
+
+# st_flags bit set on files with a decmpfs xattr
+UF_COMPRESSED: Final[int] = 0x20
+
+DecmpfsHeader = Struct(
+    "compression_magic" / Const(b"fpmc"),
+    "compression_type" / Int32ul,
+    "uncompressed_size" / Int64ul,
+)
+
+DecmpfsHeaderFast: Final[FastStruct] = FastStruct(DecmpfsHeader)
+
+
+class DecmpfsType(enum.IntEnum):
+    raw_xattr = 1
+    zlib_xattr = 3
+    zlib_rsrc = 4
+    lzvn_xattr = 7
+    lzvn_rsrc = 8
+    raw_xattr_alt = 9
+    raw_rsrc = 10
+    lzfse_xattr = 11
+    lzfse_rsrc = 12
+
+
+DECMPFS_CODECS: Final[dict[DecmpfsType, str]] = {
+    DecmpfsType.raw_xattr: "raw",
+    DecmpfsType.zlib_xattr: "zlib",
+    DecmpfsType.zlib_rsrc: "zlib",
+    DecmpfsType.lzvn_xattr: "lzvn",
+    DecmpfsType.lzvn_rsrc: "lzvn",
+    DecmpfsType.raw_xattr_alt: "raw",
+    DecmpfsType.raw_rsrc: "raw",
+    DecmpfsType.lzfse_xattr: "lzfse",
+    DecmpfsType.lzfse_rsrc: "lzfse",
+}
+
+DECMPFS_RSRC_TYPES: Final[frozenset[DecmpfsType]] = frozenset(
+    (
+        DecmpfsType.zlib_rsrc,
+        DecmpfsType.lzvn_rsrc,
+        DecmpfsType.raw_rsrc,
+        DecmpfsType.lzfse_rsrc,
+    )
+)
+
+_U32BE: Final[struct.Struct] = struct.Struct(">I")
+_U32LE: Final[struct.Struct] = struct.Struct("<I")
+
+
+def decode_decmpfs_chunk(codec: str, src: ReadableBuffer, out_sz: int) -> bytes:
+    # every codec has a marker byte for chunks that didn't compress
+    src = bytes(src)
+    if codec == "raw":
+        out = src
+    elif codec == "zlib":
+        out = src[1:] if src[:1] and src[0] & 0x0F == 0x0F else zlib.decompress(src)
+    elif codec == "lzvn":
+        out = src[1:] if src[:1] == b"\x06" else lzvn_decompress(src, out_sz)
+    elif codec == "lzfse":
+        out = src[1:] if src[:1] == b"\xff" else lzfse_decompress(src, out_sz)
+    else:
+        raise ValueError(f"unsupported decmpfs codec: {codec}")
+    if len(out) != out_sz:
+        raise ValueError(f"decmpfs chunk decoded to {len(out)} bytes not {out_sz}")
+    return out
+
+
+def _zlib_rsrc_table(rsrc: Any) -> list[tuple[int, int]]:
+    # resource fork with one 'cmpf' resource: a block count then
+    # (offset, size) pairs relative to the start of the block table
+    (data_off,) = _U32BE.unpack(rsrc.pread(0, 4))
+    tbl_off = data_off + 4
+    (count,) = _U32LE.unpack(rsrc.pread(tbl_off, 4))
+    tbl = rsrc.pread(tbl_off + 4, 8 * count)
+    return [(tbl_off + off, sz) for off, sz in struct.iter_unpack("<II", tbl)]
+
+
+def _offset_rsrc_table(rsrc: Any) -> list[tuple[int, int]]:
+    # chunk start offsets with the end of the last chunk, the first entry is
+    # the size of the table itself
+    (first,) = _U32LE.unpack(rsrc.pread(0, 4))
+    offs = [o for (o,) in _U32LE.iter_unpack(rsrc.pread(0, first))]
+    return [(start, end - start) for start, end in zip(offs, offs[1:])]
+
+
+@define
+class DecmpfsFile(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
+    # decompressed view of a decmpfs file, decoding only the 64 KiB chunks
+    # that are touched
+    codec: Final[str]
+    sz: Final[int]
+    # compressed payload inline in the xattr, or None when in the resource fork
+    inline: Final[Optional[bytes]]
+    rsrc: Final[Any] = None
+    cache_max_bytes: Final[int] = 8 * 1024 * 1024
+    blksz: Final[int] = 1
+    stats: Final[BlockCacheStats] = field(init=False, factory=BlockCacheStats)
+    # (source offset, source size) of each chunk in the resource fork
+    _table: list[tuple[int, int]] = field(init=False, factory=list)
+    _chunks: Final[collections.OrderedDict[int, bytes]] = field(
+        init=False, factory=collections.OrderedDict
+    )
+    _cur_bytes: int = field(init=False, default=0)
+    _idx: int = field(init=False, default=0)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        if self.inline is not None:
+            return
+        if self.rsrc is None:
+            raise ValueError("decmpfs resource fork compression needs the fork")
+        if self.sz == 0:
+            return
+        if self.codec == "zlib":
+            self._table = _zlib_rsrc_table(self.rsrc)
+        else:
+            self._table = _offset_rsrc_table(self.rsrc)
+        need = -(-self.sz // DECMPFS_CHUNK_SZ)
+        if len(self._table) < need:
+            raise ValueError(
+                f"decmpfs chunk table has {len(self._table)} entries, need {need}"
+            )
+
+    @classmethod
+    def from_xattr(cls, xattr: ReadableBuffer, rsrc: Any = None, **kwargs: Any) -> Self:
+        hdr = DecmpfsHeaderFast.parse(xattr)
+        try:
+            cmp_type = DecmpfsType(hdr.compression_type)
+        except ValueError:
+            raise ValueError(
+                f"unsupported decmpfs compression type {hdr.compression_type}"
+            ) from None
+        inline = None
+        if cmp_type not in DECMPFS_RSRC_TYPES:
+            inline = bytes(xattr[DecmpfsHeaderFast.fixed_sz :])
+        return cls(
+            DECMPFS_CODECS[cmp_type], hdr.uncompressed_size, inline, rsrc, **kwargs
+        )
+
+    @property
+    def num_chunks(self) -> int:
+        if self.inline is not None:
+            return 1
+        return -(-self.sz // DECMPFS_CHUNK_SZ)
+
+    def size(self) -> int:
+        return self.sz
+
+    def _chunk(self, idx: int) -> bytes:
+        with self._lock:
+            buf = self._chunks.get(idx)
+            if buf is not None:
+                self._chunks.move_to_end(idx)
+                self.stats.hits += 1
+                return buf
+            self.stats.misses += 1
+        if self.inline is not None:
+            src = self.inline
+            out_sz = self.sz
+        else:
+            off, src_sz = self._table[idx]
+            src = self.rsrc.pread(off, src_sz)
+            if len(src) != src_sz:
+                raise OSError(f"short read: wanted {src_sz} bytes got {len(src)}")
+            out_sz = min(DECMPFS_CHUNK_SZ, self.sz - idx * DECMPFS_CHUNK_SZ)
+        buf = decode_decmpfs_chunk(self.codec, src, out_sz)
+        with self._lock:
+            self.stats.fetches += 1
+            self.stats.fetched_bytes += len(src)
+            if out_sz <= self.cache_max_bytes and idx not in self._chunks:
+                self._chunks[idx] = buf
+                self._cur_bytes += len(buf)
+                while self._cur_bytes > self.cache_max_bytes:
+                    _, old = self._chunks.popitem(last=False)
+                    self._cur_bytes -= len(old)
+                    self.stats.evictions += 1
+        return buf
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        if offset < 0:
+            raise ValueError("negative offset")
+        out = memoryview(buf).cast("B")
+        end = min(offset + len(out), self.sz)
+        chunk_sz = self.sz if self.inline is not None else DECMPFS_CHUNK_SZ
+        pos = offset
+        while pos < end:
+            idx = pos // chunk_sz
+            coff = pos - idx * chunk_sz
+            n = min(chunk_sz - coff, end - pos)
+            out[pos - offset : pos - offset + n] = self._chunk(idx)[coff : coff + n]
+            pos += n
+        return max(end - offset, 0)
+
+    def pread(self, offset: int, size: int) -> bytes:
+        if offset < 0 or size < 0 or offset + size > self.sz:
+            raise ValueError("out of bounds size")
+        buf = bytearray(size)
+        self.readinto_at(offset, buf)
+        return bytes(buf)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.sz - self._idx
+        buf = self.pread(self._idx, max(min(size, self.sz - self._idx), 0))
+        self._idx += len(buf)
+        return buf
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, buf)
+        self._idx += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
+        elif whence == io.SEEK_END:
+            idx = self.sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if idx < 0:
+            raise ValueError("negative seek position")
+        self._idx = idx
+        return self._idx
+
+    def tell(self) -> int:
+        return self._idx
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
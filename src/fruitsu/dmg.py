@@ -1,22 +1,57 @@
 #!/usr/bin/env python3
 
 import argparse
+import bisect
+import bz2
+import collections
+import contextlib
+import functools
 import io
+import json
 import logging
-import mmap
+import lzma
+import multiprocessing.util
+import os
 import plistlib
 import sys
+import threading
+import time
 import zlib
-from ctypes import c_uint8, memset
-from typing import IO, Final
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Container,
+    Final,
+    Iterable,
+    Iterator,
+    Optional,
+    Self,
+)
 
 import attr
+from attrs import define, field
 from construct import Bytes, Const, Enum, Int32ub, Int64ub, Struct, this
 from packaging.version import Version
 from rich.console import Console
 from rich.logging import RichHandler
 
 from . import _version
+from .compression import adc_decompress, lzfse_decompress
+from .fast_struct import FastStruct
+from .index_cache import IndexCache, IndexEntry, index_key, source_stamp
+from .io_ext import (
+    BlockCacheStats,
+    FancyRawIOBase,
+    MmapRawIOBase,
+    OffsetRawIOBase,
+    ReadableBuffer,
+    SeekContextIOBaseMixin,
+    SubscriptedIOBaseMixin,
+    WritableBuffer,
+    open_source,
+    pwrite_all,
+)
 
 LOG_FORMAT = "%(message)s"
 logging.basicConfig(
@@ -103,96 +138,522 @@ BLKXTable = Struct(
     "block_chunks" / BLKXChunkEntry[this.num_block_chunks],
 )
 
-assert UDIFResourceFile.sizeof() == 512
+BLKXTableFast: Final[FastStruct] = FastStruct(BLKXTable)
+
+UDIF_TRAILER_SZ: Final[int] = 512
+
+assert UDIFResourceFile.sizeof() == UDIF_TRAILER_SZ
+
+
+@define
+class DMGMetadata:
+    hdr: Final[Container[Any]]
+    plist: Final[dict[str, Any]]
+    blkx_tables: Final[list[Container[Any]]]
+
+    @classmethod
+    def from_plist(cls, hdr: Container[Any], plist: dict[str, Any]) -> Self:
+        blkx_tables = []
+        for blk_info in plist["resource-fork"]["blkx"]:
+            blk_data = blk_info["Data"]
+            assert len(blk_data) >= 4 and blk_data[:4] == b"mish"
+            blkx_tables.append(BLKXTableFast.parse(blk_data))
+        return cls(hdr, plist, blkx_tables)
+
+    @classmethod
+    def from_buffers(cls, trailer_buf: bytes, plist_buf: bytes) -> Self:
+        hdr = UDIFResourceFile.parse(trailer_buf)
+        return cls.from_plist(hdr, plistlib.loads(plist_buf))
+
+    @classmethod
+    def from_file(cls, fh, index_cache: Optional[IndexCache] = None) -> Self:
+        # only positional reads, so remote and nested sources work too
+        fh = FancyRawIOBase(fh)
+        sz = fh.size()
+        if sz < UDIF_TRAILER_SZ:
+            raise ValueError(f"too small for a UDIF image: {sz} bytes")
+        trailer_buf = bytes(fh.pread(sz - UDIF_TRAILER_SZ, UDIF_TRAILER_SZ))
+        key = None
+        if index_cache is not None and (stamp := source_stamp(fh)) is not None:
+            # the trailer carries both the data fork and master checksums
+            key = index_key(b"dmg", sz, stamp, trailer_buf)
+            if (entry := index_cache.load(key)) is not None:
+                return cls.from_index(entry)
+        hdr = UDIFResourceFile.parse(trailer_buf)
+        plist_buf = bytes(fh.pread(hdr.plist_off, hdr.plist_sz))
+        meta = cls.from_buffers(trailer_buf, plist_buf)
+        if key is not None:
+            try:
+                sections = meta.to_index()
+            except TypeError as e:
+                log.info(f"not caching DMG index: {e}")
+            else:
+                index_cache.store(key, sections)
+        return meta
+
+    def to_index(self) -> list[bytes]:
+        # binary blobs (the mish tables) go in a flat section, the rest of the
+        # plist is a small JSON manifest referencing them by offset
+        blobs: list[bytes] = []
+        blob_off = 0
+
+        def encode(obj: Any) -> Any:
+            nonlocal blob_off
+            if isinstance(obj, bytes):
+                ref = {"$data": [blob_off, len(obj)]}
+                blobs.append(obj)
+                blob_off += len(obj)
+                return ref
+            if isinstance(obj, dict):
+                return {k: encode(v) for k, v in obj.items()}
+            if isinstance(obj, list):
+                return [encode(v) for v in obj]
+            if obj is None or isinstance(obj, (str, int, float, bool)):
+                return obj
+            raise TypeError(f"unsupported plist value type: {type(obj).__name__}")
+
+        manifest = json.dumps(encode(self.plist), separators=(",", ":")).encode()
+        return [UDIFResourceFile.build(self.hdr), manifest, b"".join(blobs)]
+
+    @classmethod
+    def from_index(cls, entry: IndexEntry) -> Self:
+        trailer_buf, manifest_buf, blob = entry.sections
+
+        def decode(obj: Any) -> Any:
+            if isinstance(obj, dict):
+                if len(obj) == 1 and "$data" in obj:
+                    off, sz = obj["$data"]
+                    return bytes(blob[off : off + sz])
+                return {k: decode(v) for k, v in obj.items()}
+            if isinstance(obj, list):
+                return [decode(v) for v in obj]
+            return obj
+
+        plist = decode(json.loads(bytes(manifest_buf)))
+        return cls.from_plist(UDIFResourceFile.parse(trailer_buf), plist)
+
+    @classmethod
+    async def from_async(cls, afh) -> Self:
+        trailer_buf = await afh.pread(afh.sz - UDIF_TRAILER_SZ, UDIF_TRAILER_SZ)
+        hdr = UDIFResourceFile.parse(trailer_buf)
+        plist_buf = await afh.pread(hdr.plist_off, hdr.plist_sz)
+        return cls.from_buffers(trailer_buf, plist_buf)
+
+
+HOLE_CHUNK_TYPES: Final[frozenset[str]] = frozenset(("zero", "ignore"))
+SKIP_CHUNK_TYPES: Final[frozenset[str]] = frozenset(("comment", "terminator"))
+RAW_COPY_SZ: Final[int] = 1024 * 1024
+
+
+@define(frozen=True)
+class ChunkRun:
+    type: str
+    out_off: int
+    out_sz: int
+    in_off: int
+    in_sz: int
+
+
+def iter_chunk_runs(
+    meta: DMGMetadata,
+    blkx_tables: Optional[Iterable[Container[Any]]] = None,
+    base_sector: int = 0,
+) -> Iterator[ChunkRun]:
+    data_fork_off = meta.hdr.data_fork_off
+    for table in meta.blkx_tables if blkx_tables is None else blkx_tables:
+        table_sector = table.sector_num - base_sector
+        in_base = data_fork_off + table.data_off
+        for chunk in table.block_chunks:
+            ty = str(chunk.entry_type)
+            if ty in SKIP_CHUNK_TYPES:
+                continue
+            yield ChunkRun(
+                ty,
+                (table_sector + chunk.sector_num) * SECTOR_SIZE,
+                chunk.sector_count * SECTOR_SIZE,
+                in_base + chunk.compressed_off,
+                chunk.compressed_sz,
+            )
+
+
+def decode_chunk(chunk_type: str, src: ReadableBuffer, out_sz: int) -> bytes:
+    if chunk_type == "zlib":
+        out = zlib.decompress(src, bufsize=out_sz)
+    elif chunk_type == "lzfse":
+        out = lzfse_decompress(src, out_sz)
+    elif chunk_type == "lzma":
+        out = lzma.decompress(src)
+    elif chunk_type == "bzip2":
+        out = bz2.decompress(src)
+    elif chunk_type == "adc":
+        out = adc_decompress(src, out_sz)
+    elif chunk_type == "raw":
+        out = bytes(src)
+    elif chunk_type in HOLE_CHUNK_TYPES:
+        return bytes(out_sz)
+    else:
+        raise ValueError(f"unsupported UDIF chunk type: {chunk_type}")
+    if len(out) != out_sz:
+        raise ValueError(
+            f"{chunk_type} chunk decoded to {len(out)} bytes, expected {out_sz}"
+        )
+    return out
+
+
+@define
+class ConvertStats:
+    chunks: int = 0
+    total_bytes: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    hole_bytes: int = 0
+    start: float = field(factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        # logical image bytes per second, holes included
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        done = self.bytes_out + self.hole_bytes
+        return done / elapsed if elapsed > 0 else 0.0
+
+
+@functools.lru_cache(maxsize=4)
+def _zeros(size: int) -> bytes:
+    # chunks are nearly all the same size so the comparison buffer is reused
+    return bytes(size)
+
+
+def _write_run(src, fd: int, run: ChunkRun) -> bool:
+    # returns False when nothing was written and the run stays a hole
+    if run.type in HOLE_CHUNK_TYPES:
+        return False
+    if run.type == "raw":
+        # copied in pieces so huge raw runs don't need a huge buffer
+        for off in range(0, run.out_sz, RAW_COPY_SZ):
+            piece = src.pread(run.in_off + off, min(RAW_COPY_SZ, run.out_sz - off))
+            pwrite_all(fd, piece, run.out_off + off)
+        return True
+    out = decode_chunk(run.type, src.pread(run.in_off, run.in_sz), run.out_sz)
+    if out == _zeros(len(out)):
+        return False
+    pwrite_all(fd, out, run.out_off)
+    return True
+
+
+_worker_src: Optional[MmapRawIOBase] = None
+_worker_fd: int = -1
+
+
+def _convert_worker_init(src_path: str, out_path: str) -> None:
+    global _worker_src, _worker_fd
+    # each worker maps the DMG and opens the target itself so only the run
+    # descriptors cross the process boundary
+    stack = contextlib.ExitStack()
+    # only mapped, so no buffered reader on top
+    src_fh = stack.enter_context(io.FileIO(src_path))
+    _worker_src = MmapRawIOBase(src_fh)
+    stack.callback(_worker_src.close)
+    _worker_fd = os.open(out_path, os.O_WRONLY)
+    stack.callback(os.close, _worker_fd)
+    # pool workers leave through os._exit after multiprocessing's own exit
+    # hooks, atexit handlers never run there
+    multiprocessing.util.Finalize(None, stack.close, exitpriority=0)
+
+
+def _convert_worker(runs: list[ChunkRun]) -> list[bool]:
+    return [_write_run(_worker_src, _worker_fd, run) for run in runs]
+
+
+def _iter_batches(runs: Iterable[ChunkRun], max_sz: int) -> Iterator[list[ChunkRun]]:
+    batch: list[ChunkRun] = []
+    batch_sz = 0
+    for run in runs:
+        if run.type in HOLE_CHUNK_TYPES:
+            continue
+        batch.append(run)
+        batch_sz += run.out_sz
+        if batch_sz >= max_sz:
+            yield batch
+            batch, batch_sz = [], 0
+    if batch:
+        yield batch
+
+
+def convert_image(
+    meta: DMGMetadata,
+    src,
+    out_path: str | os.PathLike,
+    blkx_tables: Optional[list[Container[Any]]] = None,
+    progress: Optional[Callable[[ConvertStats], None]] = None,
+    workers: Optional[int] = 1,
+    src_path: Optional[str | os.PathLike] = None,
+    batch_sz: int = 8 * 1024 * 1024,
+    max_inflight_bytes: int = 256 * 1024 * 1024,
+) -> ConvertStats:
+    tables = meta.blkx_tables if blkx_tables is None else blkx_tables
+    base_sector = min(t.sector_num for t in tables)
+    end_sector = max(t.sector_num + t.sector_count for t in tables)
+    stats = ConvertStats(total_bytes=(end_sector - base_sector) * SECTOR_SIZE)
+    runs = list(iter_chunk_runs(meta, tables, base_sector))
+    stats.chunks = len(runs)
+    for run in runs:
+        if run.type in HOLE_CHUNK_TYPES:
+            stats.hole_bytes += run.out_sz
+
+    def account(batch: list[ChunkRun], written: list[bool]) -> None:
+        for run, wrote in zip(batch, written):
+            stats.bytes_in += run.in_sz
+            if wrote:
+                stats.bytes_out += run.out_sz
+            else:
+                stats.hole_bytes += run.out_sz
+        if progress is not None:
+            progress(stats)
+
+    fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # sized up front so zero/ignore runs are left as holes
+        os.ftruncate(fd, stats.total_bytes)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1 or src_path is None:
+            for batch in _iter_batches(runs, batch_sz):
+                account(batch, [_write_run(src, fd, run) for run in batch])
+        else:
+            initargs = (os.fspath(src_path), os.fspath(out_path))
+            with ProcessPoolExecutor(
+                workers, initializer=_convert_worker_init, initargs=initargs
+            ) as pool:
+                inflight: collections.deque[tuple[Future, list[ChunkRun], int]] = (
+                    collections.deque()
+                )
+                inflight_bytes = 0
+                for batch in _iter_batches(runs, batch_sz):
+                    batch_out = sum(run.out_sz for run in batch)
+                    # bounds both queued work and decompressed data in workers
+                    while inflight and inflight_bytes + batch_out > max_inflight_bytes:
+                        fut, done_batch, done_sz = inflight.popleft()
+                        account(done_batch, fut.result())
+                        inflight_bytes -= done_sz
+                    inflight.append(
+                        (pool.submit(_convert_worker, batch), batch, batch_out)
+                    )
+                    inflight_bytes += batch_out
+                while inflight:
+                    fut, done_batch, _ = inflight.popleft()
+                    account(done_batch, fut.result())
+    finally:
+        os.close(fd)
+    stats.elapsed = time.perf_counter() - stats.start
+    return stats
+
+
+@define
+class DMGBlockDevice(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
+    # random access view of the logical disk, decoding only the chunks touched
+    src: Final[Any]
+    meta: Final[DMGMetadata]
+    cache_max_bytes: Final[int] = 64 * 1024 * 1024
+    blksz: Final[int] = SECTOR_SIZE
+    sz: Final[int] = field(init=False)
+    stats: Final[BlockCacheStats] = field(init=False, factory=BlockCacheStats)
+    _runs: Final[list[ChunkRun]] = field(init=False)
+    _run_offs: Final[list[int]] = field(init=False)
+    _chunks: Final[collections.OrderedDict[int, bytes]] = field(
+        init=False, factory=collections.OrderedDict
+    )
+    _cur_bytes: int = field(init=False, default=0)
+    _idx: int = field(init=False, default=0)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        self._runs = sorted(iter_chunk_runs(self.meta), key=lambda r: r.out_off)
+        self._run_offs = [run.out_off for run in self._runs]
+        self.sz = self.meta.hdr.sector_count * SECTOR_SIZE
+
+    def size(self) -> int:
+        return self.sz
+
+    def _chunk(self, run_idx: int) -> bytes:
+        with self._lock:
+            buf = self._chunks.get(run_idx)
+            if buf is not None:
+                self._chunks.move_to_end(run_idx)
+                self.stats.hits += 1
+                return buf
+            self.stats.misses += 1
+        run = self._runs[run_idx]
+        src = self.src.pread(run.in_off, run.in_sz)
+        if len(src) != run.in_sz:
+            raise OSError(f"short read: wanted {run.in_sz} bytes got {len(src)}")
+        buf = decode_chunk(run.type, src, run.out_sz)
+        with self._lock:
+            self.stats.fetches += 1
+            self.stats.fetched_bytes += run.in_sz
+            if run.out_sz <= self.cache_max_bytes and run_idx not in self._chunks:
+                self._chunks[run_idx] = buf
+                self._cur_bytes += len(buf)
+                while self._cur_bytes > self.cache_max_bytes:
+                    _, old = self._chunks.popitem(last=False)
+                    self._cur_bytes -= len(old)
+                    self.stats.evictions += 1
+        return buf
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        if offset < 0:
+            raise ValueError("negative offset")
+        out = memoryview(buf).cast("B")
+        end = min(offset + len(out), self.sz)
+        pos = offset
+        run_idx = max(bisect.bisect_right(self._run_offs, pos) - 1, 0)
+        while pos < end:
+            run = self._runs[run_idx] if run_idx < len(self._runs) else None
+            if run is None or pos < run.out_off:
+                # gaps between tables read as zeros
+                gap_end = end if run is None else min(run.out_off, end)
+                out[pos - offset : gap_end - offset] = bytes(gap_end - pos)
+                pos = gap_end
+                continue
+            run_end = run.out_off + run.out_sz
+            if pos >= run_end:
+                run_idx += 1
+                continue
+            n = min(run_end, end) - pos
+            dst = out[pos - offset : pos - offset + n]
+            roff = pos - run.out_off
+            if run.type in HOLE_CHUNK_TYPES:
+                dst[:] = bytes(n)
+            elif run.type == "raw":
+                # stored chunks are read straight from the source, never cached
+                src = self.src.pread(run.in_off + roff, n)
+                if len(src) != n:
+                    raise OSError(f"short read: wanted {n} bytes got {len(src)}")
+                dst[:] = src
+            else:
+                dst[:] = self._chunk(run_idx)[roff : roff + n]
+            pos += n
+            run_idx += 1
+        return max(end - offset, 0)
+
+    def pread(self, offset: int, size: int) -> bytes:
+        if offset < 0 or size < 0 or offset + size > self.sz:
+            raise ValueError("out of bounds size")
+        buf = bytearray(size)
+        self.readinto_at(offset, buf)
+        return bytes(buf)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.sz - self._idx
+        buf = self.pread(self._idx, max(min(size, self.sz - self._idx), 0))
+        self._idx += len(buf)
+        return buf
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, buf)
+        self._idx += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
+        elif whence == io.SEEK_END:
+            idx = self.sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if idx < 0:
+            raise ValueError("negative seek position")
+        self._idx = idx
+        return self._idx
+
+    def tell(self) -> int:
+        return self._idx
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def partition(self, idx: int) -> OffsetRawIOBase:
+        table = self.meta.blkx_tables[idx]
+        return OffsetRawIOBase(
+            self,
+            table.sector_num * SECTOR_SIZE,
+            table.sector_count * SECTOR_SIZE,
+            SECTOR_SIZE,
+        )
 
 
 @attr.s
 class DMG:
-    fh: IO[bytes] = attr.ib()
-    buf: bytes = attr.ib(init=False)
+    fh: FancyRawIOBase = attr.ib(converter=FancyRawIOBase)
+    src: Any = attr.ib(init=False)
     sz: Final[int] = attr.ib(init=False)
+    meta: DMGMetadata = attr.ib(init=False)
+    index_cache: Optional[IndexCache] = attr.ib(default=None, kw_only=True)
 
     def __attrs_post_init__(self):
-        self.fh.seek(0, io.SEEK_END)
-        self.sz = self.fh.tell()
-        self.sz = 0
-        self.fh.seek(0, io.SEEK_SET)
-        self.buf = mmap.mmap(
-            self.fh.fileno(), self.sz, mmap.MAP_PRIVATE, mmap.PROT_READ
+        # local files are mapped, anything else is read through pread
+        if self.fh._fileno() is not None:
+            self.src = MmapRawIOBase(self.fh)
+        else:
+            self.src = self.fh
+        self.sz = self.fh.size()
+        self.meta = DMGMetadata.from_file(self.fh, self.index_cache)
+
+    @property
+    def partition_names(self) -> list[str]:
+        return [
+            blk_info.get("Name") or blk_info.get("CFName", "")
+            for blk_info in self.meta.plist["resource-fork"]["blkx"]
+        ]
+
+    def convert(
+        self,
+        out_path: str | os.PathLike,
+        progress: Optional[Callable[[ConvertStats], None]] = None,
+        workers: Optional[int] = 1,
+        **kwargs,
+    ) -> ConvertStats:
+        # the process pool needs a path the workers can map themselves
+        src_path = getattr(self.fh, "name", None)
+        if self.fh._fileno() is None or not isinstance(
+            src_path, (str, bytes, os.PathLike)
+        ):
+            src_path = None
+        return convert_image(
+            self.meta,
+            self.src,
+            out_path,
+            progress=progress,
+            workers=workers,
+            src_path=src_path,
+            **kwargs,
         )
 
-    def dump(self):
+    def block_device(self, cache_max_bytes: int = 64 * 1024 * 1024) -> DMGBlockDevice:
+        return DMGBlockDevice(self.src, self.meta, cache_max_bytes)
+
+    def partition(self, idx: int, **kwargs) -> OffsetRawIOBase:
+        return self.block_device(**kwargs).partition(idx)
+
+    def dump(self, out_dir: Optional[str | os.PathLike] = None) -> None:
+        # images of each blkx table and the whole disk only go to out_dir
         print(f"dumping: {self}")
-        self.fh.seek(-512, io.SEEK_END)
-        buf = self.fh.read(512)
         print(f"UDIFResourceFile sz: {UDIFResourceFile.sizeof()}")
-        print(f"buf: {buf.hex()}")
-        hdr = UDIFResourceFile.parse(buf)
-        print(f"hdr: {hdr}")
-        self.fh.seek(hdr.plist_off, io.SEEK_SET)
-        plist_buf = self.fh.read(hdr.plist_sz)
-        plist_str = plist_buf.decode()
-        print(f"plist_str: {plist_str}")
-        plist = plistlib.loads(plist_buf)
-        # print(f'plist: {plist}')
-        dmg_sz = hdr.sector_count * SECTOR_SIZE
-        with mmap.mmap(-1, dmg_sz) as dmg_wbuf:
-            dmg_mmty = c_uint8 * dmg_sz
-            dmg_ptr = dmg_mmty.from_buffer(dmg_wbuf)
-            memset(dmg_ptr, ord("Z"), dmg_sz)
-            del dmg_ptr
-            for blk_idx, blk_info in enumerate(plist["resource-fork"]["blkx"]):
-                blk_data = blk_info["Data"]
-                assert len(blk_data) >= 4 and blk_data[:4] == b"mish"
-                blkx_table = BLKXTable.parse(blk_data)
-                print(f"blkx_table: {blkx_table}")
-                part_sz = blkx_table.sector_count * SECTOR_SIZE
-                with mmap.mmap(-1, part_sz) as mm:
-                    mmty = c_uint8 * part_sz
-                    ptr = mmty.from_buffer(mm)
-                    memset(ptr, ord("U"), part_sz)
-                    del ptr
-                    for chunk in blkx_table.block_chunks:
-                        print(f"chunk: {chunk}")
-                        sn = chunk.sector_num
-                        sc = chunk.sector_count
-                        sz = sc * SECTOR_SIZE
-                        off = sn * SECTOR_SIZE
-                        coff = chunk.compressed_off
-                        csz = chunk.compressed_sz
-                        cty = chunk.entry_type
-                        roff = blkx_table.sector_num * SECTOR_SIZE + off
-                        scratch = b"X" * sz
-                        mm[off : off + sz] = scratch
-                        dmg_wbuf[off : off + sz] = scratch
-                        if cty == BLKXChunkEntryType.ignore:
-                            # mm[off:off + sz] = self.buf[roff:roff+sz]
-                            # dmg_wbuf[roff:roff+sz] = mm[off:off + sz]
-                            hashes = b"\x00" * sz
-                            mm[off : off + sz] = hashes
-                            dmg_wbuf[roff : roff + sz] = hashes
-                        elif cty == BLKXChunkEntryType.zlib:
-                            decomp = zlib.decompress(self.buf[coff : coff + csz])
-                            mm[off : off + sz] = decomp
-                            dmg_wbuf[roff : roff + sz] = decomp
-                        elif cty == BLKXChunkEntryType.zero:
-                            zeros = b"\x00" * sz
-                            mm[off : off + sz] = zeros
-                            dmg_wbuf[roff : roff + sz] = zeros
-                        elif cty == BLKXChunkEntryType.raw:
-                            cpybuf = self.buf[coff : coff + csz]
-                            mm[off : off + sz] = cpybuf
-                            dmg_wbuf[roff : roff + sz] = cpybuf
-                        elif cty == BLKXChunkEntryType.terminator:
-                            # no need to do anything
-                            pass
-                        else:
-                            print(f"unhandled block run type: {cty}")
-                    with open(f"dump-{blk_idx}.img", "wb") as dumpf:
-                        dumpf.write(mm)
-            with open("dump-whole.img", "wb") as dumpf:
-                # dumpf.write(dmg_wbuf)
-                dumpf.write(b"im just a dummy\n")
+        print(f"hdr: {self.meta.hdr}")
+        for blk_idx, blkx_table in enumerate(self.meta.blkx_tables):
+            print(f"blkx_table: {blkx_table}")
+            if out_dir is not None:
+                out_path = os.path.join(out_dir, f"dump-{blk_idx}.img")
+                convert_image(self.meta, self.src, out_path, [blkx_table])
+        if out_dir is not None:
+            stats = self.convert(os.path.join(out_dir, "dump-whole.img"))
+            print(f"stats: {stats}")
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
@@ -203,14 +664,66 @@ def get_arg_parser() -> argparse.ArgumentParser:
         action="version",
         version=f"%(prog)s version: {Version(_version.version)}",
     )
+    subparsers = parser.add_subparsers(dest="cmd")
+    convert_parser = subparsers.add_parser(
+        "convert", help="convert a DMG to a raw disk image"
+    )
+    convert_parser.add_argument("dmg", help="input DMG path or URL", metavar="DMG")
+    convert_parser.add_argument("out", help="output raw image", metavar="IMG")
+    convert_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="decompression processes (default: CPU count)",
+    )
+    list_parser = subparsers.add_parser(
+        "list", help="list the partitions of a local or remote DMG"
+    )
+    list_parser.add_argument("dmg", help="input DMG path or URL", metavar="DMG")
     return parser
 
 
+def list_main(args: argparse.Namespace) -> int:
+    with open_source(args.dmg) as src:
+        dmg = DMG(src)
+        for idx, (name, table) in enumerate(
+            zip(dmg.partition_names, dmg.meta.blkx_tables)
+        ):
+            print(
+                f"{idx}: {name!r} sector {table.sector_num} "
+                f"count {table.sector_count} chunks {table.num_block_chunks}"
+            )
+    return 0
+
+
+def convert_main(args: argparse.Namespace) -> int:
+    def progress(stats: ConvertStats) -> None:
+        log.info(
+            f"{stats.chunks} chunks "
+            f"{stats.bytes_out + stats.hole_bytes}/{stats.total_bytes} bytes "
+            f"{stats.throughput / (1024 * 1024):.1f} MiB/s"
+        )
+
+    with open_source(args.dmg) as dmg_fh:
+        stats = DMG(dmg_fh).convert(args.out, progress=progress, workers=args.jobs)
+    print(
+        f"converted {stats.chunks} chunks, {stats.bytes_out} bytes written, "
+        f"{stats.hole_bytes} bytes of holes in {stats.elapsed:.3f}s "
+        f"({stats.throughput / (1024 * 1024):.1f} MiB/s)"
+    )
+    return 0
+
+
 def real_main(args: argparse.Namespace) -> int:
     verbose: Final[bool] = args.verbose
     if verbose:
         log.setLevel(logging.INFO)
         log.info(f"{program_name}: verbose mode enabled")
+    if args.cmd == "convert":
+        return convert_main(args)
+    if args.cmd == "list":
+        return list_main(args)
     return 0
 
 
@@ -0,0 +1,274 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Final, Optional
+
+from attrs import define, field
+from construct import Bytes, Const, Int32ul, Int64ul, Struct
+
+from .chunklist import Chunklist
+from .io_ext import HTTPFile, pwrite_all
+
+__all__ = [
+    "DOWNLOAD_JOURNAL_SUFFIX",
+    "DownloadJournal",
+    "DownloadJournalHeader",
+    "DownloadStats",
+    "ResumableDownload",
+    "download",
+    "journal_path",
+]
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_JOURNAL_SUFFIX: Final[str] = ".fsujournal"
+DOWNLOAD_JOURNAL_MAGIC: Final[bytes] = b"FSUDLJNL"
+DOWNLOAD_JOURNAL_VERSION: Final[int] = 1
+DOWNLOAD_CHUNK_SZ: Final[int] = 8 * 1024 * 1024
+
+DownloadJournalHeader = Struct(
+    "magic" / Const(DOWNLOAD_JOURNAL_MAGIC),
+    "version" / Const(DOWNLOAD_JOURNAL_VERSION, Int32ul),
+    "num_chunks" / Int64ul,
+    # binds the journal to one remote object and chunk layout
+    "key" / Bytes(32),
+)
+
+# one record per verified chunk, appended after its data is durable
+_RECORD: Final[struct.Struct] = struct.Struct("<Q")
+
+_fdatasync: Final[Callable[[int], None]] = getattr(os, "fdatasync", os.fsync)
+
+
+def journal_path(dest: str | os.PathLike) -> Path:
+    return Path(os.fspath(dest) + DOWNLOAD_JOURNAL_SUFFIX)
+
+
+@define
+class DownloadJournal:
+    path: Final[Path]
+    key: Final[bytes]
+    num_chunks: Final[int]
+    sync: Final[bool] = True
+    done: Final[set[int]] = field(init=False, factory=set)
+    _fh: BinaryIO = field(init=False)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        hdr = DownloadJournalHeader.build(
+            {"num_chunks": self.num_chunks, "key": self.key}
+        )
+        fh = open(self.path, "a+b")
+        fh.seek(0)
+        buf = fh.read()
+        if buf[: len(hdr)] != hdr:
+            if buf:
+                log.info(f"discarding stale download journal {self.path}")
+            fh.truncate(0)
+            fh.write(hdr)
+            fh.flush()
+            buf = hdr
+        body = buf[len(hdr) :]
+        # a record torn by a crash is dropped, its chunk is fetched again
+        whole = len(body) - len(body) % _RECORD.size
+        if whole != len(body):
+            fh.truncate(len(hdr) + whole)
+        for (idx,) in _RECORD.iter_unpack(body[:whole]):
+            if idx < self.num_chunks:
+                self.done.add(idx)
+        self._fh = fh
+
+    def record(self, idx: int) -> None:
+        with self._lock:
+            self._fh.write(_RECORD.pack(idx))
+            self._fh.flush()
+            if self.sync:
+                _fdatasync(self._fh.fileno())
+            self.done.add(idx)
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+@define
+class DownloadStats:
+    chunks: int = 0
+    total_chunks: int = 0
+    # chunks already in the journal, skipped without fetching or hashing
+    resumed_chunks: int = 0
+    bytes_fetched: int = 0
+    total_bytes: int = 0
+    retries: int = 0
+    # chunks that were still bad after every retry
+    failed: list[int] = field(factory=list)
+    start: float = field(factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return (
+            not self.failed and self.resumed_chunks + self.chunks == self.total_chunks
+        )
+
+    @property
+    def throughput(self) -> float:
+        # fetched bytes per second
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        return self.bytes_fetched / elapsed if elapsed > 0 else 0.0
+
+
+@define
+class ResumableDownload:
+    # fetches src into a sparse dest file, journaling each chunk once it is
+    # verified and on disk so an interrupted download picks up where it left off
+    src: Final[HTTPFile]
+    dest: Final[Path] = field(converter=Path)
+    chunklist: Final[Optional[Chunklist]] = None
+    # fixed chunking when there is no chunklist, chunks are then unverified
+    chunk_sz: Final[int] = DOWNLOAD_CHUNK_SZ
+    workers: Final[int] = 4
+    retries: Final[int] = 3
+    retry_delay: Final[float] = 0.5
+    sync: Final[bool] = True
+    keep_journal: Final[bool] = False
+    # (offset, size) of each chunk
+    spans: list[tuple[int, int]] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        size = self.src.sz
+        if self.chunklist is not None:
+            if self.chunklist.total_size != size:
+                raise ValueError(
+                    f"chunklist covers {self.chunklist.total_size} bytes, "
+                    f"remote file is {size}"
+                )
+            offs = self.chunklist.offsets
+            self.spans = [(off, end - off) for off, end in zip(offs, offs[1:])]
+        else:
+            self.spans = [
+                (off, min(self.chunk_sz, size - off))
+                for off in range(0, size, self.chunk_sz)
+            ]
+
+    @property
+    def journal_path(self) -> Path:
+        return journal_path(self.dest)
+
+    def _journal_key(self) -> bytes:
+        h = hashlib.sha256()
+        h.update(f"{self.src.url}\0{self.src.validator}\0{self.src.sz}\0".encode())
+        if self.chunklist is not None:
+            for c in self.chunklist.chunks:
+                h.update(_RECORD.pack(c.chunk_size) + c.chunk_sha256)
+        else:
+            h.update(_RECORD.pack(self.chunk_sz))
+        return h.digest()
+
+    def _check(self, idx: int, buf: memoryview) -> bool:
+        if self.chunklist is None:
+            return True
+        return hashlib.sha256(buf).digest() == self.chunklist.chunks[idx].chunk_sha256
+
+    def _fetch_chunk(self, fd: int, idx: int) -> tuple[bool, int]:
+        # returns whether the chunk landed and how many attempts were retries
+        off, size = self.spans[idx]
+        buf = bytearray(size)
+        mv = memoryview(buf)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                self.src.fetch_ranges([(off, size)], mv)
+            except OSError as e:
+                log.info(f"chunk {idx} fetch failed: {e}")
+                continue
+            if self._check(idx, mv):
+                break
+            log.info(f"chunk {idx} at offset {off} failed verification")
+        else:
+            return False, self.retries
+        pwrite_all(fd, mv, off)
+        if self.sync:
+            # data must be durable before the journal claims it
+            _fdatasync(fd)
+        return True, attempt
+
+    def run(
+        self, progress: Optional[Callable[[DownloadStats], None]] = None
+    ) -> DownloadStats:
+        size = self.src.sz
+        if not (self.dest.exists() and self.dest.stat().st_size == size):
+            # journal records mean nothing without the data they describe
+            self.journal_path.unlink(missing_ok=True)
+        journal = DownloadJournal(
+            self.journal_path, self._journal_key(), len(self.spans), self.sync
+        )
+        stats = DownloadStats(
+            total_chunks=len(self.spans),
+            resumed_chunks=len(journal.done),
+            total_bytes=size,
+        )
+        try:
+            fd = os.open(self.dest, os.O_RDWR | os.O_CREAT, 0o644)
+        except BaseException:
+            journal.close()
+            raise
+        try:
+            if os.fstat(fd).st_size != size:
+                # sparse, holes are filled in as chunks arrive
+                os.ftruncate(fd, size)
+            todo = [i for i in range(len(self.spans)) if i not in journal.done]
+            with ThreadPoolExecutor(self.workers) as pool:
+                futs: dict[Future, int] = {
+                    pool.submit(self._fetch_chunk, fd, idx): idx for idx in todo
+                }
+                try:
+                    for fut in as_completed(futs):
+                        idx = futs[fut]
+                        ok, retries = fut.result()
+                        stats.retries += retries
+                        if not ok:
+                            stats.failed.append(idx)
+                            continue
+                        journal.record(idx)
+                        stats.chunks += 1
+                        stats.bytes_fetched += self.spans[idx][1]
+                        if progress is not None:
+                            progress(stats)
+                except BaseException:
+                    for pending in futs:
+                        pending.cancel()
+                    raise
+        except BaseException:
+            journal.close()
+            raise
+        finally:
+            os.close(fd)
+        stats.failed.sort()
+        stats.elapsed = time.perf_counter() - stats.start
+        if stats.ok and not self.keep_journal:
+            journal.remove()
+        else:
+            journal.close()
+        return stats
+
+
+def download(
+    src: HTTPFile | str,
+    dest: str | os.PathLike,
+    chunklist: Optional[Chunklist] = None,
+    progress: Optional[Callable[[DownloadStats], None]] = None,
+    **kwargs: Any,
+) -> DownloadStats:
+    if isinstance(src, str):
+        src = HTTPFile(src)
+    return ResumableDownload(src, dest, chunklist, **kwargs).run(progress)
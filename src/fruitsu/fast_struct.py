@@ -0,0 +1,185 @@
+import struct
+from typing import Any, Callable, Final, Optional
+
+from construct import (
+    Adapter,
+    Array,
+    Bytes,
+    Const,
+    ConstError,
+    Construct,
+    Container,
+    Enum,
+    EnumInteger,
+    FormatField,
+    ListContainer,
+    Padded,
+    Pass,
+    Renamed,
+    StreamError,
+    Struct,
+    Tell,
+)
+
+from .io_ext import ReadableBuffer
+
+__all__ = [
+    "FastStruct",
+]
+
+
+def _const_check(value: Any) -> Callable[[Any], Any]:
+    def check(obj: Any) -> Any:
+        if obj != value:
+            raise ConstError(f"parsing expected {value!r} but parsed {obj!r}")
+        return obj
+
+    return check
+
+
+class _Compiler:
+    # flattens fixed-size construct fields into one struct format plus the
+    # source of an expression rebuilding the construct parse result from it
+    def __init__(self) -> None:
+        self.fmt: list[str] = []
+        self.byte_order: Optional[str] = None
+        self.nvals = 0
+        self.offset = 0
+        self.env: dict[str, Any] = {
+            "Container": Container,
+            "ListContainer": ListContainer,
+        }
+
+    def _bind(self, obj: Any) -> str:
+        name = f"_f{len(self.env)}"
+        self.env[name] = obj
+        return name
+
+    def _value(self, code: str, size: int) -> str:
+        self.fmt.append(code)
+        self.offset += size
+        self.nvals += 1
+        return f"v[{self.nvals - 1}]"
+
+    def field(self, con: Construct) -> str:
+        if isinstance(con, Renamed):
+            return self.field(con.subcon)
+        if isinstance(con, FormatField):
+            order, code = con.fmtstr[0], con.fmtstr[1:]
+            if self.byte_order not in (None, order):
+                raise TypeError(f"mixed byte order in {con}")
+            self.byte_order = order
+            return self._value(code, con.length)
+        if isinstance(con, Bytes) and isinstance(con.length, int):
+            return self._value(f"{con.length}s", con.length)
+        if isinstance(con, Const):
+            expr = self.field(con.subcon)
+            return f"{self._bind(_const_check(con.value))}({expr})"
+        if isinstance(con, Enum):
+            # inlined Enum._decode, the mapping lookup is the hot path
+            expr = self.field(con.subcon)
+            mapping = self._bind(con.decmapping)
+            return f"({mapping}.get({expr}) or {self._bind(EnumInteger)}({expr}))"
+        if isinstance(con, Adapter):
+            expr = self.field(con.subcon)
+            return f"{self._bind(con._decode)}({expr}, None, None)"
+        if (
+            isinstance(con, Padded)
+            and con.subcon is Pass
+            and isinstance(con.length, int)
+        ):
+            self.fmt.append(f"{con.length}x")
+            self.offset += con.length
+            return "None"
+        if con is Tell:
+            return str(self.offset)
+        if isinstance(con, Array) and isinstance(con.count, int):
+            items = ", ".join(self.field(con.subcon) for _ in range(con.count))
+            return f"ListContainer([{items}])"
+        if isinstance(con, Struct):
+            # unnamed fields still consume their bytes
+            fields = [(sc.name, self.field(sc)) for sc in con.subcons]
+            items = ", ".join(f"{name!r}: {expr}" for name, expr in fields if name)
+            return f"Container({{{items}}})"
+        raise TypeError(f"not a fixed size field: {con}")
+
+
+def _is_fixed(con: Construct) -> bool:
+    try:
+        _Compiler().field(con)
+    except TypeError:
+        return False
+    return True
+
+
+class FastStruct:
+    # precompiled struct.Struct decoder for a construct Struct, which stays the
+    # schema; the fixed-size prefix is unpacked in one call and trailing
+    # length-prefixed arrays of fixed records are decoded with iter_unpack
+    con: Final[Construct]
+
+    def __init__(self, con: Construct) -> None:
+        self.con = con
+        subcons = list(con.subcons) if isinstance(con, Struct) else []
+        split = len(subcons)
+        for i, sc in enumerate(subcons):
+            if not _is_fixed(sc):
+                split = i
+                break
+        comp = _Compiler()
+        expr = comp.field(Struct(*subcons[:split]) if subcons else con)
+        self._st = struct.Struct((comp.byte_order or ">") + "".join(comp.fmt))
+        self._decode = eval(f"lambda v: {expr}", comp.env)
+        self._tail: list[tuple[str, Construct, Optional[FastStruct]]] = []
+        for sc in subcons[split:]:
+            inner = sc.subcon if isinstance(sc, Renamed) else sc
+            if isinstance(inner, Array) and _is_fixed(inner.subcon):
+                self._tail.append((sc.name, inner, FastStruct(inner.subcon)))
+            elif isinstance(inner, (Padded, Bytes)) and (
+                not isinstance(inner, Padded) or inner.subcon is Pass
+            ):
+                self._tail.append((sc.name, inner, None))
+            else:
+                raise TypeError(f"unsupported variable size field: {sc}")
+
+    @property
+    def fixed_sz(self) -> int:
+        return self._st.size
+
+    def parse(self, buf: ReadableBuffer, offset: int = 0) -> Container:
+        if len(buf) - offset < self._st.size:
+            raise StreamError(
+                f"need {self._st.size} bytes, have {max(len(buf) - offset, 0)}"
+            )
+        obj = self._decode(self._st.unpack_from(buf, offset))
+        if not self._tail:
+            return obj
+        pos = offset + self._st.size
+        for name, sc, rec in self._tail:
+            if rec is not None:
+                count = sc.count(obj) if callable(sc.count) else sc.count
+                value = rec.parse_array(buf, count, pos)
+                pos += count * rec.fixed_sz
+            else:
+                length = sc.length(obj) if callable(sc.length) else sc.length
+                if len(buf) - pos < length:
+                    raise StreamError(f"need {length} bytes, have {len(buf) - pos}")
+                value = (
+                    None if isinstance(sc, Padded) else bytes(buf[pos : pos + length])
+                )
+                pos += length
+            if name:
+                obj[name] = value
+        return obj
+
+    def parse_array(
+        self, buf: ReadableBuffer, count: int, offset: int = 0
+    ) -> ListContainer:
+        if self._tail:
+            raise TypeError("only fixed size records can be decoded as an array")
+        end = offset + count * self._st.size
+        if len(buf) < end:
+            raise StreamError(f"need {end - offset} bytes, have {len(buf) - offset}")
+        decode = self._decode
+        mv = memoryview(buf)[offset:end]
+        return ListContainer([decode(v) for v in self._st.iter_unpack(mv)])
@@ -1,23 +1,16 @@
 from __future__ import annotations
 
 import enum
-from typing import Final, List, Optional, Self
+import math
+from array import array
+from typing import Any, Final, Iterator, Optional, Self, Sequence
 
-from anytree import NodeMixin, RenderTree
-from anytree.resolver import ChildResolverError, Resolver, ResolverError
 from fs.enums import ResourceType
 from rich import (
     print as rprint,
 )
 
-
-class InoVendor:
-    _ino: int = 0
-
-    @classmethod
-    def next(cls) -> int:
-        your_ino, cls._ino = cls._ino, cls._ino + 1
-        return your_ino
+from .index_cache import STRING_NONE, StringTable, StringTableBuilder
 
 
 class DirEntType(enum.Enum):
@@ -26,39 +19,263 @@ class DirEntType(enum.Enum):
     LNK = 2
 
 
-class INode(NodeMixin):
-    name: str
-    type: Final[DirEntType]
-    _size: int
-    size_comp: Optional[int]
-    _ino: Final[int]
-
-    def __init__(
-        self,
-        name: str,
-        type: DirEntType,
-        size: int = 0,
-        size_comp: Optional[int] = None,
-        parent: Optional[Self] = None,
-        children: Optional[List[Self]] = None,
-    ):
-        super().__init__()
+DIRENT_TYPES: Final[tuple[DirEntType, ...]] = tuple(DirEntType)
+
+
+class Column:
+    # exposes one INodeTable column as an INode attribute, `none` maps to None
+    typecode: str = "q"
+
+    def __init__(self, none: Any = -1) -> None:
+        self.none = none
+
+    def __get__(self, ino: Optional[INode], owner: Optional[type] = None) -> Any:
+        if ino is None:
+            return self
+        v = ino.table.columns[self.name][ino.idx]
+        return None if v == self.none else v
+
+    def __set__(self, ino: INode, value: Any) -> None:
+        ino.table.columns[self.name][ino.idx] = self.none if value is None else value
+
+    def __set_name__(self, owner: type, name: str) -> None:
         self.name = name
-        self.type = type
-        self._size = size
-        self.size_comp = size_comp
-        self.parent = parent
-        if type == DirEntType.DIR:
-            self.children = children if children else []
-        self._ino = InoVendor.next()
+
+
+class ByteColumn(Column):
+    typecode = "B"
+
+
+class StrColumn(Column):
+    typecode = "I"
+
+    def __init__(self) -> None:
+        super().__init__(STRING_NONE)
+
+    def __get__(self, ino: Optional[INode], owner: Optional[type] = None) -> Any:
+        if ino is None:
+            return self
+        return ino.table.string(ino.table.columns[self.name][ino.idx])
+
+    def __set__(self, ino: INode, value: Optional[str]) -> None:
+        ino.table.columns[self.name][ino.idx] = ino.table.intern(value)
+
+
+class INodeTable:
+    # one row per inode in parallel arrays, row 0 is the root, children of a
+    # row are a contiguous range of _child_ids built lazily from the parents
+    ino_cls: Final[type[INode]]
+    columns: Final[dict[str, array]]
+
+    def __init__(self, ino_cls: type[INode]) -> None:
+        self.ino_cls = ino_cls
+        self._column_defs = ino_cls.column_defs()
+        self.columns = {name: array(col.typecode) for name, col in self._column_defs}
+        self._defaults = [
+            (self.columns[name], 0 if col.none is None else col.none)
+            for name, col in self._column_defs
+        ]
+        self._strings: list[str] | StringTable = []
+        self._string_idx: Optional[dict[str, int]] = {}
+        self._child_start = array("q")
+        self._child_ids = array("q")
+        self._indexed_rows = -1
+        self._path_index: Optional[PathIndex] = None
 
     @property
-    def size(self):
-        return self._size
+    def root(self) -> INode:
+        return self.ino_cls(self, 0)
+
+    def string(self, idx: int) -> Optional[str]:
+        return None if idx == STRING_NONE else self._strings[idx]
+
+    def intern(self, s: Optional[str]) -> int:
+        if s is None:
+            return STRING_NONE
+        if self._string_idx is None:
+            # tables loaded from an index are read-only until first intern
+            self._strings = [self._strings[i] for i in range(len(self._strings))]
+            self._string_idx = {s: i for i, s in enumerate(self._strings)}
+        idx = self._string_idx.get(s)
+        if idx is None:
+            idx = self._string_idx[s] = len(self._strings)
+            self._strings.append(s)
+        return idx
+
+    def add(self, parent: int, name: str, type: DirEntType) -> int:
+        idx = len(self)
+        self._path_index = None
+        for col, default in self._defaults:
+            col.append(default)
+        cols = self.columns
+        cols["_parent"][idx] = parent
+        cols["_name"][idx] = self.intern(name)
+        cols["_type"][idx] = type.value
+        return idx
+
+    def _build_children(self) -> None:
+        n = len(self)
+        parents = self.columns["_parent"]
+        start = array("q", bytes(8 * (n + 1)))
+        for p in parents:
+            if p >= 0:
+                start[p + 1] += 1
+        for i in range(n):
+            start[i + 1] += start[i]
+        fill = start[:n]
+        child_ids = array("q", bytes(8 * start[n]))
+        for i, p in enumerate(parents):
+            if p >= 0:
+                child_ids[fill[p]] = i
+                fill[p] += 1
+        self._child_start = start
+        self._child_ids = child_ids
+        self._indexed_rows = n
+
+    def path_index(self) -> PathIndex:
+        # shared by every filesystem view of this table, dropped on mutation
+        if self._path_index is None:
+            self._path_index = PathIndex(self)
+        return self._path_index
+
+    def child_range(self, idx: int) -> array:
+        if self._indexed_rows != len(self):
+            self._build_children()
+        return self._child_ids[self._child_start[idx] : self._child_start[idx + 1]]
+
+    def schema(self) -> bytes:
+        return ",".join(
+            f"{name}:{col.typecode}" for name, col in self._column_defs
+        ).encode()
+
+    def to_sections(self) -> list[bytes]:
+        strs = StringTableBuilder()
+        for i in range(len(self._strings)):
+            strs.add(self._strings[i])
+        return [
+            *strs.build(),
+            *(self.columns[name].tobytes() for name, _ in self._column_defs),
+        ]
+
+    @classmethod
+    def from_sections(
+        cls, ino_cls: type[INode], sections: Sequence[memoryview]
+    ) -> Self:
+        table = cls(ino_cls)
+        str_offs, str_blob, *col_bufs = sections
+        table._strings = StringTable(str_offs, str_blob)
+        table._string_idx = None
+        for (name, _), buf in zip(table._column_defs, col_bufs, strict=True):
+            table.columns[name].frombytes(buf)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.columns["_parent"])
+
+
+class PathIndex:
+    # hashed full-path and (parent, name) lookups for one INodeTable, built in
+    # a single pass since parents always precede their children in row order
+    paths: Final[dict[str, int]]
+    children: Final[dict[tuple[int, str], int]]
+
+    def __init__(self, table: INodeTable) -> None:
+        parents = table.columns["_parent"]
+        names = table.columns["_name"]
+        string = table.string
+        row_paths = [""] * len(table)
+        paths = {"/": 0}
+        children: dict[tuple[int, str], int] = {}
+        for idx in range(1, len(table)):
+            parent = parents[idx]
+            name = string(names[idx])
+            key = (parent, name)
+            if key in children:
+                # first entry wins for duplicate names, like a linear scan
+                row_paths[idx] = row_paths[children[key]]
+                continue
+            children[key] = idx
+            row_paths[idx] = path = f"{row_paths[parent]}/{name}"
+            paths.setdefault(path, idx)
+        self.paths = paths
+        self.children = children
+
 
-    @size.setter
-    def size(self, value):
-        self._size = value
+class INode:
+    # lightweight view of one INodeTable row
+    __slots__ = ("table", "idx")
+
+    _parent = Column()
+    _name = StrColumn()
+    _type = ByteColumn(None)
+    size = Column(None)
+    size_comp = Column()
+    data_off = Column()
+
+    def __init__(self, table: INodeTable, idx: int) -> None:
+        self.table = table
+        self.idx = idx
+
+    @classmethod
+    def column_defs(cls) -> list[tuple[str, Column]]:
+        defs = {}
+        for klass in reversed(cls.__mro__):
+            for name, attr in vars(klass).items():
+                if isinstance(attr, Column):
+                    defs[name] = attr
+        return list(defs.items())
+
+    @classmethod
+    def root_node(cls) -> Self:
+        table = INodeTable(cls)
+        return cls(table, table.add(-1, "rootfs", DirEntType.DIR))
+
+    def add_child(self, name: str, type: DirEntType) -> Self:
+        return self.__class__(self.table, self.table.add(self.idx, name, type))
+
+    @property
+    def ino(self) -> int:
+        return self.idx
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, value: str) -> None:
+        self._name = value
+        self.table._path_index = None
+
+    @property
+    def type(self) -> DirEntType:
+        return DIRENT_TYPES[self._type]
+
+    @type.setter
+    def type(self, value: DirEntType) -> None:
+        self._type = value.value
+
+    @property
+    def parent(self) -> Optional[Self]:
+        parent = self._parent
+        return None if parent is None else self.__class__(self.table, parent)
+
+    @property
+    def children(self) -> tuple[Self, ...]:
+        cls, table = self.__class__, self.table
+        return tuple(cls(table, i) for i in table.child_range(self.idx))
+
+    @property
+    def descendants(self) -> tuple[Self, ...]:
+        return tuple(self.iter_descendants())
+
+    def iter_descendants(self) -> Iterator[Self]:
+        # pre-order, iterative so deep trees don't hit the recursion limit
+        cls, table = self.__class__, self.table
+        stack = list(reversed(table.child_range(self.idx)))
+        while stack:
+            idx = stack.pop()
+            yield cls(table, idx)
+            stack.extend(reversed(table.child_range(idx)))
 
     @property
     def is_dir(self) -> bool:
@@ -72,24 +289,66 @@ class INode(NodeMixin):
             DirEntType.LNK: ResourceType.symlink,
         }[self.type]
 
-    @classmethod
-    def root_node(cls):
-        return cls(parent=None, name="rootfs", type=DirEntType.DIR)
-
     def dump(self):
-        for pre, fill, node in RenderTree(self):
-            rprint("[yellow]{}[/]{}".format(pre, node.name))
-
-    @staticmethod
-    def _norm_path(path: str):
-        if path[0] == "/":
-            return "/rootfs" + path
-        return path
-
-    def lookup(self, path: str) -> INode:
-        r = Resolver("name")
-        try:
-            res = r.get(self, self._norm_path(path))
-        except (ResolverError, ChildResolverError):
-            res = None
-        return res
+        rprint("[yellow]{}[/]{}".format("", self.name))
+        stack = [(c, "", i == 0) for i, c in enumerate(reversed(self.children))]
+        while stack:
+            node, fill, last = stack.pop()
+            rprint(
+                "[yellow]{}[/]{}".format(fill + ("└── " if last else "├── "), node.name)
+            )
+            child_fill = fill + ("    " if last else "│   ")
+            children = node.children
+            stack.extend(
+                (c, child_fill, i == 0) for i, c in enumerate(reversed(children))
+            )
+
+    def child(self, name: str) -> Optional[Self]:
+        idx = self.table.path_index().children.get((self.idx, name))
+        return None if idx is None else self.__class__(self.table, idx)
+
+    def lookup(self, path: str) -> Optional[Self]:
+        index = self.table.path_index()
+        if self.idx == 0 or path.startswith("/"):
+            idx = index.paths.get("/" + path.strip("/"))
+            if idx is not None:
+                return self.__class__(self.table, idx)
+            if "/." not in "/" + path and "//" not in path:
+                return None
+        # non-normalized or relative paths resolve a component at a time
+        idx = 0 if path.startswith("/") else self.idx
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                parent = self.table.columns["_parent"][idx]
+                idx = idx if parent < 0 else parent
+                continue
+            idx = index.children.get((idx, part))
+            if idx is None:
+                return None
+        return self.__class__(self.table, idx)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, INode):
+            return NotImplemented
+        return self.table is other.table and self.idx == other.idx
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.idx))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.idx}, {self.name!r}, {self.type.name})"
+
+
+class FloatColumn(Column):
+    typecode = "d"
+
+    def __init__(self) -> None:
+        super().__init__(math.nan)
+
+    def __get__(self, ino: Optional[INode], owner: Optional[type] = None) -> Any:
+        if ino is None:
+            return self
+        v = ino.table.columns[self.name][ino.idx]
+        return None if math.isnan(v) else v
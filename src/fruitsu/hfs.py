@@ -1,22 +1,47 @@
 #!/usr/bin/env python3
 
+import abc
 import argparse
+import bisect
+import collections
 import datetime
+import enum
+import functools
 import io
+import itertools
 import logging
 import math
+import os
+import stat
+import struct
 import sys
-from typing import Any, Container, Final
+import threading
+import unicodedata
+from typing import (
+    Any,
+    BinaryIO,
+    Collection,
+    Final,
+    Iterator,
+    Mapping,
+    Optional,
+    Self,
+)
 
 import attr
-from attrs import define
+import fs.opener.registry
+import fs.path
+from attrs import define, field
 from construct import (
     Adapter,
     Byte,
+    Bytes,
     Const,
+    Container,
     Enum,
     Int8sb,
     Int8ub,
+    Int16sb,
     Int16ub,
     Int32ub,
     Int64ub,
@@ -24,12 +49,37 @@ from construct import (
     Struct,
     Union,
 )
+from fs.base import FS
+from fs.enums import ResourceType
+from fs.errors import (
+    DirectoryExpected,
+    FileExpected,
+    ResourceNotFound,
+    ResourceReadOnly,
+)
+from fs.info import Info
+from fs.opener.errors import NotWriteable
+from fs.opener.parse import ParseResult
+from fs.permissions import Permissions
+from fs.subfs import SubFS
 from packaging.version import Version
 from rich.console import Console
 from rich.logging import RichHandler
 
 from . import _version
-from .io_ext import OffsetRawIOBase
+from .compression import DecompressingRawIO
+from .decmpfs import DECMPFS_XATTR_NAME, UF_COMPRESSED, DecmpfsFile, DecmpfsHeaderFast
+from .fast_struct import FastStruct
+from .io_ext import (
+    BlockCacheStats,
+    FancyRawIOBase,
+    OffsetRawIOBase,
+    ReadableBuffer,
+    SeekContextIOBaseMixin,
+    SubscriptedIOBaseMixin,
+    WritableBuffer,
+    iter_chunks,
+)
 
 LOG_FORMAT = "%(message)s"
 logging.basicConfig(
@@ -177,6 +227,8 @@ HFSPlusVolumeHeader = Struct(
     "startupFile" / HFSPlusForkData,
 )
 
+HFSPlusVolumeHeaderFast: Final[FastStruct] = FastStruct(HFSPlusVolumeHeader)
+
 HFSPlusCatalogKey = Struct(
     "keyLength" / Int16ub,
     "parentID" / HFSCatalogNodeID,
@@ -204,6 +256,8 @@ BTNodeDescriptor = Struct(
     "reserved" / Int16ub,
 )
 
+BTNodeDescriptorFast: Final[FastStruct] = FastStruct(BTNodeDescriptor)
+
 # struct BTHeaderRec {
 # 	u_int16_t	treeDepth;		/* maximum height (usually leaf nodes) */
 # 	u_int32_t 	rootNode;		/* node number of root node */
@@ -247,41 +301,1023 @@ BTreeKey = Union(
 )
 
 
+BTHeaderRecFast: Final[FastStruct] = FastStruct(BTHeaderRec)
+
+BT_NODE_DESCRIPTOR_SZ: Final[int] = 14
+
+# BTHeaderRec.attributes
+kBTBigKeysMask: Final[int] = 0x00000002
+kBTVariableIndexKeysMask: Final[int] = 0x00000004
+
+# BTHeaderRec.keyCompareType, HFSX only, HFS+ always case folds
+kHFSCaseFolding: Final[int] = 0xCF
+kHFSBinaryCompare: Final[int] = 0xBC
+
+kHFSRootParentID: Final[int] = 1
+kHFSRootFolderID: Final[int] = 2
+
+
+class CatalogRecordType(enum.IntEnum):
+    folder = 1
+    file = 2
+    folder_thread = 3
+    file_thread = 4
+
+
+HFSPlusBSDInfo = Struct(
+    "ownerID" / Int32ub,
+    "groupID" / Int32ub,
+    "adminFlags" / Int8ub,
+    "ownerFlags" / Int8ub,
+    "fileMode" / Int16ub,
+    "special" / Int32ub,
+)
+
+HFSPlusCatalogFolder = Struct(
+    "recordType" / Int16sb,
+    "flags" / Int16ub,
+    "valence" / Int32ub,
+    "folderID" / HFSCatalogNodeID,
+    "createDate" / HFSDate,
+    "contentModDate" / HFSDate,
+    "attributeModDate" / HFSDate,
+    "accessDate" / HFSDate,
+    "backupDate" / HFSDate,
+    "permissions" / HFSPlusBSDInfo,
+    "userInfo" / Bytes(16),
+    "finderInfo" / Bytes(16),
+    "textEncoding" / Int32ub,
+    "folderCount" / Int32ub,
+)
+
+HFSPlusCatalogFile = Struct(
+    "recordType" / Int16sb,
+    "flags" / Int16ub,
+    "reserved1" / Int32ub,
+    "fileID" / HFSCatalogNodeID,
+    "createDate" / HFSDate,
+    "contentModDate" / HFSDate,
+    "attributeModDate" / HFSDate,
+    "accessDate" / HFSDate,
+    "backupDate" / HFSDate,
+    "permissions" / HFSPlusBSDInfo,
+    "userInfo" / Bytes(16),
+    "finderInfo" / Bytes(16),
+    "textEncoding" / Int32ub,
+    "reserved2" / Int32ub,
+    "dataFork" / HFSPlusForkData,
+    "resourceFork" / HFSPlusForkData,
+)
+
+HFSPlusCatalogFolderFast: Final[FastStruct] = FastStruct(HFSPlusCatalogFolder)
+HFSPlusCatalogFileFast: Final[FastStruct] = FastStruct(HFSPlusCatalogFile)
+
+_U16: Final[struct.Struct] = struct.Struct(">H")
+_U32: Final[struct.Struct] = struct.Struct(">I")
+_THREAD_HDR: Final[struct.Struct] = struct.Struct(">hhIH")
+
+# TN1150 treats these as ignorable when comparing names
+_IGNORABLE_UNITS: Final[frozenset[int]] = frozenset(
+    (*range(0x200C, 0x2010), *range(0x202A, 0x202F), *range(0x206A, 0x2070), 0xFEFF)
+)
+
+
+# TN1150 gLowerCaseTable as (first, last, step, delta) runs, every other unit
+# folds to itself; it only folds Latin, Greek, Cyrillic, Armenian, Georgian,
+# Roman numerals and fullwidth letters and leaves precomposed letters alone
+_LOWER_CASE_RUNS: Final[tuple[tuple[int, int, int, int], ...]] = (
+    (0x0041, 0x005A, 1, 32),
+    (0x00C6, 0x00C6, 1, 32),
+    (0x00D0, 0x00D0, 1, 32),
+    (0x00D8, 0x00D8, 1, 32),
+    (0x00DE, 0x00DE, 1, 32),
+    (0x0110, 0x0110, 1, 1),
+    (0x0126, 0x0126, 1, 1),
+    (0x0132, 0x0132, 1, 1),
+    (0x013F, 0x0141, 2, 1),
+    (0x014A, 0x014A, 1, 1),
+    (0x0152, 0x0152, 1, 1),
+    (0x0166, 0x0166, 1, 1),
+    (0x0181, 0x0181, 1, 210),
+    (0x0182, 0x0184, 2, 1),
+    (0x0186, 0x0186, 1, 206),
+    (0x0187, 0x0187, 1, 1),
+    (0x0189, 0x018A, 1, 205),
+    (0x018B, 0x018B, 1, 1),
+    (0x018E, 0x018E, 1, 79),
+    (0x018F, 0x018F, 1, 202),
+    (0x0190, 0x0190, 1, 203),
+    (0x0191, 0x0191, 1, 1),
+    (0x0193, 0x0193, 1, 205),
+    (0x0194, 0x0194, 1, 207),
+    (0x0196, 0x0196, 1, 211),
+    (0x0197, 0x0197, 1, 209),
+    (0x0198, 0x0198, 1, 1),
+    (0x019C, 0x019C, 1, 211),
+    (0x019D, 0x019D, 1, 213),
+    (0x019F, 0x019F, 1, 214),
+    (0x01A2, 0x01A4, 2, 1),
+    (0x01A7, 0x01A7, 1, 1),
+    (0x01A9, 0x01A9, 1, 218),
+    (0x01AC, 0x01AC, 1, 1),
+    (0x01AE, 0x01AE, 1, 218),
+    (0x01B1, 0x01B2, 1, 217),
+    (0x01B3, 0x01B5, 2, 1),
+    (0x01B7, 0x01B7, 1, 219),
+    (0x01B8, 0x01B8, 1, 1),
+    (0x01BC, 0x01BC, 1, 1),
+    (0x01C4, 0x01C4, 1, 2),
+    (0x01C5, 0x01C5, 1, 1),
+    (0x01C7, 0x01C7, 1, 2),
+    (0x01C8, 0x01C8, 1, 1),
+    (0x01CA, 0x01CA, 1, 2),
+    (0x01CB, 0x01CB, 1, 1),
+    (0x01E4, 0x01E4, 1, 1),
+    (0x01F1, 0x01F1, 1, 2),
+    (0x01F2, 0x01F2, 1, 1),
+    (0x0391, 0x03A1, 1, 32),
+    (0x03A3, 0x03A9, 1, 32),
+    (0x03E2, 0x03EE, 2, 1),
+    (0x0402, 0x0404, 2, 80),
+    (0x0405, 0x0406, 1, 80),
+    (0x0408, 0x040B, 1, 80),
+    (0x040F, 0x040F, 1, 80),
+    (0x0410, 0x0418, 1, 32),
+    (0x041A, 0x042F, 1, 32),
+    (0x0460, 0x0474, 2, 1),
+    (0x0478, 0x0480, 2, 1),
+    (0x0490, 0x04BE, 2, 1),
+    (0x04C3, 0x04C3, 1, 1),
+    (0x04C7, 0x04C7, 1, 1),
+    (0x04CB, 0x04CB, 1, 1),
+    (0x0531, 0x0556, 1, 48),
+    (0x10A0, 0x10C5, 1, 48),
+    (0x2160, 0x216F, 1, 16),
+    (0xFF21, 0xFF3A, 1, 32),
+)
+
+# HFS+ stores names in canonical decomposition as of Unicode 3.2, except for
+# these ranges which are kept as is
+_DECOMPOSE_EXCLUDED: Final[tuple[tuple[int, int], ...]] = (
+    (0x2000, 0x2FFF),
+    (0xF900, 0xFAFF),
+    (0x2F800, 0x2FAFF),
+)
+
+
+@functools.cache
+def _case_fold_table() -> str:
+    # one UTF-16 code unit in, one out; "\0" marks ignorable units and NUL
+    # sorts last like in FastUnicodeCompare
+    table = [chr(unit) for unit in range(0x10000)]
+    for first, last, step, delta in _LOWER_CASE_RUNS:
+        for unit in range(first, last + 1, step):
+            table[unit] = chr(unit + delta)
+    for unit in _IGNORABLE_UNITS:
+        table[unit] = "\0"
+    table[0] = "\uffff"
+    return "".join(table)
+
+
+def hfs_fold_name(name_units: str) -> str:
+    # name_units holds one char per UTF-16 code unit so str ordering matches
+    # the on-disk u16 ordering, even for surrogate pairs
+    return name_units.translate(_case_fold_table()).replace("\0", "")
+
+
+def utf16_units(name: str) -> str:
+    if not name or max(name) < "\U00010000":
+        return name
+    buf = name.encode("utf-16-be", "surrogatepass")
+    return "".join(chr(u) for (u,) in _U16.iter_unpack(buf))
+
+
+def hfs_decompose(name: str) -> str:
+    # the on-disk form of name, which lookups have to match unit for unit
+    if name.isascii():
+        return name
+    ucd = unicodedata.ucd_3_2_0
+    out = []
+    for ch in name:
+        cp = ord(ch)
+        if any(lo <= cp <= hi for lo, hi in _DECOMPOSE_EXCLUDED):
+            out.append(ch)
+        else:
+            out.extend(ucd.normalize("NFD", ch))
+    # combining marks brought together from separate chars need reordering
+    i = 0
+    while i < len(out):
+        j = i
+        while j < len(out) and ucd.combining(out[j]):
+            j += 1
+        if j - i > 1:
+            out[i:j] = sorted(out[i:j], key=ucd.combining)
+        i = j + 1
+    return "".join(out)
+
+
+@define(frozen=True)
+class CatalogKey:
+    parent_id: int
+    name: str
+
+    @classmethod
+    def parse(cls, buf: ReadableBuffer, off: int) -> tuple[Self, int]:
+        # returns the key and the offset just past it
+        key_len = _U16.unpack_from(buf, off)[0]
+        (parent_id,) = _U32.unpack_from(buf, off + 2)
+        (name_len,) = _U16.unpack_from(buf, off + 6)
+        name = bytes(buf[off + 8 : off + 8 + 2 * name_len]).decode(
+            "utf-16-be", "surrogatepass"
+        )
+        return cls(parent_id, name), off + 2 + key_len
+
+    def sort_key(self, case_fold: bool = True) -> tuple[int, str]:
+        units = utf16_units(self.name)
+        return self.parent_id, hfs_fold_name(units) if case_fold else units
+
+
+@define
+class BTNode:
+    num: int
+    desc: Container[Any]
+    buf: bytes = field(repr=False)
+    # record start offsets plus the free space offset, in record order
+    offsets: tuple[int, ...] = field(repr=False)
+    keys: Optional[list[Any]] = field(default=None, repr=False)
+    children: Optional[list[int]] = field(default=None, repr=False)
+
+    @property
+    def kind(self) -> str:
+        return str(self.desc.kind)
+
+    @property
+    def num_records(self) -> int:
+        return self.desc.numRecords
+
+    def record(self, idx: int) -> memoryview:
+        return memoryview(self.buf)[self.offsets[idx] : self.offsets[idx + 1]]
+
+
+@define
+class BTree(abc.ABC):
+    # subclasses supply the key codec for their tree
+    fork: Final[Any]
+    cache_max_bytes: Final[int] = 8 * 1024 * 1024
+    header: Container[Any] = field(init=False, repr=False)
+    node_size: int = field(init=False)
+    stats: Final[BlockCacheStats] = field(init=False, factory=BlockCacheStats)
+    _nodes: Final[collections.OrderedDict[int, BTNode]] = field(
+        init=False, factory=collections.OrderedDict
+    )
+    _cur_bytes: int = field(init=False, default=0)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        # the header node is at least 512 bytes and says how big nodes are
+        hdr_buf = self.fork.pread(0, 512)
+        desc = BTNodeDescriptorFast.parse(hdr_buf)
+        if desc.kind != "kBTHeaderNode":
+            raise ValueError(f"B-tree node 0 is a {desc.kind}, not a header node")
+        self.header = BTHeaderRecFast.parse(hdr_buf, BT_NODE_DESCRIPTOR_SZ)
+        self.node_size = self.header.nodeSize
+
+    def read_node(self, num: int) -> BTNode:
+        with self._lock:
+            node = self._nodes.get(num)
+            if node is not None:
+                self._nodes.move_to_end(num)
+                self.stats.hits += 1
+                return node
+            self.stats.misses += 1
+        if not (0 <= num < self.header.totalNodes):
+            raise ValueError(f"B-tree node {num} out of range")
+        buf = bytes(self.fork.pread(num * self.node_size, self.node_size))
+        desc = BTNodeDescriptorFast.parse(buf)
+        n = desc.numRecords
+        offsets = struct.unpack_from(f">{n + 1}H", buf, self.node_size - 2 * (n + 1))
+        node = BTNode(num, desc, buf, offsets[::-1])
+        with self._lock:
+            self.stats.fetches += 1
+            self.stats.fetched_bytes += self.node_size
+            if num not in self._nodes:
+                self._nodes[num] = node
+                self._cur_bytes += self.node_size
+                while self._cur_bytes > self.cache_max_bytes and len(self._nodes) > 1:
+                    self._nodes.popitem(last=False)
+                    self._cur_bytes -= self.node_size
+                    self.stats.evictions += 1
+        return node
+
+    @abc.abstractmethod
+    def parse_key(self, buf: ReadableBuffer, off: int) -> tuple[Any, int]:
+        # key and the offset of the record data after it
+        ...
+
+    @abc.abstractmethod
+    def sort_key(self, key: Any) -> Any: ...
+
+    def _record_key(self, node: BTNode, idx: int) -> tuple[Any, int]:
+        key, data_off = self.parse_key(node.buf, node.offsets[idx])
+        if node.kind == "kBTIndexNode" and not (
+            self.header.attributes & kBTVariableIndexKeysMask
+        ):
+            # fixed size index keys are padded out to maxKeyLength
+            len_sz = 2 if self.header.attributes & kBTBigKeysMask else 1
+            data_off = node.offsets[idx] + len_sz + self.header.maxKeyLength
+        return key, data_off
+
+    def node_keys(self, node: BTNode) -> list[Any]:
+        # sort keys and child pointers of every record, decoded once per node
+        if node.keys is None:
+            keys, children = [], []
+            is_index = node.kind == "kBTIndexNode"
+            for i in range(node.num_records):
+                key, data_off = self._record_key(node, i)
+                keys.append(self.sort_key(key))
+                if is_index:
+                    children.append(_U32.unpack_from(node.buf, data_off)[0])
+            node.keys, node.children = keys, children
+        return node.keys
+
+    def search(self, skey: Any) -> tuple[BTNode, int]:
+        # leaf node and index of the first record with a key >= skey
+        num = self.header.rootNode
+        for _ in range(max(self.header.treeDepth, 1) + 1):
+            node = self.read_node(num)
+            keys = self.node_keys(node)
+            if node.kind == "kBTLeafNode":
+                return node, bisect.bisect_left(keys, skey)
+            if node.kind != "kBTIndexNode":
+                raise ValueError(f"unexpected {node.kind} in B-tree search")
+            num = node.children[max(bisect.bisect_right(keys, skey) - 1, 0)]
+        raise ValueError("B-tree deeper than its header says")
+
+    def iter_from(self, skey: Any) -> Iterator[tuple[Any, memoryview]]:
+        # leaf records in key order starting at the first key >= skey
+        if self.header.rootNode == 0:
+            return
+        node, idx = self.search(skey)
+        while True:
+            for i in range(idx, node.num_records):
+                key, data_off = self._record_key(node, i)
+                rec = node.record(i)
+                yield key, rec[data_off - node.offsets[i] :]
+            if node.desc.fLink == 0:
+                return
+            node, idx = self.read_node(node.desc.fLink), 0
+
+    def get(self, key: Any) -> Optional[memoryview]:
+        skey = self.sort_key(key)
+        if self.header.rootNode == 0:
+            return None
+        node, idx = self.search(skey)
+        keys = self.node_keys(node)
+        if idx < len(keys) and keys[idx] == skey:
+            _, data_off = self._record_key(node, idx)
+            return node.record(idx)[data_off - node.offsets[idx] :]
+        return None
+
+
+@define
+class CatalogBTree(BTree):
+    case_fold: bool = field(init=False, default=True)
+    _root: Optional[Container[Any]] = field(init=False, default=None)
+
+    def __attrs_post_init__(self) -> None:
+        super().__attrs_post_init__()
+        self.case_fold = self.header.keyCompareType != kHFSBinaryCompare
+
+    def parse_key(self, buf: ReadableBuffer, off: int) -> tuple[CatalogKey, int]:
+        return CatalogKey.parse(buf, off)
+
+    def sort_key(self, key: CatalogKey) -> tuple[int, str]:
+        return key.sort_key(self.case_fold)
+
+    @staticmethod
+    def parse_record(data: ReadableBuffer) -> Container[Any]:
+        rec_type = CatalogRecordType(struct.unpack_from(">h", data)[0])
+        if rec_type == CatalogRecordType.folder:
+            return HFSPlusCatalogFolderFast.parse(data)
+        if rec_type == CatalogRecordType.file:
+            return HFSPlusCatalogFileFast.parse(data)
+        _, _, parent_id, name_len = _THREAD_HDR.unpack_from(data)
+        name_off = _THREAD_HDR.size
+        name = bytes(data[name_off : name_off + 2 * name_len]).decode(
+            "utf-16-be", "surrogatepass"
+        )
+        return Container(recordType=rec_type, parentID=parent_id, nodeName=name)
+
+    def record(self, parent_id: int, name: str) -> Optional[Container[Any]]:
+        data = self.get(CatalogKey(parent_id, hfs_decompose(name)))
+        return None if data is None else self.parse_record(data)
+
+    def thread(self, cnid: int) -> Optional[Container[Any]]:
+        return self.record(cnid, "")
+
+    def children(self, folder_id: int) -> Iterator[tuple[str, Container[Any]]]:
+        for key, data in self.iter_from(self.sort_key(CatalogKey(folder_id, ""))):
+            if key.parent_id != folder_id:
+                return
+            if key.name:
+                yield key.name, self.parse_record(data)
+
+    def lookup(self, path: str) -> Optional[Container[Any]]:
+        # one root-to-leaf descent per path component
+        rec = self.root
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if rec is None or rec.recordType != CatalogRecordType.folder:
+                return None
+            rec = self.record(rec.folderID, part)
+        return rec
+
+    @property
+    def root(self) -> Optional[Container[Any]]:
+        if self._root is None:
+            thread = self.thread(kHFSRootFolderID)
+            if thread is not None:
+                self._root = self.record(thread.parentID, thread.nodeName)
+        return self._root
+
+    def path_of(self, cnid: int) -> Optional[str]:
+        parts = []
+        while cnid != kHFSRootFolderID:
+            thread = self.thread(cnid)
+            if thread is None:
+                return None
+            parts.append(thread.nodeName)
+            cnid = thread.parentID
+        return "/" + "/".join(reversed(parts))
+
+
+# reserved CNIDs of the special files
+kHFSExtentsFileID: Final[int] = 3
+kHFSCatalogFileID: Final[int] = 4
+kHFSAllocationFileID: Final[int] = 6
+kHFSStartupFileID: Final[int] = 7
+kHFSAttributesFileID: Final[int] = 8
+
+kHFSDataForkType: Final[int] = 0x00
+kHFSResourceForkType: Final[int] = 0xFF
+
+HFSPlusExtentKey = Struct(
+    "keyLength" / Int16ub,
+    "forkType" / Int8ub,
+    "pad" / Int8ub,
+    "fileID" / HFSCatalogNodeID,
+    "startBlock" / Int32ub,
+)
+
+HFSPlusExtentKeyFast: Final[FastStruct] = FastStruct(HFSPlusExtentKey)
+HFSPlusExtentRecordFast: Final[FastStruct] = FastStruct(HFSPlusExtentDescriptor[8])
+
+
+@define
+class ExtentsBTree(BTree):
+    def parse_key(self, buf: ReadableBuffer, off: int) -> tuple[Container[Any], int]:
+        key = HFSPlusExtentKeyFast.parse(buf, off)
+        return key, off + 2 + key.keyLength
+
+    def sort_key(self, key: Container[Any]) -> tuple[int, int, int]:
+        return key.fileID, key.forkType, key.startBlock
+
+    def iter_extents(
+        self, file_id: int, fork_type: int, start_block: int
+    ) -> Iterator[tuple[int, int, int]]:
+        # (logical block, physical block, block count) past the inline extents
+        for key, data in self.iter_from((file_id, fork_type, start_block)):
+            if key.fileID != file_id or key.forkType != fork_type:
+                return
+            lblk = key.startBlock
+            for ext in HFSPlusExtentRecordFast.parse(data):
+                if ext.blockCount == 0:
+                    break
+                yield lblk, ext.startBlock, ext.blockCount
+                lblk += ext.blockCount
+
+
+@define
+class HFSFork(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
+    # logical fork offsets mapped onto volume blocks via a sorted extent map
+    fh: Final[Any]
+    block_size: Final[int]
+    sz: Final[int]
+    # (logical block, physical block, block count), sorted and coalesced
+    extents: Final[list[tuple[int, int, int]]]
+    blksz: Final[int] = 1
+    _lblks: Final[list[int]] = field(init=False)
+    _idx: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self) -> None:
+        merged: list[tuple[int, int, int]] = []
+        for lblk, pblk, cnt in sorted(self.extents):
+            if merged:
+                mlblk, mpblk, mcnt = merged[-1]
+                if mlblk + mcnt == lblk and mpblk + mcnt == pblk:
+                    merged[-1] = (mlblk, mpblk, mcnt + cnt)
+                    continue
+            merged.append((lblk, pblk, cnt))
+        self.extents[:] = merged
+        self._lblks = [lblk for lblk, _, _ in merged]
+        allocated = sum(cnt for _, _, cnt in merged) * self.block_size
+        if self.sz > allocated:
+            raise ValueError(
+                f"fork of {self.sz} bytes only has {allocated} bytes of extents"
+            )
+
+    @classmethod
+    def from_fork_data(
+        cls,
+        fh: Any,
+        block_size: int,
+        fork_data: Container[Any],
+        file_id: int,
+        fork_type: int = kHFSDataForkType,
+        extents_btree: Optional[ExtentsBTree] = None,
+    ) -> Self:
+        extents = []
+        nblks = 0
+        for ext in fork_data.extents:
+            if ext.blockCount == 0:
+                break
+            extents.append((nblks, ext.startBlock, ext.blockCount))
+            nblks += ext.blockCount
+        if nblks < fork_data.totalBlocks and extents_btree is not None:
+            # the first eight extents live in the fork data, the rest overflow
+            for ext in extents_btree.iter_extents(file_id, fork_type, nblks):
+                extents.append(ext)
+                nblks = ext[0] + ext[2]
+                if nblks >= fork_data.totalBlocks:
+                    break
+        return cls(fh, block_size, fork_data.logicalSize, extents)
+
+    def size(self) -> int:
+        return self.sz
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        if offset < 0:
+            raise ValueError("negative offset")
+        out = memoryview(buf).cast("B")
+        end = min(offset + len(out), self.sz)
+        pos = offset
+        ext_idx = bisect.bisect_right(self._lblks, pos // self.block_size) - 1
+        while pos < end:
+            lblk, pblk, cnt = self.extents[ext_idx]
+            ext_off = lblk * self.block_size
+            if not (ext_off <= pos < ext_off + cnt * self.block_size):
+                raise ValueError(f"hole in fork extent map at offset {pos}")
+            ext_end = min(ext_off + cnt * self.block_size, end)
+            # one read per extent, contiguous extents were merged up front
+            n = ext_end - pos
+            phys = pblk * self.block_size + pos - ext_off
+            dst = out[pos - offset : pos - offset + n]
+            got = self.fh.readinto_at(phys, dst)
+            if got != n:
+                raise OSError(f"short read: wanted {n} bytes got {got}")
+            pos += n
+            ext_idx += 1
+        return max(end - offset, 0)
+
+    def pread(self, offset: int, size: int) -> ReadableBuffer:
+        if offset < 0 or size < 0 or offset + size > self.sz:
+            raise ValueError("out of bounds size")
+        if size:
+            ext_idx = bisect.bisect_right(self._lblks, offset // self.block_size) - 1
+            lblk, pblk, cnt = self.extents[ext_idx]
+            ext_off = lblk * self.block_size
+            if offset + size <= ext_off + cnt * self.block_size:
+                # within one extent, no copy needed
+                return self.fh.pread(pblk * self.block_size + offset - ext_off, size)
+        buf = bytearray(size)
+        self.readinto_at(offset, buf)
+        return buf
+
+    def read(self, size: int = -1) -> ReadableBuffer:
+        if size is None or size < 0:
+            size = self.sz - self._idx
+        buf = self.pread(self._idx, max(min(size, self.sz - self._idx), 0))
+        self._idx += len(buf)
+        return buf
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, buf)
+        self._idx += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
+        elif whence == io.SEEK_END:
+            idx = self.sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if idx < 0:
+            raise ValueError("negative seek position")
+        self._idx = idx
+        return self._idx
+
+    def tell(self) -> int:
+        return self._idx
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+
+# attributes B-tree record types
+kHFSPlusAttrInlineData: Final[int] = 0x10
+kHFSPlusAttrForkData: Final[int] = 0x20
+kHFSPlusAttrExtents: Final[int] = 0x30
+
+HFSPlusForkDataFast: Final[FastStruct] = FastStruct(HFSPlusForkData)
+_ATTR_KEY_HDR: Final[struct.Struct] = struct.Struct(">H2xIIH")
+# recordType, reserved[2], attrSize of an inline attribute record
+_ATTR_DATA_HDR: Final[struct.Struct] = struct.Struct(">I8xI")
+
+
+@define(frozen=True)
+class AttrKey:
+    file_id: int
+    name: str
+    start_block: int = 0
+
+    @classmethod
+    def parse(cls, buf: ReadableBuffer, off: int) -> tuple[Self, int]:
+        # keyLength, pad, fileID, startBlock, attrNameLen then the name
+        key_len, file_id, start_block, name_len = _ATTR_KEY_HDR.unpack_from(buf, off)
+        name_off = off + _ATTR_KEY_HDR.size
+        name = bytes(buf[name_off : name_off + 2 * name_len]).decode(
+            "utf-16-be", "surrogatepass"
+        )
+        return cls(file_id, name, start_block), off + 2 + key_len
+
+    def sort_key(self) -> tuple[int, str, int]:
+        # attribute names compare as raw UTF-16 code units
+        return self.file_id, utf16_units(self.name), self.start_block
+
+
+@define
+class AttributesBTree(BTree):
+    def parse_key(self, buf: ReadableBuffer, off: int) -> tuple[AttrKey, int]:
+        return AttrKey.parse(buf, off)
+
+    def sort_key(self, key: AttrKey) -> tuple[int, str, int]:
+        return key.sort_key()
+
+    def names(self, file_id: int) -> Iterator[str]:
+        for key, _ in self.iter_from((file_id, "", 0)):
+            if key.file_id != file_id:
+                return
+            if key.start_block == 0:
+                yield key.name
+
+
 @attr.s
 class HFS:
-    fh: OffsetRawIOBase = attr.ib()
+    fh: OffsetRawIOBase = attr.ib(converter=OffsetRawIOBase)
     hdr: Container[Any] = attr.ib(init=False, repr=False)
-    cat_file: Final[OffsetRawIOBase] = attr.ib(init=False)
+    cat_file: Final[HFSFork] = attr.ib(init=False)
+    catalog: CatalogBTree = attr.ib(init=False, repr=False)
+    extents: Optional[ExtentsBTree] = attr.ib(init=False, repr=False)
+    attributes_file: Optional[HFSFork] = attr.ib(init=False, repr=False)
+    _attributes: Optional[AttributesBTree] = attr.ib(
+        init=False, default=None, repr=False
+    )
+    cache_max_bytes: int = attr.ib(default=8 * 1024 * 1024, kw_only=True)
 
     def __attrs_post_init__(self):
-        self.fh.seek(1024, io.SEEK_SET)
-        hdr_buf = self.fh.read(HFSPlusVolumeHeader.sizeof())
-        self.hdr = HFSPlusVolumeHeader.parse(hdr_buf)
-        cat_ext = self.hdr.catalogFile.extents[0]
-        self.cat_file = Region.from_blks(
-            cat_ext.startBlock, cat_ext.blockCount, self.hdr.blockSize
+        hdr_buf = self.fh.pread(1024, HFSPlusVolumeHeader.sizeof())
+        self.hdr = HFSPlusVolumeHeaderFast.parse(hdr_buf)
+        self.extents = None
+        if self.hdr.extentsFile.logicalSize:
+            # the extents overflow file can't overflow itself
+            extents_fork = self.open_fork(self.hdr.extentsFile, kHFSExtentsFileID)
+            self.extents = ExtentsBTree(extents_fork, self.cache_max_bytes)
+        self.cat_file = self.open_fork(self.hdr.catalogFile, kHFSCatalogFileID)
+        self.catalog = CatalogBTree(self.cat_file, self.cache_max_bytes)
+        self.attributes_file = None
+        if self.hdr.attributesFile.logicalSize:
+            self.attributes_file = self.open_fork(
+                self.hdr.attributesFile, kHFSAttributesFileID
+            )
+
+    def open_fork(
+        self,
+        fork_data: Container[Any],
+        file_id: int,
+        fork_type: int = kHFSDataForkType,
+    ) -> HFSFork:
+        return HFSFork.from_fork_data(
+            self.fh, self.hdr.blockSize, fork_data, file_id, fork_type, self.extents
+        )
+
+    def open_data_fork(self, rec: Container[Any]) -> HFSFork:
+        return self.open_fork(rec.dataFork, rec.fileID)
+
+    def open_resource_fork(self, rec: Container[Any]) -> HFSFork:
+        return self.open_fork(rec.resourceFork, rec.fileID, kHFSResourceForkType)
+
+    @property
+    def attributes(self) -> Optional[AttributesBTree]:
+        # opened on first use, most reads never touch extended attributes
+        if self._attributes is None and self.attributes_file is not None:
+            self._attributes = AttributesBTree(
+                self.attributes_file, self.cache_max_bytes
+            )
+        return self._attributes
+
+    def getxattr(self, file_id: int, name: str) -> Optional[bytes]:
+        if self.attributes is None:
+            return None
+        data = self.attributes.get(AttrKey(file_id, name))
+        if data is None:
+            return None
+        rec_type = _U32.unpack_from(data)[0]
+        if rec_type == kHFSPlusAttrInlineData:
+            _, attr_sz = _ATTR_DATA_HDR.unpack_from(data)
+            return bytes(data[_ATTR_DATA_HDR.size : _ATTR_DATA_HDR.size + attr_sz])
+        if rec_type == kHFSPlusAttrForkData:
+            # big attributes keep their data in blocks like a fork
+            fork_data = HFSPlusForkDataFast.parse(data, 8)
+            fork = HFSFork.from_fork_data(
+                self.fh, self.hdr.blockSize, fork_data, file_id
+            )
+            return bytes(fork.read())
+        raise ValueError(f"unexpected attribute record type {rec_type:#x}")
+
+    def listxattr(self, file_id: int) -> list[str]:
+        if self.attributes is None:
+            return []
+        return list(self.attributes.names(file_id))
+
+    def _decmpfs_xattr(self, rec: Container[Any]) -> Optional[bytes]:
+        # only files flagged compressed pay for the attributes lookup
+        if rec.recordType != CatalogRecordType.file:
+            return None
+        if not rec.permissions.ownerFlags & UF_COMPRESSED:
+            return None
+        return self.getxattr(rec.fileID, DECMPFS_XATTR_NAME)
+
+    def file_size(self, rec: Container[Any]) -> int:
+        xattr = self._decmpfs_xattr(rec)
+        if xattr is None:
+            return rec.dataFork.logicalSize
+        return DecmpfsHeaderFast.parse(xattr).uncompressed_size
+
+    def open_file(self, rec: Container[Any]) -> HFSFork | DecmpfsFile:
+        # data fork contents, transparently decompressed for decmpfs files
+        xattr = self._decmpfs_xattr(rec)
+        if xattr is None:
+            return self.open_data_fork(rec)
+        return DecmpfsFile.from_xattr(
+            xattr,
+            self.open_resource_fork(rec),
+            cache_max_bytes=self.cache_max_bytes,
         )
 
     def dump(self):
         print(f"dumping: {self}")
-        print(f"HFSPlusVolumeHeader sz: {HFSPlusVolumeHeader.sizeof()}")
         print(f"hdr: {self.hdr}")
-        assert self.hdr.catalogFile.extents[0].blockCount > 0
-        assert self.hdr.catalogFile.extents[1].blockCount == 0
-        blk_off = self.hdr.catalogFile.extents[0].startBlock * self.hdr.blockSize
-        cat_buf = self.fh[blk_off : self.hdr.catalogFile.logicalSize]
-        print(f"len(cat_buf) = {len(cat_buf)}")
-        with open("cat_buf.bin", "wb") as f:
-            f.write(cat_buf)
-
-        root_node = BTNodeDescriptor.parse(cat_buf)
-        print(f"root_node: {root_node}")
-
-        first_bthdrrec = BTHeaderRec.parse(cat_buf[14:])
-        print(f"first_bthdrrec: {first_bthdrrec}")
-
-        # root_cat_key = BTreeKey.parse(cat_buf)
-        # print(f'root_cat_key: {root_cat_key}')
+        print(f"catalog header: {self.catalog.header}")
+
+    def dump_catalog(self, out_path: str | os.PathLike) -> int:
+        # the raw catalog file, for inspecting the B-tree with other tools
+        with open(out_path, "wb") as f:
+            for chunk in iter_chunks(self.cat_file, 0, self.cat_file.sz, 1024 * 1024):
+                f.write(chunk)
+        return self.cat_file.sz
+
+
+MAX_SYMLINK_HOPS: Final[int] = 40
+
+# metadata folders in the root holding hard link targets, hidden from listings
+HFS_PRIVATE_DATA_NAME: Final[str] = "\0\0\0\0HFS+ Private Data"
+HFS_DIR_METADATA_NAME: Final[str] = ".HFS+ Private Directory Data\r"
+
+# FileInfo fdType + fdCreator of the special link files
+_SYMLINK_TYPE: Final[bytes] = b"slnkrhap"
+_HARD_LINK_TYPE: Final[bytes] = b"hlnkhfs+"
+_DIR_HARD_LINK_TYPE: Final[bytes] = b"fdrpMACS"
+
+
+def _hfs_epoch(dt: datetime.datetime) -> Optional[float]:
+    # zero dates mean unset
+    if dt == HFSEpoch:
+        return None
+    return (dt - UnixEpoch).total_seconds()
+
+
+@define
+class HFSFS(fs.base.FS):
+    file: Final[Any]
+    hfs: Final[HFS] = field(init=False)
+    _owns_file: bool = field(init=False, default=False)
+    _private_ids: Optional[dict[str, Optional[int]]] = field(init=False, default=None)
+
+    def __attrs_post_init__(self):
+        FS.__init__(self)
+        if isinstance(self.file, (str, os.PathLike)):
+            self.file = FancyRawIOBase(io.FileIO(self.file, "r"))
+            self._owns_file = True
+        self.hfs = HFS(self.file)
+
+    def _private_dir_id(self, name: str) -> Optional[int]:
+        if self._private_ids is None:
+            self._private_ids = {}
+            for pname in (HFS_PRIVATE_DATA_NAME, HFS_DIR_METADATA_NAME):
+                rec = self.hfs.catalog.record(kHFSRootFolderID, pname)
+                self._private_ids[pname] = None if rec is None else rec.folderID
+        return self._private_ids[name]
+
+    def _is_hidden(self, parent_id: int, name: str) -> bool:
+        return parent_id == kHFSRootFolderID and name in (
+            HFS_PRIVATE_DATA_NAME,
+            HFS_DIR_METADATA_NAME,
+        )
+
+    def _follow_hard_link(self, rec: Container[Any]) -> Container[Any]:
+        # hard links are empty files naming an iNode in a private folder
+        if rec.recordType != CatalogRecordType.file:
+            return rec
+        kind = rec.userInfo[:8]
+        if kind == _HARD_LINK_TYPE:
+            parent_id = self._private_dir_id(HFS_PRIVATE_DATA_NAME)
+            name = f"iNode{rec.permissions.special}"
+        elif kind == _DIR_HARD_LINK_TYPE:
+            parent_id = self._private_dir_id(HFS_DIR_METADATA_NAME)
+            name = f"dir_{rec.permissions.special}"
+        else:
+            return rec
+        if parent_id is None:
+            return rec
+        target = self.hfs.catalog.record(parent_id, name)
+        return rec if target is None else target
+
+    def _lookup(self, path: str) -> Container[Any]:
+        path = fs.path.abspath(fs.path.normpath(path))
+        rec = self.hfs.catalog.root
+        for part in fs.path.iteratepath(path):
+            if rec is None or rec.recordType != CatalogRecordType.folder:
+                raise ResourceNotFound(path)
+            if self._is_hidden(rec.folderID, part):
+                raise ResourceNotFound(path)
+            rec = self.hfs.catalog.record(rec.folderID, part)
+        if rec is None:
+            raise ResourceNotFound(path)
+        return self._follow_hard_link(rec)
+
+    @staticmethod
+    def _is_symlink(rec: Container[Any]) -> bool:
+        if rec.recordType != CatalogRecordType.file:
+            return False
+        mode = rec.permissions.fileMode
+        if mode:
+            return stat.S_ISLNK(mode)
+        return rec.userInfo[:8] == _SYMLINK_TYPE
+
+    def _link_target(self, rec: Container[Any]) -> str:
+        return bytes(self.hfs.open_file(rec).read()).decode("utf-8")
+
+    def _resolve(self, path: str) -> Container[Any]:
+        for _ in range(MAX_SYMLINK_HOPS):
+            rec = self._lookup(path)
+            if not self._is_symlink(rec):
+                return rec
+            path = fs.path.normpath(
+                fs.path.join(
+                    fs.path.dirname(fs.path.abspath(path)), self._link_target(rec)
+                )
+            )
+        raise ResourceNotFound(path)
+
+    def _make_info(
+        self, name: str, rec: Container[Any], namespaces: Collection[str]
+    ) -> Info:
+        is_dir = rec.recordType == CatalogRecordType.folder
+        if is_dir:
+            res_type = ResourceType.directory
+        elif self._is_symlink(rec):
+            res_type = ResourceType.symlink
+        else:
+            res_type = ResourceType.file
+        raw_info: dict[str, dict[str, Any]] = {
+            "basic": {"name": name, "is_dir": is_dir},
+            "details": {
+                "type": int(res_type),
+                "size": 0 if is_dir else self.hfs.file_size(rec),
+                "created": _hfs_epoch(rec.createDate),
+                "modified": _hfs_epoch(rec.contentModDate),
+                "metadata_changed": _hfs_epoch(rec.attributeModDate),
+                "accessed": _hfs_epoch(rec.accessDate),
+            },
+        }
+        if "access" in namespaces:
+            perms = rec.permissions
+            raw_info["access"] = {
+                "permissions": Permissions(mode=stat.S_IMODE(perms.fileMode)).dump(),
+                "uid": perms.ownerID,
+                "gid": perms.groupID,
+            }
+        if "link" in namespaces:
+            target = self._link_target(rec) if self._is_symlink(rec) else None
+            raw_info["link"] = {"target": target}
+        return Info(raw_info)
+
+    def getinfo(self, path: str, namespaces: Optional[Collection[str]] = None) -> Info:
+        rec = self._lookup(path)
+        name = fs.path.basename(fs.path.abspath(fs.path.normpath(path)))
+        return self._make_info(name, rec, namespaces or ())
+
+    def _iter_children(self, path: str) -> Iterator[tuple[str, Container[Any]]]:
+        rec = self._resolve(path)
+        if rec.recordType != CatalogRecordType.folder:
+            raise DirectoryExpected(path)
+        # a single pass over the folder's leaf records, not a lookup per child
+        for name, child in self.hfs.catalog.children(rec.folderID):
+            if not self._is_hidden(rec.folderID, name):
+                yield name, child
+
+    def listdir(self, path: str) -> list[str]:
+        return [name for name, _ in self._iter_children(path)]
+
+    def scandir(
+        self,
+        path: str,
+        namespaces: Optional[Collection[str]] = None,
+        page: Optional[tuple[int, int]] = None,
+    ) -> Iterator[Info]:
+        namespaces = namespaces or ()
+        infos = (
+            self._make_info(name, self._follow_hard_link(rec), namespaces)
+            for name, rec in self._iter_children(path)
+        )
+        if page is not None:
+            start, end = page
+            infos = itertools.islice(infos, start, end)
+        return infos
+
+    def makedir(
+        self,
+        path: str,
+        permissions: Optional[Permissions] = None,
+        recreate: bool = False,
+    ) -> SubFS[FS]:
+        raise NotWriteable("HFS supports only reading")
+
+    def openbin(
+        self, path: str, mode: str = "r", buffering: int = -1, **kwargs
+    ) -> BinaryIO:
+        if any(m in mode for m in "wax+"):
+            raise ResourceReadOnly(path)
+        rec = self._resolve(path)
+        if rec.recordType != CatalogRecordType.file:
+            raise FileExpected(path)
+        # stored stream straight over the fork, one read per extent, or over
+        # the decmpfs view which decodes only the chunks read
+        src = self.hfs.open_file(rec)
+        raw = DecompressingRawIO(src, src.sz, None)
+        if buffering == 0:
+            return raw
+        if buffering < 0:
+            buffering = io.DEFAULT_BUFFER_SIZE
+        return io.BufferedReader(raw, buffering)
+
+    def remove(self, path: str) -> None:
+        raise NotWriteable("HFS supports only reading")
+
+    def removedir(self, path: str) -> None:
+        raise NotWriteable("HFS supports only reading")
+
+    def setinfo(self, path: str, info: Mapping[str, Mapping[str, object]]) -> None:
+        raise NotWriteable("HFS supports only reading")
+
+    def close(self) -> None:
+        if not self.isclosed() and self._owns_file:
+            self.file.close()
+        super().close()
+
+
+# @fs.opener.registry.install
+class HFSFSOpener(fs.opener.Opener):
+    protocols = ["hfs"]
+
+    def open_fs(
+        self,
+        fs_url: str,
+        parse_result: ParseResult,
+        writeable: bool,
+        create: bool,
+        cwd: str,
+    ):
+        if create or writeable:
+            raise NotWriteable("HFS supports only reading")
+        return HFSFS(parse_result.resource)
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
@@ -0,0 +1,204 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Final, Iterable, Optional, Self, Sequence
+
+from attrs import define, field
+from construct import Bytes, Const, ConstructError, Int32ul, Int64ul, Struct, this
+
+from .io_ext import ReadableBuffer
+
+__all__ = [
+    "IndexCache",
+    "IndexEntry",
+    "StringTable",
+    "StringTableBuilder",
+    "default_cache_dir",
+    "index_key",
+    "source_stamp",
+]
+
+INDEX_CACHE_VERSION: Final[int] = 2
+
+IndexSection = Struct(
+    "off" / Int64ul,
+    "sz" / Int64ul,
+)
+
+IndexHeader = Struct(
+    "magic" / Const(b"FSUIDX\0\0"),
+    "version" / Const(INDEX_CACHE_VERSION, Int32ul),
+    "num_sections" / Int32ul,
+    "key" / Bytes(32),
+    "sections" / IndexSection[this.num_sections],
+)
+
+INDEX_HEADER_MIN_SZ: Final[int] = 48
+
+
+def _index_header_sz(num_sections: int) -> int:
+    return INDEX_HEADER_MIN_SZ + num_sections * IndexSection.sizeof()
+
+
+STRING_NONE: Final[int] = 0xFFFFFFFF
+
+
+def default_cache_dir() -> Path:
+    if env_dir := os.environ.get("FRUITSU_CACHE_DIR"):
+        return Path(env_dir)
+    xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return Path(xdg) / "fruitsu" / "index"
+
+
+def source_stamp(fh) -> Optional[bytes]:
+    # remote files are validated by ETag/Last-Modified, local ones by mtime
+    validator = getattr(fh, "validator", None)
+    if validator is not None:
+        return validator.encode()
+    try:
+        st = os.fstat(fh.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return struct.pack("<qq", st.st_mtime_ns, st.st_ino)
+
+
+def index_key(kind: bytes, size: int, stamp: bytes, *hdr_bufs: ReadableBuffer) -> bytes:
+    h = hashlib.sha256()
+    h.update(struct.pack("<I", INDEX_CACHE_VERSION) + kind)
+    for buf in (struct.pack("<Q", size), stamp, *hdr_bufs):
+        h.update(struct.pack("<Q", len(buf)))
+        h.update(buf)
+    return h.digest()
+
+
+class StringTableBuilder:
+    def __init__(self) -> None:
+        self._idx: dict[str, int] = {}
+        self._bufs: list[bytes] = []
+
+    def add(self, s: Optional[str]) -> int:
+        if s is None:
+            return STRING_NONE
+        idx = self._idx.get(s)
+        if idx is None:
+            idx = self._idx[s] = len(self._bufs)
+            self._bufs.append(s.encode("utf-8"))
+        return idx
+
+    def build(self) -> tuple[bytes, bytes]:
+        offs = [0]
+        for buf in self._bufs:
+            offs.append(offs[-1] + len(buf))
+        return struct.pack(f"<{len(offs)}I", *offs), b"".join(self._bufs)
+
+
+class StringTable:
+    def __init__(self, offs_buf: memoryview, blob: memoryview) -> None:
+        self._offs = offs_buf.cast("I")
+        self._blob = blob
+        self._cache: dict[int, str] = {}
+
+    def __getitem__(self, idx: int) -> Optional[str]:
+        if idx == STRING_NONE:
+            return None
+        s = self._cache.get(idx)
+        if s is None:
+            s = self._cache[idx] = str(
+                self._blob[self._offs[idx] : self._offs[idx + 1]], "utf-8"
+            )
+        return s
+
+    def __len__(self) -> int:
+        return len(self._offs) - 1
+
+
+@define
+class IndexEntry:
+    mm: Final[mmap.mmap]
+    sections: Final[list[memoryview]]
+
+    @classmethod
+    def from_mmap(cls, mm: mmap.mmap, key: bytes) -> Optional[Self]:
+        if len(mm) < INDEX_HEADER_MIN_SZ:
+            return None
+        try:
+            hdr = IndexHeader.parse(mm)
+        except ConstructError:
+            return None
+        if hdr.key != key:
+            return None
+        mv = memoryview(mm)
+        sections = []
+        for sect in hdr.sections:
+            if sect.off + sect.sz > len(mm):
+                return None
+            sections.append(mv[sect.off : sect.off + sect.sz])
+        return cls(mm, sections)
+
+
+@define
+class IndexCache:
+    root: Final[Path] = field(factory=default_cache_dir, converter=Path)
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+
+    def path(self, key: bytes) -> Path:
+        hex_key = key.hex()
+        return self.root / hex_key[:2] / hex_key
+
+    def load(self, key: bytes) -> Optional[IndexEntry]:
+        try:
+            with open(self.path(key), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        entry = IndexEntry.from_mmap(mm, key)
+        if entry is None:
+            mm.close()
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def store(self, key: bytes, sections: Sequence[ReadableBuffer]) -> Path:
+        hdr_sz = _index_header_sz(len(sections))
+        sect_descs = []
+        off = hdr_sz
+        for sect in sections:
+            # 8 byte aligned so sections can be cast to typed memoryviews
+            off = (off + 7) & ~7
+            sect_descs.append({"off": off, "sz": len(sect)})
+            off += len(sect)
+        hdr = IndexHeader.build(
+            {"num_sections": len(sections), "key": key, "sections": sect_descs}
+        )
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write-then-rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(hdr)
+                for desc, sect in zip(sect_descs, sections):
+                    f.write(b"\0" * (desc["off"] - f.tell()))
+                    f.write(sect)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    def _entries(self) -> Iterable[Path]:
+        if not self.root.is_dir():
+            return []
+        return [p for p in self.root.glob("*/*") if p.is_file()]
+
+    def clear(self) -> None:
+        for p in self._entries():
+            p.unlink(missing_ok=True)
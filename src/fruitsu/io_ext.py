@@ -1,17 +1,63 @@
+import concurrent.futures
 import io
-from contextlib import contextmanager
-from typing import Final, Generator, Optional, Self
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Final,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Self,
+)
 
 import requests
+import requests.adapters
 from attrs import define, field
 from wrapt import ObjectProxy
 
+from .range_cache import RangeCache
+
+ReadableBuffer = bytes | memoryview
+WritableBuffer = bytearray | memoryview
+
+
+def preallocate(fd: int, size: int) -> None:
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # not available on macOS or on some filesystems
+        os.ftruncate(fd, size)
+
+
+def pwrite_all(fd: int, buf: ReadableBuffer, offset: int) -> None:
+    mv = memoryview(buf)
+    while mv:
+        n = os.pwrite(fd, mv, offset)
+        mv = mv[n:]
+        offset += n
+
+
+def iter_chunks(src, offset: int, size: int, chunk_sz: int) -> Iterator[ReadableBuffer]:
+    for chunk_off in range(offset, offset + size, chunk_sz):
+        yield src.pread(chunk_off, min(chunk_sz, offset + size - chunk_off))
+
 
 class SubscriptedIOBaseMixin:
     sz: int
     blksz: Optional[int]
 
-    def __getitem__(self, item: slice) -> bytes:
+    def __getitem__(self, item: slice) -> ReadableBuffer:
         byte_off, num_bytes, step = item.start, item.stop, item.step
         if byte_off is None:
             byte_off = 0
@@ -19,11 +65,7 @@ class SubscriptedIOBaseMixin:
             num_bytes = self.sz
         if step == Ellipsis:
             byte_off, num_bytes = byte_off * self.blksz, num_bytes * self.blksz
-        old_tell = self.tell()
-        self.seek(byte_off, io.SEEK_SET)
-        buf = self.read(num_bytes)
-        self.seek(old_tell, io.SEEK_SET)
-        return buf
+        return self.pread(byte_off, num_bytes)
 
 
 class SeekContextIOBaseMixin:
@@ -38,12 +80,63 @@ class SeekContextIOBaseMixin:
             self.seek(old_tell)
 
 
-class FancyRawIOBase(ObjectProxy, SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
-    pass
+class PositionalIOBaseMixin:
+    # fallbacks for sources without native positional I/O, not thread safe
+    def pread(self, offset: int, size: int) -> bytes:
+        with self.seek_ctx(offset, io.SEEK_SET):
+            return self.read(size)
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        data = self.pread(offset, len(buf))
+        memoryview(buf)[: len(data)] = data
+        return len(data)
+
+
+class FancyRawIOBase(
+    ObjectProxy, SubscriptedIOBaseMixin, SeekContextIOBaseMixin, PositionalIOBaseMixin
+):
+    def _fileno(self) -> Optional[int]:
+        try:
+            return self.__wrapped__.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def size(self) -> int:
+        if hasattr(self.__wrapped__, "sz"):
+            return self.__wrapped__.sz
+        fd = self._fileno()
+        if fd is not None:
+            return os.fstat(fd).st_size
+        with self.seek_ctx(0, io.SEEK_END):
+            return self.tell()
+
+    def pread(self, offset: int, size: int) -> ReadableBuffer:
+        if hasattr(self.__wrapped__, "pread"):
+            return self.__wrapped__.pread(offset, size)
+        fd = self._fileno()
+        if fd is None:
+            return PositionalIOBaseMixin.pread(self, offset, size)
+        buf = os.pread(fd, size, offset)
+        if len(buf) != size:
+            raise ValueError("out of bounds size")
+        return buf
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        if hasattr(self.__wrapped__, "readinto_at"):
+            return self.__wrapped__.readinto_at(offset, buf)
+        fd = self._fileno()
+        if fd is None:
+            return PositionalIOBaseMixin.readinto_at(self, offset, buf)
+        return os.preadv(fd, [buf], offset)
+
+    # ObjectProxy forwards subscripting to the wrapped object, which doesn't support it
+    __getitem__ = SubscriptedIOBaseMixin.__getitem__
 
 
 @define
-class OffsetRawIOBase(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
+class OffsetRawIOBase(
+    SubscriptedIOBaseMixin, SeekContextIOBaseMixin, PositionalIOBaseMixin
+):
     fh: Final[FancyRawIOBase] = field(converter=FancyRawIOBase)
     off: Final[int] = 0
     sz: Final[int] = -1
@@ -53,72 +146,457 @@ class OffsetRawIOBase(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
     _idx: Final[int] = field(init=False, default=0)
 
     def __attrs_post_init__(self) -> None:
-        with self.fh.seek_ctx(0, io.SEEK_END):
-            self._parent_end = self.fh.tell()
+        self._parent_end = self.fh.size()
         if self.sz == -1:
             self.sz = self._parent_end - self.off
         self._end = self.off + self.sz
 
-    def read(self, size: int = -1) -> bytes:
+    def _check_span(self, offset: int, size: int) -> None:
+        if offset < 0 or size < 0 or offset + size > self.sz:
+            raise ValueError("out of bounds size")
+
+    def pread(self, offset: int, size: int) -> ReadableBuffer:
+        self._check_span(offset, size)
+        return self.fh.pread(self.off + offset, size)
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        self._check_span(offset, len(buf))
+        return self.fh.readinto_at(self.off + offset, buf)
+
+    def read(self, size: int = -1) -> ReadableBuffer:
         if size == -1:
             size = self.sz - self._idx
-        if self._idx + size > self.sz:
-            raise ValueError("out of bounds size")
-        with self.fh.seek_ctx(self.off + self._idx, io.SEEK_SET):
-            buf = self.fh.read(size)
+        buf = self.pread(self._idx, size)
         self._idx += len(buf)
         return buf
 
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, memoryview(buf)[: self.sz - self._idx])
+        self._idx += n
+        return n
+
     def tell(self) -> int:
         return self._idx
 
     def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
-        parent_off = offset
         if whence == io.SEEK_SET:
-            # add beginning gap
-            parent_off += self.off
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
         elif whence == io.SEEK_END:
-            # add end gap
-            parent_off += self._parent_end - self._end
-        self._idx = parent_off - self.off
-        if not (0 <= self._idx <= self.sz):
+            idx = self.sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if not (0 <= idx <= self.sz):
             raise ValueError("out of bounds seek")
+        self._idx = idx
         return self._idx
 
     def subfile(self, offset: int, size: int = -1, blksz: Optional[int] = None) -> Self:
-        suboff = self.off + offset
-        if not (0 <= suboff <= self.sz):
+        if not (0 <= offset <= self.sz):
             raise ValueError("subfile suboff out of range")
         if size < 0:
             size = self.sz - offset
+        if offset + size > self.sz:
+            raise ValueError("subfile size out of range")
         if blksz is None:
             blksz = self.blksz
-        return type(self)(self.fh, suboff, size, blksz)
+        return type(self)(self.fh, self.off + offset, size, blksz)
 
 
 @define
-class HTTPFile(FancyRawIOBase):
+class MmapRawIOBase(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
+    fh: Final[IO[bytes]]
+    blksz: Final[int] = 1
+    sz: Final[int] = field(init=False)
+    _mm: Final[Optional[mmap.mmap]] = field(init=False, repr=False)
+    _mv: Final[memoryview] = field(init=False, repr=False)
+    _idx: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self) -> None:
+        self.sz = os.fstat(self.fh.fileno()).st_size
+        if self.sz == 0:
+            # zero length files can't be mapped
+            self._mm = None
+            self._mv = memoryview(b"")
+        else:
+            self._mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mv = memoryview(self._mm)
+
+    def pread(self, offset: int, size: int) -> memoryview:
+        if offset < 0 or size < 0 or offset + size > self.sz:
+            raise ValueError("out of bounds size")
+        return self._mv[offset : offset + size]
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        size = min(len(buf), self.sz - offset)
+        memoryview(buf)[:size] = self.pread(offset, size)
+        return size
+
+    def read(self, size: int = -1) -> memoryview:
+        if size == -1:
+            size = self.sz - self._idx
+        buf = self.pread(self._idx, size)
+        self._idx += size
+        return buf
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, buf)
+        self._idx += n
+        return n
+
+    def tell(self) -> int:
+        return self._idx
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            idx = offset
+        elif whence == io.SEEK_CUR:
+            idx = self._idx + offset
+        elif whence == io.SEEK_END:
+            idx = self.sz + offset
+        else:
+            raise ValueError(f"bad whence: {whence}")
+        if not (0 <= idx <= self.sz):
+            raise ValueError("out of bounds seek")
+        self._idx = idx
+        return self._idx
+
+    def close(self) -> None:
+        # raises BufferError while views handed out by pread are still alive
+        self._mv.release()
+        if self._mm is not None:
+            self._mm.close()
+
+
+@define
+class BlockCacheStats:
+    hits: int = 0
+    misses: int = 0
+    fetches: int = 0
+    fetched_bytes: int = 0
+    evictions: int = 0
+
+
+@define
+class BlockCache:
+    fetch: Final[Callable[[int, int], bytes]]
+    sz: Final[int]
+    blksz: Final[int] = 64 * 1024
+    max_bytes: Final[int] = 16 * 1024 * 1024
+    readahead_max: Final[int] = 2 * 1024 * 1024
+    stats: Final[BlockCacheStats] = field(init=False, factory=BlockCacheStats)
+    _blocks: Final[OrderedDict[int, bytes]] = field(init=False, factory=OrderedDict)
+    _cur_bytes: int = field(init=False, default=0)
+    _last_end: int = field(init=False, default=-1)
+    _readahead: int = field(init=False, default=0)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        if self.blksz <= 0:
+            raise ValueError("block size must be positive")
+
+    @property
+    def num_blocks(self) -> int:
+        return (self.sz + self.blksz - 1) // self.blksz
+
+    def _update_readahead(self, off: int, miss: bool) -> int:
+        # grow the window geometrically on every sequential miss, reset on random access
+        if off != self._last_end:
+            self._readahead = 0
+        elif miss:
+            self._readahead = min(
+                max(self._readahead * 2, self.blksz), self.readahead_max
+            )
+        return self._readahead
+
+    def _missing_runs(self, first: int, last: int) -> list[tuple[int, int]]:
+        runs: list[tuple[int, int]] = []
+        for blk in range(first, last + 1):
+            if blk in self._blocks:
+                continue
+            if runs and runs[-1][1] == blk:
+                runs[-1] = (runs[-1][0], blk + 1)
+            else:
+                runs.append((blk, blk + 1))
+        return runs
+
+    def _fill(self, first_blk: int, end_blk: int) -> None:
+        off = first_blk * self.blksz
+        size = min(end_blk * self.blksz, self.sz) - off
+        buf = self.fetch(off, size)
+        if len(buf) != size:
+            raise OSError(f"short fetch: wanted {size} bytes got {len(buf)}")
+        self.stats.fetches += 1
+        self.stats.fetched_bytes += size
+        for blk in range(first_blk, end_blk):
+            boff = (blk - first_blk) * self.blksz
+            blk_buf = buf[boff : boff + self.blksz]
+            self._blocks[blk] = blk_buf
+            self._cur_bytes += len(blk_buf)
+
+    def _evict(self) -> None:
+        while self._cur_bytes > self.max_bytes and self._blocks:
+            _, blk_buf = self._blocks.popitem(last=False)
+            self._cur_bytes -= len(blk_buf)
+            self.stats.evictions += 1
+
+    def _read(self, off: int, size: int) -> bytes:
+        first = off // self.blksz
+        last = (off + size - 1) // self.blksz
+        runs = self._missing_runs(first, last)
+        readahead = self._update_readahead(off, bool(runs))
+        if runs:
+            self.stats.misses += 1
+            if readahead:
+                ra_last = min(
+                    (off + size + readahead - 1) // self.blksz, self.num_blocks - 1
+                )
+                ra_runs = self._missing_runs(last + 1, ra_last)
+                if ra_runs and ra_runs[0][0] == runs[-1][1]:
+                    runs[-1] = (runs[-1][0], ra_runs[0][1])
+            for run_first, run_end in runs:
+                self._fill(run_first, run_end)
+        else:
+            self.stats.hits += 1
+        self._last_end = off + size
+        parts = []
+        for blk in range(first, last + 1):
+            self._blocks.move_to_end(blk)
+            parts.append(self._blocks[blk])
+        self._evict()
+        buf = b"".join(parts)
+        start = off - first * self.blksz
+        return buf[start : start + size]
+
+    def read(self, off: int, size: int) -> bytes:
+        if off < 0 or size < 0 or off + size > self.sz:
+            raise ValueError("out of bounds read")
+        if size == 0:
+            return b""
+        with self._lock:
+            return self._read(off, size)
+
+    def _clear(self) -> None:
+        self._blocks.clear()
+        self._cur_bytes = 0
+        self._last_end = -1
+        self._readahead = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+
+def pooled_session(max_conns: int = 8) -> requests.Session:
+    ses = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_conns, pool_maxsize=max_conns, pool_block=True
+    )
+    ses.mount("http://", adapter)
+    ses.mount("https://", adapter)
+    return ses
+
+
+@define(frozen=True)
+class Span:
+    off: int
+    dst_off: int
+    sz: int
+
+
+def split_spans(spans: Iterable[tuple[int, int]], max_sz: int) -> list[Span]:
+    # (src_off, dst_off, size) pieces no larger than max_sz, in destination order
+    pieces: list[Span] = []
+    dst_off = 0
+    for off, size in spans:
+        for piece_off in range(0, size, max_sz):
+            piece_sz = min(max_sz, size - piece_off)
+            pieces.append(Span(off + piece_off, dst_off + piece_off, piece_sz))
+        dst_off += size
+    return pieces
+
+
+def parse_multipart_byteranges(
+    body: bytes, content_type: str
+) -> list[tuple[int, bytes]]:
+    m = re.search(r'boundary="?([^";]+)"?', content_type)
+    if m is None:
+        raise ValueError(f"no boundary in content type: {content_type}")
+    delim = b"--" + m.group(1).encode()
+    parts = []
+    for part in body.split(delim)[1:]:
+        if part.startswith(b"--"):
+            break
+        hdrs, _, data = part.partition(b"\r\n\r\n")
+        cr = re.search(rb"Content-Range:\s*bytes (\d+)-(\d+)/", hdrs, re.IGNORECASE)
+        if cr is None:
+            raise ValueError("multipart part without Content-Range")
+        start, end = int(cr.group(1)), int(cr.group(2))
+        parts.append((start, data[: end - start + 1]))
+    return parts
+
+
+@define
+class HTTPFile(SubscriptedIOBaseMixin, SeekContextIOBaseMixin):
     url: Final[str]
-    _ses: Final[requests.Session] = field(init=False, default=requests.Session())
+    cache_blksz: Final[int] = 64 * 1024
+    cache_max_bytes: Final[int] = 16 * 1024 * 1024
+    readahead_max: Final[int] = 2 * 1024 * 1024
+    max_workers: Final[int] = 8
+    parallel_split_sz: Final[int] = 4 * 1024 * 1024
+    parallel_min_sz: Final[int] = 16 * 1024 * 1024
+    multipart: Final[bool] = False
+    max_ranges_per_request: Final[int] = 32
+    _ses: Final[Optional[requests.Session]] = field(default=None, kw_only=True)
+    # shared on-disk cache under the in-memory one, used when there's a validator
+    range_cache: Final[Optional[RangeCache]] = field(default=None, kw_only=True)
     _idx: int = field(init=False, default=0)
     _sz: Final[int] = field(init=False)
+    _validator: Final[Optional[str]] = field(init=False, default=None)
+    _cache: Final[BlockCache] = field(init=False)
+    _range_key: Optional[str] = field(init=False, default=None)
+
+    def _fetch(self, off: int, size: int) -> bytes:
+        r = self._ses.get(self.url, headers={"Range": f"bytes={off}-{off + size - 1}"})
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise OSError(f"server ignored range request for {self.url}")
+        return r.content
+
+    def _fetch_range_cached(self, off: int, size: int) -> bytes:
+        return self.range_cache.read(self._range_key, self._sz, off, size, self._fetch)
 
     def __attrs_post_init__(self) -> None:
+        if self._ses is None:
+            self._ses = pooled_session(self.max_workers)
         head_r = self._ses.head(self.url)
+        head_r.raise_for_status()
         self._sz = int(head_r.headers["Content-Length"])
+        self._validator = head_r.headers.get("ETag") or head_r.headers.get(
+            "Last-Modified"
+        )
+        fetch = self._fetch
+        if self.range_cache is not None and self._validator is not None:
+            self._range_key = self.range_cache.entry_key(self.url, self._validator)
+            fetch = self._fetch_range_cached
+        self._cache = BlockCache(
+            fetch,
+            self._sz,
+            self.cache_blksz,
+            self.cache_max_bytes,
+            self.readahead_max,
+        )
+
+    @property
+    def sz(self) -> int:
+        return self._sz
+
+    @property
+    def validator(self) -> Optional[str]:
+        return self._validator
+
+    @property
+    def cache_stats(self) -> BlockCacheStats:
+        return self._cache.stats
+
+    def _fetch_into(self, span: Span, mv: memoryview) -> None:
+        dst = mv[span.dst_off : span.dst_off + span.sz]
+        rng = f"bytes={span.off}-{span.off + span.sz - 1}"
+        with self._ses.get(self.url, headers={"Range": rng}, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise OSError(f"server ignored range request for {self.url}")
+            pos = 0
+            for chunk in r.iter_content(chunk_size=256 * 1024):
+                if pos + len(chunk) > span.sz:
+                    raise OSError(f"long fetch: wanted {span.sz} bytes got more")
+                dst[pos : pos + len(chunk)] = chunk
+                pos += len(chunk)
+        if pos != span.sz:
+            raise OSError(f"short fetch: wanted {span.sz} bytes got {pos}")
+
+    def _fetch_multipart_into(self, spans: list[Span], mv: memoryview) -> None:
+        rng = ",".join(f"{s.off}-{s.off + s.sz - 1}" for s in spans)
+        r = self._ses.get(self.url, headers={"Range": f"bytes={rng}"})
+        r.raise_for_status()
+        ctype = r.headers.get("Content-Type", "")
+        if r.status_code == 200:
+            # server ignored the ranges and sent everything
+            parts = [(0, r.content)]
+        elif ctype.startswith("multipart/byteranges"):
+            parts = parse_multipart_byteranges(r.content, ctype)
+        else:
+            # a single range came back, possibly the coalesced union of the request
+            cr = re.match(r"bytes (\d+)-", r.headers["Content-Range"])
+            parts = [(int(cr.group(1)), r.content)]
+        for span in spans:
+            for part_off, part_buf in parts:
+                src = span.off - part_off
+                if 0 <= src and src + span.sz <= len(part_buf):
+                    mv[span.dst_off : span.dst_off + span.sz] = part_buf[
+                        src : src + span.sz
+                    ]
+                    break
+            else:
+                raise OSError(f"server response is missing range {span}")
+
+    def fetch_ranges(
+        self,
+        spans: Iterable[tuple[int, int]],
+        buf: Optional[bytearray | memoryview] = None,
+    ) -> bytearray | memoryview:
+        spans = list(spans)
+        total = sum(size for _, size in spans)
+        for off, size in spans:
+            if off < 0 or size < 0 or off + size > self._sz:
+                raise ValueError("out of bounds span")
+        if buf is None:
+            buf = bytearray(total)
+        elif len(buf) < total:
+            raise ValueError("destination buffer too small")
+        mv = memoryview(buf)
+        pieces = [p for p in split_spans(spans, self.parallel_split_sz) if p.sz]
+        if self.multipart:
+            n = self.max_ranges_per_request
+            batches = [pieces[i : i + n] for i in range(0, len(pieces), n)]
+            jobs = [(self._fetch_multipart_into, b) for b in batches]
+        else:
+            jobs = [(self._fetch_into, p) for p in pieces]
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+            futs = [pool.submit(fn, arg, mv) for fn, arg in jobs]
+            for fut in futs:
+                fut.result()
+        return buf
+
+    def pread(self, offset: int, size: int) -> bytes:
+        if offset < 0 or size < 0 or offset + size > self._sz:
+            raise ValueError("out of bounds size")
+        if size >= self.parallel_min_sz:
+            # big transfers bypass the block cache so they don't flush it
+            return bytes(self.fetch_ranges([(offset, size)]))
+        return self._cache.read(offset, size)
+
+    def readinto_at(self, offset: int, buf: WritableBuffer) -> int:
+        size = len(buf)
+        if size >= self.parallel_min_sz:
+            self.fetch_ranges([(offset, size)], buf)
+        else:
+            memoryview(buf)[:] = self.pread(offset, size)
+        return size
 
     def read(self, size: int = -1) -> bytes:
         if size == -1:
             size = self._sz - self._idx
-        if self._idx + size > self._sz:
-            raise ValueError("out of bounds size")
-        buf = self._ses.get(
-            self.url, headers={"Range": f"bytes={self._idx}-{self._idx + size - 1}"}
-        ).content
-        assert len(buf) == size
+        buf = self.pread(self._idx, size)
         self._idx += size
         return buf
 
+    def readinto(self, buf: WritableBuffer) -> int:
+        n = self.readinto_at(self._idx, memoryview(buf)[: self._sz - self._idx])
+        self._idx += n
+        return n
+
     def tell(self) -> int:
         return self._idx
 
@@ -128,7 +606,15 @@ class HTTPFile(FancyRawIOBase):
         elif whence == io.SEEK_CUR:
             self._idx += offset
         elif whence == io.SEEK_END:
-            self._idx = self._sz
+            self._idx = self._sz + offset
         if not (0 <= self._idx <= self._sz):
             raise ValueError("out of bounds seek")
         return self._idx
+
+
+def open_source(
+    path_or_url: str, range_cache: Optional[RangeCache] = None
+) -> ContextManager[Any]:
+    if path_or_url.startswith(("http://", "https://")):
+        return nullcontext(HTTPFile(path_or_url, range_cache=range_cache))
+    return open(path_or_url, "rb")
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import io
+import itertools
+import logging
+import lzma
+import os
+import stat
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Final, Iterable, Iterator, Optional
+
+from attrs import define, field
+from construct import Adapter, Bytes, Const, Int64ub, Struct
+from packaging.version import Version
+from rich.console import Console
+from rich.logging import RichHandler
+
+from . import _version
+from .compression import iter_decompress
+from .fast_struct import FastStruct
+from .fs import DirEntType
+from .io_ext import ReadableBuffer, WritableBuffer, open_source
+from .xar import XARFile
+
+__all__ = [
+    "CPIO_TRAILER",
+    "CpioEntry",
+    "CpioNewcHeader",
+    "CpioOdcHeader",
+    "PBZX_MAGIC",
+    "PbzxChunkHeader",
+    "PbzxHeader",
+    "decode_pbzx_chunk",
+    "iter_cpio",
+    "iter_payload",
+    "iter_payload_chunks",
+    "iter_pbzx",
+]
+
+LOG_FORMAT = "%(message)s"
+logging.basicConfig(
+    level=logging.WARNING,
+    format=LOG_FORMAT,
+    datefmt="[%X]",
+    handlers=[RichHandler(console=Console(stderr=True), rich_tracebacks=True)],
+)
+
+program_name = "fruitsu-payload-mod"
+
+log = logging.getLogger(program_name)
+
+PBZX_MAGIC: Final[bytes] = b"pbzx"
+XZ_MAGIC: Final[bytes] = b"\xfd7zXZ\x00"
+BZIP2_MAGIC: Final[bytes] = b"BZh"
+GZIP_MAGIC: Final[bytes] = b"\x1f\x8b"
+CPIO_ODC_MAGIC: Final[bytes] = b"070707"
+CPIO_NEWC_MAGICS: Final[tuple[bytes, ...]] = (b"070701", b"070702")
+CPIO_TRAILER: Final[str] = "TRAILER!!!"
+
+PbzxHeader = Struct(
+    "magic" / Const(PBZX_MAGIC),
+    # uncompressed chunk size, usually 16 MiB
+    "flags" / Int64ub,
+)
+
+PbzxChunkHeader = Struct(
+    "uncompressed_size" / Int64ub,
+    "compressed_size" / Int64ub,
+)
+
+PbzxHeaderFast: Final[FastStruct] = FastStruct(PbzxHeader)
+PbzxChunkHeaderFast: Final[FastStruct] = FastStruct(PbzxChunkHeader)
+
+
+class _AsciiInt(Adapter):
+    # fixed width ASCII number fields of the cpio character headers
+    def __init__(self, width: int, base: int) -> None:
+        super().__init__(Bytes(width))
+        self.width = width
+        self.base = base
+
+    def _decode(self, obj: bytes, context: Any, path: Any) -> int:
+        return int(obj, self.base)
+
+    def _encode(self, obj: int, context: Any, path: Any) -> bytes:
+        spec = "o" if self.base == 8 else "X"
+        return f"{obj:0{self.width}{spec}}".encode()
+
+
+def _Octal(width: int) -> _AsciiInt:
+    return _AsciiInt(width, 8)
+
+
+def _Hex(width: int) -> _AsciiInt:
+    return _AsciiInt(width, 16)
+
+
+# POSIX.1 portable format, what Apple's pax writes into payloads
+CpioOdcHeader = Struct(
+    "c_magic" / Const(CPIO_ODC_MAGIC),
+    "c_dev" / _Octal(6),
+    "c_ino" / _Octal(6),
+    "c_mode" / _Octal(6),
+    "c_uid" / _Octal(6),
+    "c_gid" / _Octal(6),
+    "c_nlink" / _Octal(6),
+    "c_rdev" / _Octal(6),
+    "c_mtime" / _Octal(11),
+    "c_namesize" / _Octal(6),
+    "c_filesize" / _Octal(11),
+)
+
+# SVR4 format, names and data are padded to 4 bytes
+CpioNewcHeader = Struct(
+    "c_magic" / Bytes(6),
+    "c_ino" / _Hex(8),
+    "c_mode" / _Hex(8),
+    "c_uid" / _Hex(8),
+    "c_gid" / _Hex(8),
+    "c_nlink" / _Hex(8),
+    "c_mtime" / _Hex(8),
+    "c_filesize" / _Hex(8),
+    "c_devmajor" / _Hex(8),
+    "c_devminor" / _Hex(8),
+    "c_rdevmajor" / _Hex(8),
+    "c_rdevminor" / _Hex(8),
+    "c_namesize" / _Hex(8),
+    "c_check" / _Hex(8),
+)
+
+CpioOdcHeaderFast: Final[FastStruct] = FastStruct(CpioOdcHeader)
+CpioNewcHeaderFast: Final[FastStruct] = FastStruct(CpioNewcHeader)
+
+
+def _read_exact(fh: Any, size: int, eof_ok: bool = False) -> Optional[bytes]:
+    buf = bytearray(size)
+    mv = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = fh.readinto(mv[pos:])
+        if not n:
+            if eof_ok and pos == 0:
+                return None
+            raise ValueError(f"truncated payload: wanted {size} bytes got {pos}")
+        pos += n
+    return bytes(buf)
+
+
+def _iter_reads(fh: Any, chunk_sz: int) -> Iterator[bytes]:
+    while True:
+        buf = bytearray(chunk_sz)
+        n = fh.readinto(buf)
+        if not n:
+            return
+        yield bytes(buf[:n])
+
+
+def decode_pbzx_chunk(src: ReadableBuffer, out_sz: int) -> bytes:
+    # chunks that didn't compress are stored without the xz wrapper
+    if bytes(src[: len(XZ_MAGIC)]) == XZ_MAGIC:
+        out = lzma.decompress(src, lzma.FORMAT_XZ)
+    else:
+        out = bytes(src)
+    if len(out) != out_sz:
+        raise ValueError(f"pbzx chunk decoded to {len(out)} bytes not {out_sz}")
+    return out
+
+
+def iter_pbzx(
+    fh: Any,
+    workers: Optional[int] = None,
+    max_inflight: Optional[int] = None,
+    hdr_buf: Optional[bytes] = None,
+) -> Iterator[bytes]:
+    # chunks are independent xz streams, decoded in parallel (lzma drops the
+    # GIL) and yielded in order with at most max_inflight chunks buffered
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_inflight is None:
+        max_inflight = 2 * workers
+    if hdr_buf is None:
+        hdr_buf = _read_exact(fh, PbzxHeaderFast.fixed_sz)
+    PbzxHeaderFast.parse(hdr_buf)
+    inflight: collections.deque[Future] = collections.deque()
+    eof = False
+    with ThreadPoolExecutor(workers) as pool:
+        try:
+            while True:
+                while not eof and len(inflight) < max_inflight:
+                    chdr_buf = _read_exact(fh, PbzxChunkHeaderFast.fixed_sz, True)
+                    if chdr_buf is None:
+                        eof = True
+                        break
+                    chdr = PbzxChunkHeaderFast.parse(chdr_buf)
+                    src = _read_exact(fh, chdr.compressed_size)
+                    inflight.append(
+                        pool.submit(decode_pbzx_chunk, src, chdr.uncompressed_size)
+                    )
+                if not inflight:
+                    break
+                yield inflight.popleft().result()
+        finally:
+            for pending in inflight:
+                pending.cancel()
+
+
+def iter_payload_chunks(
+    fh: Any, workers: Optional[int] = None, chunk_sz: int = 1024 * 1024
+) -> Iterator[bytes]:
+    # decompressed cpio stream of a pkg Payload, pbzx or a plain compressed or
+    # uncompressed cpio archive
+    head = _read_exact(fh, PbzxHeaderFast.fixed_sz, True) or b""
+    if head.startswith(PBZX_MAGIC):
+        yield from iter_pbzx(fh, workers, hdr_buf=head)
+        return
+    chunks = itertools.chain([head], _iter_reads(fh, chunk_sz))
+    if head.startswith(XZ_MAGIC):
+        yield from iter_decompress(chunks, "lzma", chunk_sz)
+    elif head.startswith(BZIP2_MAGIC):
+        yield from iter_decompress(chunks, "bzip2", chunk_sz)
+    elif head.startswith(GZIP_MAGIC):
+        yield from iter_decompress(chunks, "gzip", chunk_sz)
+    else:
+        yield from chunks
+
+
+class _ChunkStream:
+    # byte stream over an iterator of chunks, without joining them
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._cur = memoryview(b"")
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        while not self._cur:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._cur = memoryview(chunk)
+        return True
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        out = memoryview(buf).cast("B")
+        if not out or not self._fill():
+            return 0
+        n = min(len(out), len(self._cur))
+        out[:n] = self._cur[:n]
+        self._cur = self._cur[n:]
+        self.pos += n
+        return n
+
+    def read_exact(self, size: int) -> bytes:
+        if len(self._cur) >= size:
+            # the common case of a header inside one chunk
+            buf = bytes(self._cur[:size])
+            self._cur = self._cur[size:]
+            self.pos += size
+            return buf
+        return _read_exact(self, size)
+
+    def skip(self, size: int) -> None:
+        while size:
+            if not self._fill():
+                raise ValueError(f"truncated payload: {size} bytes missing")
+            n = min(size, len(self._cur))
+            self._cur = self._cur[n:]
+            self.pos += n
+            size -= n
+
+
+class _EntryReader(io.RawIOBase):
+    # data of one cpio entry, valid until the iterator moves to the next one
+    def __init__(self, stream: _ChunkStream, size: int) -> None:
+        self._stream = stream
+        self.remaining = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        mv = memoryview(buf).cast("B")[: self.remaining]
+        n = self._stream.readinto(mv) if mv else 0
+        if mv and not n:
+            raise ValueError("truncated payload inside entry data")
+        self.remaining -= n
+        return n
+
+
+@define
+class CpioEntry:
+    name: str
+    mode: int
+    size: int
+    uid: int = 0
+    gid: int = 0
+    nlink: int = 1
+    mtime: int = 0
+    ino: int = 0
+    dev: int = 0
+    rdev: int = 0
+    link: Optional[str] = None
+    _reader: Optional[_EntryReader] = field(default=None, repr=False)
+
+    @property
+    def type(self) -> Optional[DirEntType]:
+        if stat.S_ISDIR(self.mode):
+            return DirEntType.DIR
+        if stat.S_ISLNK(self.mode):
+            return DirEntType.LNK
+        if stat.S_ISREG(self.mode):
+            return DirEntType.REG
+        # devices, fifos and sockets
+        return None
+
+    @property
+    def path(self) -> str:
+        return self.name[2:] if self.name.startswith("./") else self.name
+
+    def open(self) -> io.BufferedReader:
+        if self._reader is None:
+            raise ValueError(f"{self.name} has no data")
+        return io.BufferedReader(self._reader)
+
+
+def iter_cpio(chunks: Iterable[bytes]) -> Iterator[CpioEntry]:
+    stream = _ChunkStream(chunks)
+    reader: Optional[_EntryReader] = None
+    pad = 0
+    while True:
+        if reader is not None:
+            # whatever the consumer didn't read of the previous entry
+            stream.skip(reader.remaining + pad)
+            reader.remaining = 0
+            reader = None
+        elif pad:
+            stream.skip(pad)
+        magic = stream.read_exact(6)
+        if magic == CPIO_ODC_MAGIC:
+            hdr_buf = magic + stream.read_exact(CpioOdcHeaderFast.fixed_sz - 6)
+            hdr = CpioOdcHeaderFast.parse(hdr_buf)
+            name_pad = data_align = 1
+            dev, rdev = hdr.c_dev, hdr.c_rdev
+        elif magic in CPIO_NEWC_MAGICS:
+            hdr_buf = magic + stream.read_exact(CpioNewcHeaderFast.fixed_sz - 6)
+            hdr = CpioNewcHeaderFast.parse(hdr_buf)
+            name_pad = data_align = 4
+            dev = os.makedev(hdr.c_devmajor, hdr.c_devminor)
+            rdev = os.makedev(hdr.c_rdevmajor, hdr.c_rdevminor)
+        else:
+            raise ValueError(f"bad cpio magic {magic!r} at offset {stream.pos - 6}")
+        name_end = len(hdr_buf) + hdr.c_namesize
+        name_buf = stream.read_exact(-name_end % name_pad + hdr.c_namesize)
+        name = (
+            name_buf[: hdr.c_namesize].rstrip(b"\0").decode("utf-8", "surrogateescape")
+        )
+        if name == CPIO_TRAILER:
+            return
+        size = hdr.c_filesize
+        pad = -size % data_align
+        entry = CpioEntry(
+            name,
+            hdr.c_mode,
+            size,
+            hdr.c_uid,
+            hdr.c_gid,
+            hdr.c_nlink,
+            hdr.c_mtime,
+            hdr.c_ino,
+            dev,
+            rdev,
+        )
+        if stat.S_ISLNK(hdr.c_mode):
+            # the target is the data, small enough to read eagerly
+            entry.link = stream.read_exact(size).decode("utf-8", "surrogateescape")
+            entry.size = 0
+        elif size:
+            reader = entry._reader = _EntryReader(stream, size)
+        yield entry
+
+
+def iter_payload(fh: Any, workers: Optional[int] = None) -> Iterator[CpioEntry]:
+    return iter_cpio(iter_payload_chunks(fh, workers))
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=program_name)
+    parser.add_argument("-v", "--verbose", action="store_true", help="be verbose")
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s version: {Version(_version.version)}",
+    )
+    subparsers = parser.add_subparsers(dest="cmd")
+    list_parser = subparsers.add_parser("list", help="list the files in a Payload")
+    list_parser.add_argument(
+        "payload", help="Payload or pkg path or URL", metavar="PAYLOAD"
+    )
+    list_parser.add_argument(
+        "-m",
+        "--member",
+        default=None,
+        help="Payload member inside a pkg XAR, e.g. Payload",
+    )
+    list_parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="decompression workers"
+    )
+    return parser
+
+
+def list_main(args: argparse.Namespace) -> int:
+    with open_source(args.payload) as src:
+        if args.member is not None:
+            xar = XARFile(src)
+            ino = xar.toc.rootfs.lookup(args.member)
+            if ino is None:
+                print(f"no member {args.member} in {args.payload}")
+                return 1
+            src = xar.open_member(ino)
+        n = total = 0
+        for entry in iter_payload(src, args.jobs):
+            link = f" -> {entry.link}" if entry.link is not None else ""
+            print(f"{stat.filemode(entry.mode)} {entry.size:>12} {entry.path}{link}")
+            n += 1
+            total += entry.size
+    log.info(f"{n} entries, {total} bytes")
+    return 0
+
+
+def real_main(args: argparse.Namespace) -> int:
+    verbose: Final[bool] = args.verbose
+    if verbose:
+        log.setLevel(logging.INFO)
+        log.info(f"{program_name}: verbose mode enabled")
+    if args.cmd == "list":
+        return list_main(args)
+    return 0
+
+
+def main() -> int:
+    try:
+        args = get_arg_parser().parse_args()
+        return real_main(args)
+    except Exception:
+        log.exception(f"Received an unexpected exception when running {program_name}")
+        return 1
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Final, Generator, Optional
+
+from attrs import define, field
+
+__all__ = [
+    "RangeCache",
+    "default_range_cache_dir",
+]
+
+RANGE_CACHE_VERSION: Final[int] = 1
+RANGE_CACHE_LOCK_NAME: Final[str] = "lock"
+
+# usage counter kept in the lock file, only touched while it is flocked
+_USAGE: Final[struct.Struct] = struct.Struct("<Q")
+
+
+def _touch(path: str | os.PathLike) -> None:
+    # mtime is the LRU clock, set explicitly since file timestamps are often
+    # coarser than the gap between accesses
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+
+def default_range_cache_dir() -> Path:
+    if env_dir := os.environ.get("FRUITSU_RANGE_CACHE_DIR"):
+        return Path(env_dir)
+    xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return Path(xdg) / "fruitsu" / "ranges"
+
+
+@define
+class RangeCache:
+    # on-disk block cache for remote files shared by every process using root,
+    # entries are keyed by URL plus validator so a changed object never hits
+    root: Final[Path] = field(factory=default_range_cache_dir, converter=Path)
+    max_bytes: Final[int] = 1024 * 1024 * 1024
+    blksz: Final[int] = 64 * 1024
+    # eviction trims down to this fraction of max_bytes so it runs rarely
+    low_water: Final[float] = 0.9
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+    stores: int = field(init=False, default=0)
+    stored_bytes: int = field(init=False, default=0)
+    evictions: int = field(init=False, default=0)
+    _lock: Final[threading.Lock] = field(init=False, factory=threading.Lock)
+
+    def __attrs_post_init__(self) -> None:
+        if self.blksz <= 0:
+            raise ValueError("block size must be positive")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def entry_key(self, url: str, validator: str) -> str:
+        h = hashlib.sha256()
+        for part in (str(RANGE_CACHE_VERSION), url, validator, str(self.blksz)):
+            h.update(struct.pack("<Q", len(part)) + part.encode())
+        return h.hexdigest()
+
+    def _block_path(self, key: str, blk: int) -> Path:
+        return self.root / key[:2] / key / f"{blk:x}"
+
+    @contextmanager
+    def _locked(self) -> Generator[int, None, None]:
+        # a fresh open file description per holder so flock also excludes
+        # other threads of this process
+        fd = os.open(self.root / RANGE_CACHE_LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            os.close(fd)
+
+    def _usage(self, fd: int) -> int:
+        buf = os.pread(fd, _USAGE.size, 0)
+        return _USAGE.unpack(buf)[0] if len(buf) == _USAGE.size else 0
+
+    @property
+    def usage(self) -> int:
+        with self._locked() as fd:
+            return self._usage(fd)
+
+    def get(self, key: str, blk: int, size: int) -> Optional[bytes]:
+        path = self._block_path(key, blk)
+        try:
+            with open(path, "rb") as f:
+                buf = f.read(size + 1)
+        except OSError:
+            buf = None
+        else:
+            try:
+                _touch(path)
+            except OSError:
+                pass
+        hit = buf is not None and len(buf) == size
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return buf if hit else None
+
+    def _blocks(self) -> list[tuple[int, int, str]]:
+        blocks = []
+        for outer in os.scandir(self.root):
+            if not outer.is_dir():
+                continue
+            for entry in os.scandir(outer.path):
+                for blk in os.scandir(entry.path):
+                    if blk.name.startswith("."):
+                        continue
+                    try:
+                        st = blk.stat()
+                    except FileNotFoundError:
+                        continue
+                    blocks.append((st.st_mtime_ns, st.st_size, blk.path))
+        return blocks
+
+    def _evict(self, target: int) -> int:
+        # called with the lock held, recounts usage from disk so a counter
+        # left stale by a crashed process heals itself
+        blocks = sorted(self._blocks())
+        usage = sum(size for _, size, _ in blocks)
+        evicted = 0
+        for _, size, path in blocks:
+            if usage <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            usage -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return usage
+
+    def put(self, key: str, blk: int, buf: bytes) -> None:
+        path = self._block_path(key, blk)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write-then-rename so concurrent readers never see a partial block
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(buf)
+            with self._locked() as lock_fd:
+                if path.exists():
+                    # another process got here first
+                    os.unlink(tmp_path)
+                    return
+                _touch(tmp_path)
+                os.replace(tmp_path, path)
+                usage = self._usage(lock_fd) + len(buf)
+                if usage > self.max_bytes:
+                    usage = self._evict(int(self.max_bytes * self.low_water))
+                os.pwrite(lock_fd, _USAGE.pack(usage), 0)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self.stores += 1
+            self.stored_bytes += len(buf)
+
+    def read(
+        self,
+        key: str,
+        sz: int,
+        off: int,
+        size: int,
+        fetch: Callable[[int, int], bytes],
+    ) -> bytes:
+        # bytes [off, off + size) of an object of sz bytes, fetching and
+        # storing only the blocks that aren't on disk yet
+        if off < 0 or size < 0 or off + size > sz:
+            raise ValueError("out of bounds read")
+        if size == 0:
+            return b""
+        bs = self.blksz
+        first = off // bs
+        last = (off + size - 1) // bs
+        blocks: dict[int, bytes] = {}
+        runs: list[tuple[int, int]] = []
+        for blk in range(first, last + 1):
+            buf = self.get(key, blk, min(bs, sz - blk * bs))
+            if buf is not None:
+                blocks[blk] = buf
+            elif runs and runs[-1][1] == blk:
+                runs[-1] = (runs[-1][0], blk + 1)
+            else:
+                runs.append((blk, blk + 1))
+        for run_first, run_end in runs:
+            run_off = run_first * bs
+            run_sz = min(run_end * bs, sz) - run_off
+            buf = fetch(run_off, run_sz)
+            if len(buf) != run_sz:
+                raise OSError(f"short fetch: wanted {run_sz} bytes got {len(buf)}")
+            for blk in range(run_first, run_end):
+                blk_buf = bytes(
+                    buf[(blk - run_first) * bs : (blk - run_first + 1) * bs]
+                )
+                try:
+                    self.put(key, blk, blk_buf)
+                except OSError:
+                    # a full or read-only cache must not fail the read
+                    pass
+                blocks[blk] = blk_buf
+        buf = b"".join(blocks[blk] for blk in range(first, last + 1))
+        start = off - first * bs
+        return buf[start : start + size]
+
+    def clear(self) -> None:
+        with self._locked() as lock_fd:
+            for _, _, path in self._blocks():
+                os.unlink(path)
+            os.pwrite(lock_fd, _USAGE.pack(0), 0)
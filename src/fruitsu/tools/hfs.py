@@ -28,6 +28,13 @@ log = logging.getLogger(program_name)
 def get_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description=program_name)
     parser.add_argument("path", type=Path, help="input HFS image", metavar="HFS_IMG")
+    parser.add_argument(
+        "-c",
+        "--dump-catalog",
+        type=Path,
+        help="write the raw catalog file here",
+        metavar="OUT",
+    )
     parser.add_argument("-v", "--verbose", action="store_true", help="be verbose")
     parser.add_argument(
         "--version",
@@ -42,13 +49,13 @@ def real_main(args: argparse.Namespace) -> int:
     if verbose:
         log.setLevel(logging.INFO)
         log.info(f"{program_name}: verbose mode enabled")
-    if args.version:
-        print(f"{program_name} version: {Version(_version.version)}")
-        return 0
     with open(args.path, "rb") as hfs_fh:
         hfs_file = hfs.HFS(OffsetRawIOBase(hfs_fh))
         print(f"hfs: {hfs_file}")
         hfs_file.dump()
+        if args.dump_catalog is not None:
+            sz = hfs_file.dump_catalog(args.dump_catalog)
+            print(f"wrote {sz} catalog bytes to {args.dump_catalog}")
     return 0
 
 
@@ -1,17 +1,41 @@
 import argparse
+import collections
+import datetime
 import enum
+import hashlib
 import io
+import itertools
 import logging
+import lzma
+import math
+import os
+import shutil
+import struct
 import sys
+import time
 import zlib
-from typing import Any, BinaryIO, Collection, Container, Final, Mapping, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Collection,
+    Container,
+    Final,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Self,
+)
+from xml.parsers import expat
 
 import fs.opener.registry
-import untangle
+import fs.path
 from attrs import define, field
 from construct import Enum, Int16ub, Int32ub, Int64ub, Padding, Struct, Tell, this
 from fs.base import FS
-from fs.errors import ResourceNotFound
+from fs.errors import FileExpected, ResourceNotFound, ResourceReadOnly
 from fs.info import Info
 from fs.opener.errors import NotWriteable
 from fs.opener.parse import ParseResult
@@ -22,8 +46,18 @@ from rich.console import Console
 from rich.logging import RichHandler
 
 from . import _version
-from .fs import DirEntType, INode
-from .io_ext import FancyRawIOBase, OffsetRawIOBase
+from .compression import DecompressingRawIO, iter_decompress
+from .fast_struct import FastStruct
+from .fs import Column, DirEntType, FloatColumn, INode, INodeTable, StrColumn
+from .index_cache import IndexCache, IndexEntry, index_key, source_stamp
+from .io_ext import (
+    FancyRawIOBase,
+    OffsetRawIOBase,
+    ReadableBuffer,
+    WritableBuffer,
+    iter_chunks,
+    preallocate,
+)
 
 LOG_FORMAT = "%(message)s"
 logging.basicConfig(
@@ -41,10 +75,16 @@ log = logging.getLogger(program_name)
 __all__ = [
     "ChecksumAlgorithmEnum",
     "ChecksumAlgorithm",
+    "ExtractStats",
+    "XARChecksumMismatch",
+    "XARVerifyReport",
     "XARTOC",
     "XARFile",
     "XARFS",
     "XARHeader",
+    "XARHeaderFast",
+    "XARINode",
+    "XARMetadata",
 ]
 
 
@@ -69,69 +109,687 @@ XARHeader = Struct(
     "padding" / Padding(this.size - this._padding_begin),
 )
 
+XARHeaderFast: Final[FastStruct] = FastStruct(XARHeader)
+
+XAR_HEADER_MIN_SZ: Final[int] = 28
+
+XAR_CKSUM_SIZES: Final[dict[ChecksumAlgorithmEnum, int]] = {
+    ChecksumAlgorithmEnum.sha1: 20,
+    ChecksumAlgorithmEnum.md5: 16,
+    ChecksumAlgorithmEnum.sha256: 32,
+    ChecksumAlgorithmEnum.sha512: 64,
+}
+
+# checksum style, checksum offset, checksum size, creation time
+XAR_INDEX_TOC: Final[struct.Struct] = struct.Struct("<Iqqd")
+
+
+MAX_SYMLINK_HOPS: Final[int] = 40
+
+XAR_ENCODINGS: Final[dict[str, Optional[str]]] = {
+    "application/octet-stream": None,
+    "application/x-gzip": "zlib",
+    "application/x-bzip2": "bzip2",
+    "application/x-lzma": "lzma",
+    "application/x-xz": "lzma",
+}
+
+
+XAR_FILE_TYPES: Final[dict[str, DirEntType]] = {
+    "directory": DirEntType.DIR,
+    "file": DirEntType.REG,
+    "hardlink": DirEntType.REG,
+    "symlink": DirEntType.LNK,
+}
+
+
+def _parse_xar_time(s: str) -> Optional[float]:
+    # e.g. 2022-02-12T02:54:04Z, strptime is too slow for huge TOCs
+    try:
+        return datetime.datetime(
+            int(s[0:4]),
+            int(s[5:7]),
+            int(s[8:10]),
+            int(s[11:13]),
+            int(s[14:16]),
+            int(s[17:19]),
+            tzinfo=datetime.timezone.utc,
+        ).timestamp()
+    except ValueError:
+        return None
+
+
+class XARINode(INode):
+    __slots__ = ()
+
+    data_len = Column()
+    encoding = StrColumn()
+    link = StrColumn()
+    # inode of the original for hardlinks, which carry no data of their own
+    hardlink = Column()
+    mode = Column()
+    uid = Column()
+    gid = Column()
+    mtime = FloatColumn()
+    ctime = FloatColumn()
+    atime = FloatColumn()
+    _ext_cksum_style = StrColumn()
+    _ext_cksum = StrColumn()
+    _arc_cksum_style = StrColumn()
+    _arc_cksum = StrColumn()
+
+    @property
+    def extracted_cksum(self) -> Optional[tuple[str, str]]:
+        if self._ext_cksum is None:
+            return None
+        return self._ext_cksum_style, self._ext_cksum
+
+    @extracted_cksum.setter
+    def extracted_cksum(self, value: Optional[tuple[str, str]]) -> None:
+        self._ext_cksum_style, self._ext_cksum = value or (None, None)
+
+    @property
+    def archived_cksum(self) -> Optional[tuple[str, str]]:
+        if self._arc_cksum is None:
+            return None
+        return self._arc_cksum_style, self._arc_cksum
+
+    @archived_cksum.setter
+    def archived_cksum(self, value: Optional[tuple[str, str]]) -> None:
+        self._arc_cksum_style, self._arc_cksum = value or (None, None)
+
+    @property
+    def codec(self) -> Optional[str]:
+        if self.encoding is None:
+            return None
+        try:
+            return XAR_ENCODINGS[self.encoding]
+        except KeyError:
+            raise ValueError(f"unsupported XAR encoding: {self.encoding}") from None
+
+    def _set_file_field(self, tag: str, text: str) -> None:
+        if tag == "name":
+            self.name = text
+        elif tag == "type":
+            self.type = XAR_FILE_TYPES.get(text, DirEntType.REG)
+        elif tag == "link":
+            self.link = text
+        elif tag == "mode":
+            self.mode = int(text, 8)
+        elif tag == "uid":
+            self.uid = int(text)
+        elif tag == "gid":
+            self.gid = int(text)
+        elif tag == "mtime":
+            self.mtime = _parse_xar_time(text)
+        elif tag == "ctime":
+            self.ctime = _parse_xar_time(text)
+        elif tag == "atime":
+            self.atime = _parse_xar_time(text)
+
+    def _set_data_field(self, tag: str, text: str, attrs: dict[str, str]) -> None:
+        if tag == "offset":
+            self.data_off = int(text)
+        elif tag == "length":
+            self.data_len = int(text)
+        elif tag == "size":
+            self.size = int(text)
+        elif tag == "encoding":
+            self.encoding = attrs.get("style")
+        elif tag == "extracted-checksum":
+            self.extracted_cksum = (attrs.get("style"), text.strip().lower())
+        elif tag == "archived-checksum":
+            self.archived_cksum = (attrs.get("style"), text.strip().lower())
+
+    def _link_to(self, orig: Self) -> None:
+        self.hardlink = orig.idx
+        self.size = orig.size
+        self.size_comp = orig.size_comp
+        self.data_off = orig.data_off
+        self.data_len = orig.data_len
+        self.encoding = orig.encoding
+        self.extracted_cksum = orig.extracted_cksum
+        self.archived_cksum = orig.archived_cksum
+
+    def _finish(self) -> None:
+        if self.type != DirEntType.REG:
+            self.size = 0
+            self.data_off = self.data_len = self.encoding = None
+        elif self.encoding is not None and self.codec is not None:
+            self.size_comp = self.data_len
+
 
 @define
 class XARTOC:
-    rootfs: Final[INode]
+    rootfs: Final[XARINode]
+    cksum_style: Optional[str] = None
+    cksum_off: Optional[int] = None
+    cksum_sz: Optional[int] = None
+    creation_time: Optional[float] = None
 
     @classmethod
-    def from_xml(cls, xml):
-        xml = untangle.parse(xml)
-        root = INode.root_node()
-        print("TREE:")
-        root.dump()
-        print("/TREE")
-
-        def add_files_children(node, file):
-            if hasattr(file, "file"):
-                for f in file.file:
-                    name = f.name.cdata
-                    ty = {
-                        "directory": DirEntType.DIR,
-                        "file": DirEntType.REG,
-                        "symlink": DirEntType.LNK,
-                    }[f.type.cdata]
-                    sz = 0
-                    sz_comp = None
-                    if ty == DirEntType.REG:
-                        sz = int(f.data.size.cdata)
-                        if f.data.encoding["style"] != "application/octet-stream":
-                            sz_comp = int(f.data.length.cdata)
-                    child_node = INode(
-                        parent=node, name=name, size=sz, size_comp=sz_comp, type=ty
-                    )
-                    add_files_children(child_node, f)
-
-        add_files_children(root, xml.xar.toc)
-
-        return cls(rootfs=root)
+    def from_xml(cls, xml: str | bytes) -> Self:
+        if isinstance(xml, str):
+            xml = xml.encode("utf-8")
+        return cls.from_chunks([xml])
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[ReadableBuffer]) -> Self:
+        # single pass SAX parse with explicit stacks, no element tree is built
+        # so memory stays bounded no matter how many <file> entries there are
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        root = XARINode.root_node()
+        toc_info: dict[str, Any] = {}
+        inodes = [root]
+        file_ids: list[Optional[str]] = [None]
+        # xar tags the first hardlink "original", the rest point at its id
+        originals: dict[str, XARINode] = {}
+        hardlinks: list[tuple[XARINode, str]] = []
+        tags = [""]
+        text: list[str] = []
+        cur_attrs: dict[str, str] = {}
+
+        def start(tag: str, attrs: dict[str, str]) -> None:
+            nonlocal cur_attrs
+            if tag == "file":
+                inodes.append(inodes[-1].add_child("", DirEntType.REG))
+                file_ids.append(attrs.get("id"))
+            elif tag == "checksum" and tags[-1] == "toc":
+                toc_info["cksum_style"] = attrs.get("style")
+            tags.append(tag)
+            text.clear()
+            cur_attrs = attrs
+
+        def end(tag: str) -> None:
+            tags.pop()
+            parent_tag = tags[-1]
+            if tag == "file":
+                inodes.pop()._finish()
+                file_ids.pop()
+            elif parent_tag == "file":
+                inodes[-1]._set_file_field(tag, "".join(text))
+                if tag == "type" and (link := cur_attrs.get("link")) is not None:
+                    if link == "original":
+                        originals[file_ids[-1]] = inodes[-1]
+                    else:
+                        hardlinks.append((inodes[-1], link))
+            elif parent_tag == "data" and tags[-2] == "file":
+                inodes[-1]._set_data_field(tag, "".join(text), cur_attrs)
+            elif parent_tag == "toc" and tag == "creation-time":
+                toc_info["creation_time"] = _parse_xar_time("".join(text))
+            elif parent_tag == "checksum" and tags[-2] == "toc":
+                if tag == "offset":
+                    toc_info["cksum_off"] = int("".join(text))
+                elif tag == "size":
+                    toc_info["cksum_sz"] = int("".join(text))
+            text.clear()
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text.append
+        for chunk in chunks:
+            parser.Parse(bytes(chunk), False)
+        parser.Parse(b"", True)
+        for ino, orig_id in hardlinks:
+            orig = originals.get(orig_id)
+            if orig is None:
+                raise ValueError(f"hardlink {ino.name} to unknown file id {orig_id}")
+            ino._link_to(orig)
+        return cls(root, **toc_info)
+
+    def to_index(self) -> list[bytes]:
+        toc_rec = XAR_INDEX_TOC.pack(
+            self.rootfs.table.intern(self.cksum_style),
+            -1 if self.cksum_off is None else self.cksum_off,
+            -1 if self.cksum_sz is None else self.cksum_sz,
+            math.nan if self.creation_time is None else self.creation_time,
+        )
+        return [toc_rec, *self.rootfs.table.to_sections()]
+
+    @classmethod
+    def from_index(cls, entry: IndexEntry) -> Self:
+        toc_buf, *table_sections = entry.sections
+        table = INodeTable.from_sections(XARINode, table_sections)
+        cksum_style, cksum_off, cksum_sz, ctime = XAR_INDEX_TOC.unpack(toc_buf)
+        return cls(
+            table.root,
+            cksum_style=table.string(cksum_style),
+            cksum_off=None if cksum_off == -1 else cksum_off,
+            cksum_sz=None if cksum_sz == -1 else cksum_sz,
+            creation_time=None if math.isnan(ctime) else ctime,
+        )
+
+    def walk(self) -> Iterator[tuple[tuple[str, ...], XARINode]]:
+        # pre-order, parents before children, names validated for extraction
+        stack = [((), self.rootfs)]
+        while stack:
+            path, node = stack.pop()
+            if path:
+                yield path, node
+            for child in reversed(node.children):
+                if child.name in ("", ".", "..") or "/" in child.name:
+                    raise ValueError(f"unsafe path component: {child.name!r}")
+                stack.append((path + (child.name,), child))
 
     def dump(self):
         print(self)
 
 
+@define
+class ExtractStats:
+    files: int = 0
+    dirs: int = 0
+    links: int = 0
+    total_files: int = 0
+    total_bytes: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    start: float = field(factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        # extracted bytes per second
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        return self.bytes_out / elapsed if elapsed > 0 else 0.0
+
+
+@define
+class XARChecksumMismatch:
+    path: str
+    # "toc", "archived" or "extracted"
+    kind: str
+    style: str
+    expected: str
+    actual: str
+    # set when the member couldn't be read or decompressed at all
+    error: Optional[str] = None
+
+
+@define
+class XARVerifyReport:
+    toc_style: Optional[str] = None
+    # None when the archive has no TOC checksum
+    toc_ok: Optional[bool] = None
+    checked: int = 0
+    total: int = 0
+    # members without a checksum or with an unsupported style
+    skipped: list[str] = field(factory=list)
+    mismatches: list[XARChecksumMismatch] = field(factory=list)
+    bytes_hashed: int = 0
+    start: float = field(factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.toc_ok is not False and not self.mismatches
+
+    @property
+    def throughput(self) -> float:
+        # hashed bytes per second
+        elapsed = self.elapsed or time.perf_counter() - self.start
+        return self.bytes_hashed / elapsed if elapsed > 0 else 0.0
+
+
+def _new_hash(style: Optional[str]) -> Optional[Any]:
+    if style is None:
+        return None
+    try:
+        return hashlib.new(style.lower())
+    except ValueError:
+        return None
+
+
+class _VerifyingRawIO(io.RawIOBase):
+    # hashes a member as it is streamed front to back and checks the digest
+    # when the last byte is read, a seek off the hashed prefix gives up
+    def __init__(self, raw: DecompressingRawIO, name: str, cksum: tuple[str, str]):
+        super().__init__()
+        self.raw = raw
+        self.name = name
+        self.style, self.expected = cksum
+        self._hash = _new_hash(self.style)
+        self._hashed = 0
+        # None until the whole member has been hashed
+        self.verified: Optional[bool] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.raw.tell()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.raw.seek(offset, whence)
+
+    def close(self) -> None:
+        self.raw.close()
+        super().close()
+
+    def _finish(self) -> None:
+        actual = self._hash.hexdigest()
+        self._hash = None
+        self.verified = actual == self.expected
+        if not self.verified:
+            raise ValueError(
+                f"{self.name}: {self.style} checksum mismatch, "
+                f"expected {self.expected} got {actual}"
+            )
+
+    def readinto(self, buf: WritableBuffer) -> int:
+        pos = self.raw.tell()
+        n = self.raw.readinto(buf)
+        if self._hash is None:
+            return n
+        if pos != self._hashed:
+            self._hash = None
+            return n
+        self._hash.update(memoryview(buf)[:n])
+        self._hashed += n
+        if self._hashed == self.raw.size:
+            self._finish()
+        return n
+
+
+def _write_member(
+    out_path: str, ino: XARINode, chunks: Iterable[ReadableBuffer]
+) -> int:
+    codec = ino.codec
+    if codec is not None:
+        chunks = iter_decompress(chunks, codec)
+    written = 0
+    with open(out_path, "wb") as f:
+        preallocate(f.fileno(), ino.size)
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+        if written != ino.size:
+            raise ValueError(
+                f"{out_path}: extracted {written} bytes, expected {ino.size}"
+            )
+    return written
+
+
+def _extract_buffer(out_path: str, ino: XARINode, src_buf: ReadableBuffer) -> int:
+    return _write_member(out_path, ino, [src_buf] if src_buf else [])
+
+
+@define
+class XARMetadata:
+    # header and TOC parsed off an async source, handed to a sync XARFile
+    hdr: Final[Container[Any]]
+    toc: Final[XARTOC]
+
+    @classmethod
+    async def from_async(cls, afh) -> Self:
+        hdr_buf = await afh.pread(0, XAR_HEADER_MIN_SZ)
+        hdr_sz = Int16ub.parse(hdr_buf[4:6])
+        if hdr_sz > len(hdr_buf):
+            hdr_buf += await afh.pread(len(hdr_buf), hdr_sz - len(hdr_buf))
+        hdr = XARHeaderFast.parse(hdr_buf)
+        xml_comp_buf = await afh.pread(hdr.size, hdr.toc_length_compressed)
+        toc = XARTOC.from_chunks(iter_decompress([xml_comp_buf], "zlib"))
+        return cls(hdr, toc)
+
+
 @define
 class XARFile:
     fh: Final[FancyRawIOBase] = field(converter=FancyRawIOBase)
     hdr: Container[Any] = field(init=False)
     toc: Final[XARTOC] = field(init=False)
+    index_cache: Final[Optional[IndexCache]] = field(default=None, kw_only=True)
+    # already parsed metadata for fh, skips reading the header and TOC
+    meta: Final[Optional[XARMetadata]] = field(default=None, kw_only=True)
+
+    def _index_key(self, hdr_buf: bytes) -> Optional[bytes]:
+        stamp = source_stamp(self.fh)
+        if stamp is None:
+            return None
+        # the TOC checksum lives at the start of the heap by convention
+        cksum_sz = XAR_CKSUM_SIZES.get(self.cksum_alg, 0)
+        toc_cksum = self.fh.pread(self.heap_off, cksum_sz) if cksum_sz else b""
+        schema = INodeTable(XARINode).schema()
+        return index_key(b"xar", self.fh.size(), stamp, schema, hdr_buf, toc_cksum)
 
     def __attrs_post_init__(self):
-        with self.fh.seek_ctx(0):
-            hdr_buf = self.fh.read()
-        self.hdr = XARHeader.parse(hdr_buf)
+        if self.meta is not None:
+            self.hdr = self.meta.hdr
+            self.toc = self.meta.toc
+            return
+        hdr_buf = self.fh.pread(0, XAR_HEADER_MIN_SZ)
+        hdr_sz = Int16ub.parse(hdr_buf[4:6])
+        if hdr_sz > len(hdr_buf):
+            hdr_buf += self.fh.pread(len(hdr_buf), hdr_sz - len(hdr_buf))
+        self.hdr = XARHeaderFast.parse(hdr_buf)
         print(f"hdr: {self.hdr}")
         print(f"self.fh: {self.fh} self.fh.seek_ctx: {self.fh.seek_ctx}")
-        xml_comp_fh = OffsetRawIOBase(
-            self.fh, self.hdr.size, self.hdr.toc_length_compressed
+        key = None
+        if self.index_cache is not None:
+            key = self._index_key(hdr_buf)
+            if key is not None and (entry := self.index_cache.load(key)) is not None:
+                self.toc = XARTOC.from_index(entry)
+                return
+        xml_comp_chunks = iter_chunks(
+            self.fh, self.hdr.size, self.hdr.toc_length_compressed, 1024 * 1024
+        )
+        self.toc = XARTOC.from_chunks(iter_decompress(xml_comp_chunks, "zlib"))
+        if key is not None:
+            self.index_cache.store(key, self.toc.to_index())
+
+    @property
+    def cksum_alg(self) -> ChecksumAlgorithmEnum:
+        # the construct Enum parses to a string with the number alongside
+        alg = self.hdr.cksum_alg
+        return ChecksumAlgorithmEnum(getattr(alg, "intvalue", alg))
+
+    @property
+    def heap_off(self) -> int:
+        return self.hdr.size + self.hdr.toc_length_compressed
+
+    def _extract_stream(self, out_path: str, ino: XARINode) -> int:
+        chunks = iter_chunks(
+            self.fh, self.heap_off + ino.data_off, ino.data_len, 1024 * 1024
         )
-        # print(f"xml_comp_fh: {xml_comp_fh[:4].hex()}")
-        xml_comp_buf = xml_comp_fh.read()
-        print(f"len(xml_comp_buf): {len(xml_comp_buf)} {len(xml_comp_fh[:])}")
-        xml = zlib.decompress(xml_comp_fh[:]).decode("utf-8")
-        with open("toc.xml", "w") as toc_fh:
-            toc_fh.write(xml)
-        self.toc = XARTOC.from_xml(xml)
+        return _write_member(out_path, ino, chunks)
+
+    def extract_all(
+        self,
+        dest: str | os.PathLike,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[ExtractStats], None]] = None,
+        max_inflight_bytes: int = 256 * 1024 * 1024,
+        stream_min_sz: int = 64 * 1024 * 1024,
+    ) -> ExtractStats:
+        dest = os.fspath(dest)
+        stats = ExtractStats()
+        files: list[tuple[str, XARINode]] = []
+        hardlinks: list[tuple[str, XARINode]] = []
+        links: list[tuple[str, XARINode]] = []
+        os.makedirs(dest, exist_ok=True)
+        for path, ino in self.toc.walk():
+            out_path = os.path.join(dest, *path)
+            if ino.type == DirEntType.DIR:
+                os.makedirs(out_path, exist_ok=True)
+                stats.dirs += 1
+            elif ino.type == DirEntType.LNK:
+                links.append((out_path, ino))
+            elif ino.hardlink is not None:
+                hardlinks.append((out_path, ino))
+            else:
+                files.append((out_path, ino))
+        stats.total_files = len(files)
+        stats.total_bytes = sum(ino.size for _, ino in files)
+        # sequential heap order, empty members sort first
+        files.sort(key=lambda f: -1 if f[1].data_off is None else f[1].data_off)
+        inflight: collections.deque[tuple[Future, int, int]] = collections.deque()
+        inflight_bytes = 0
+
+        def retire(fut: Future, in_sz: int, buffered_sz: int) -> None:
+            nonlocal inflight_bytes
+            stats.bytes_out += fut.result()
+            stats.bytes_in += in_sz
+            stats.files += 1
+            inflight_bytes -= buffered_sz
+            if progress is not None:
+                progress(stats)
+
+        with ThreadPoolExecutor(workers) as pool:
+            for out_path, ino in files:
+                in_sz = ino.data_len or 0
+                buffered_sz = 0
+                if in_sz >= stream_min_sz:
+                    # too big to buffer, the worker streams it with positional reads
+                    fut = pool.submit(self._extract_stream, out_path, ino)
+                else:
+                    src_buf = self.fh.pread(self.heap_off + (ino.data_off or 0), in_sz)
+                    fut = pool.submit(_extract_buffer, out_path, ino, src_buf)
+                    buffered_sz = in_sz
+                inflight.append((fut, in_sz, buffered_sz))
+                inflight_bytes += buffered_sz
+                while inflight and (
+                    inflight_bytes > max_inflight_bytes or inflight[0][0].done()
+                ):
+                    retire(*inflight.popleft())
+            while inflight:
+                retire(*inflight.popleft())
+        orig_inos = {ino.hardlink for _, ino in hardlinks}
+        orig_paths = {ino.idx: p for p, ino in files if ino.idx in orig_inos}
+        for out_path, ino in hardlinks:
+            if os.path.lexists(out_path):
+                os.unlink(out_path)
+            try:
+                os.link(orig_paths[ino.hardlink], out_path)
+            except OSError:
+                # filesystems without hardlinks get a copy
+                shutil.copyfile(orig_paths[ino.hardlink], out_path)
+            stats.links += 1
+        for out_path, ino in links:
+            if os.path.lexists(out_path):
+                os.unlink(out_path)
+            os.symlink(ino.link, out_path)
+            stats.links += 1
+        stats.elapsed = time.perf_counter() - stats.start
+        return stats
+
+    def open_member(
+        self, ino: XARINode, verify: bool = False, **kwargs
+    ) -> DecompressingRawIO | _VerifyingRawIO:
+        if ino.type != DirEntType.REG:
+            raise ValueError(f"{ino.name} is not a regular file")
+        if ino.data_off is None:
+            # empty files have no heap data
+            raw = DecompressingRawIO(OffsetRawIOBase(self.fh, 0, 0), 0, None)
+        else:
+            src = OffsetRawIOBase(self.fh, self.heap_off + ino.data_off, ino.data_len)
+            raw = DecompressingRawIO(src, ino.size, ino.codec, **kwargs)
+        # the stream yields extracted bytes, uncompressed ones are also archived
+        cksum = ino.extracted_cksum
+        if cksum is None and ino.codec is None:
+            cksum = ino.archived_cksum
+        if verify and cksum is not None:
+            return _VerifyingRawIO(raw, ino.name, cksum)
+        return raw
+
+    def _toc_checksum(self) -> Optional[XARChecksumMismatch]:
+        style = self.cksum_alg.name
+        cksum_off = self.toc.cksum_off or 0
+        cksum_sz = self.toc.cksum_sz or XAR_CKSUM_SIZES[self.cksum_alg]
+        h = hashlib.new(style)
+        for chunk in iter_chunks(
+            self.fh, self.hdr.size, self.hdr.toc_length_compressed, 1024 * 1024
+        ):
+            h.update(chunk)
+        expected = bytes(self.fh.pread(self.heap_off + cksum_off, cksum_sz)).hex()
+        actual = h.hexdigest()
+        if actual == expected:
+            return None
+        return XARChecksumMismatch("", "toc", style, expected, actual)
+
+    def _member_checksum(
+        self, path: str, ino: XARINode, kind: str, style: str, expected: str
+    ) -> tuple[Optional[XARChecksumMismatch], int]:
+        h = hashlib.new(style.lower())
+        chunks: Iterable[ReadableBuffer] = []
+        if ino.data_off is not None:
+            chunks = iter_chunks(
+                self.fh, self.heap_off + ino.data_off, ino.data_len, 1024 * 1024
+            )
+        hashed = 0
+        if kind == "extracted" and ino.codec is not None:
+            chunks = iter_decompress(chunks, ino.codec)
+        try:
+            for chunk in chunks:
+                # hashlib drops the GIL for big buffers so workers hash in parallel
+                h.update(chunk)
+                hashed += len(chunk)
+        except (OSError, ValueError, zlib.error, lzma.LZMAError) as e:
+            # corrupt compressed data fails in the decoder before any hashing
+            return XARChecksumMismatch(path, kind, style, expected, "", str(e)), hashed
+        actual = h.hexdigest()
+        if actual == expected:
+            return None, hashed
+        return XARChecksumMismatch(path, kind, style, expected, actual), hashed
+
+    def verify(
+        self,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[XARVerifyReport], None]] = None,
+        extracted: bool = False,
+        max_inflight: Optional[int] = None,
+    ) -> XARVerifyReport:
+        # archived checksums cover the heap bytes as stored, extracted ones
+        # need every member decompressed so they are opt-in
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_inflight is None:
+            max_inflight = 2 * workers
+        report = XARVerifyReport()
+        if self.cksum_alg in XAR_CKSUM_SIZES:
+            report.toc_style = self.cksum_alg.name
+            mismatch = self._toc_checksum()
+            report.toc_ok = mismatch is None
+            if mismatch is not None:
+                report.mismatches.append(mismatch)
+        kinds = ("archived", "extracted") if extracted else ("archived",)
+        jobs = []
+        for path, ino in self.toc.walk():
+            # hardlinks share the original's heap data
+            if ino.type != DirEntType.REG or ino.hardlink is not None:
+                continue
+            name = "/".join(path)
+            checked = False
+            for kind in kinds:
+                cksum = (
+                    ino.archived_cksum if kind == "archived" else ino.extracted_cksum
+                )
+                if cksum is None or _new_hash(cksum[0]) is None:
+                    continue
+                jobs.append((name, ino, kind, *cksum))
+                checked = True
+            if not checked:
+                report.skipped.append(name)
+        report.total = len(jobs)
+        inflight: collections.deque[Future] = collections.deque()
+        job_iter = iter(jobs)
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                for job in itertools.islice(job_iter, max_inflight - len(inflight)):
+                    inflight.append(pool.submit(self._member_checksum, *job))
+                if not inflight:
+                    break
+                mismatch, hashed = inflight.popleft().result()
+                report.checked += 1
+                report.bytes_hashed += hashed
+                if mismatch is not None:
+                    report.mismatches.append(mismatch)
+                if progress is not None:
+                    progress(report)
+        report.elapsed = time.perf_counter() - report.start
+        return report
 
 
 @define
@@ -144,16 +802,29 @@ class XARFS(fs.base.FS):
             self.file = FancyRawIOBase(io.FileIO(self.file, "r"))
         self.xar = XARFile(self.file)
 
+    def _resolve(self, path: str) -> XARINode:
+        for _ in range(MAX_SYMLINK_HOPS):
+            ino = self.xar.toc.rootfs.lookup(path)
+            if ino is None:
+                raise ResourceNotFound(path)
+            if ino.type != DirEntType.LNK:
+                return ino
+            path = fs.path.normpath(
+                fs.path.join(fs.path.dirname(fs.path.abspath(path)), ino.link)
+            )
+        raise ResourceNotFound(path)
+
     def getinfo(self, path: str, namespaces: Optional[Collection[str]] = None) -> Info:
         ino = self.xar.toc.rootfs.lookup(path)
         if ino is None:
             raise ResourceNotFound(path)
-        return Info(
-            {
-                "basic": {"name": ino.name, "is_dir": ino.is_dir},
-                "details": {"type": ino.pyfs_type, "size": ino.size},
-            }
-        )
+        raw_info = {
+            "basic": {"name": ino.name, "is_dir": ino.is_dir},
+            "details": {"type": ino.pyfs_type, "size": ino.size},
+        }
+        if namespaces is not None and "link" in namespaces:
+            raw_info["link"] = {"target": ino.link}
+        return Info(raw_info)
 
     def listdir(self, path: str) -> list[str]:
         ino = self.xar.toc.rootfs.lookup(path)
@@ -172,7 +843,17 @@ class XARFS(fs.base.FS):
     def openbin(
         self, path: str, mode: str = "r", buffering: int = -1, **kwargs
     ) -> BinaryIO:
-        raise NotImplementedError
+        if any(m in mode for m in "wax+"):
+            raise ResourceReadOnly(path)
+        ino = self._resolve(path)
+        if ino.is_dir:
+            raise FileExpected(path)
+        raw = self.xar.open_member(ino, **kwargs)
+        if buffering == 0:
+            return raw
+        if buffering < 0:
+            buffering = io.DEFAULT_BUFFER_SIZE
+        return io.BufferedReader(raw, buffering)
 
     def remove(self, path: str) -> None:
         raise NotWriteable("XAR supports only reading")
@@ -209,14 +890,81 @@ def get_arg_parser() -> argparse.ArgumentParser:
         action="version",
         version=f"%(prog)s version: {Version(_version.version)}",
     )
+    subparsers = parser.add_subparsers(dest="cmd")
+    extract_parser = subparsers.add_parser("extract", help="extract a XAR archive")
+    extract_parser.add_argument("archive", help="input XAR archive", metavar="XAR")
+    extract_parser.add_argument("dest", help="output directory", metavar="DEST")
+    extract_parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="decompression workers"
+    )
+    verify_parser = subparsers.add_parser(
+        "verify", help="verify the TOC and member checksums"
+    )
+    verify_parser.add_argument("archive", help="input XAR archive", metavar="XAR")
+    verify_parser.add_argument(
+        "-x",
+        "--extracted",
+        action="store_true",
+        help="also decompress members to check their extracted checksums",
+    )
+    verify_parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="hashing workers"
+    )
     return parser
 
 
+def extract_main(args: argparse.Namespace) -> int:
+    def progress(stats: ExtractStats) -> None:
+        log.info(
+            f"{stats.files}/{stats.total_files} files "
+            f"{stats.bytes_out}/{stats.total_bytes} bytes "
+            f"{stats.throughput / (1024 * 1024):.1f} MiB/s"
+        )
+
+    with open(args.archive, "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+        stats = xar.extract_all(args.dest, workers=args.jobs, progress=progress)
+    print(
+        f"extracted {stats.files} files, {stats.dirs} dirs, {stats.links} links, "
+        f"{stats.bytes_out} bytes in {stats.elapsed:.3f}s "
+        f"({stats.throughput / (1024 * 1024):.1f} MiB/s)"
+    )
+    return 0
+
+
+def verify_main(args: argparse.Namespace) -> int:
+    def progress(report: XARVerifyReport) -> None:
+        log.info(
+            f"{report.checked}/{report.total} checksums "
+            f"{report.throughput / (1024 * 1024):.1f} MiB/s"
+        )
+
+    with open(args.archive, "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+        report = xar.verify(
+            workers=args.jobs, progress=progress, extracted=args.extracted
+        )
+    for m in report.mismatches:
+        what = "TOC" if m.kind == "toc" else f"{m.path} ({m.kind})"
+        print(f"{what}: {m.style} expected {m.expected} got {m.actual}")
+    toc = "no" if report.toc_ok is None else report.toc_style
+    print(
+        f"checked {toc} TOC checksum and {report.checked} member checksums, "
+        f"{len(report.mismatches)} bad, {len(report.skipped)} unchecked, "
+        f"{report.bytes_hashed} bytes in {report.elapsed:.3f}s"
+    )
+    return 0 if report.ok else 1
+
+
 def real_main(args: argparse.Namespace) -> int:
     verbose: Final[bool] = args.verbose
     if verbose:
         log.setLevel(logging.INFO)
         log.info(f"{program_name}: verbose mode enabled")
+    if args.cmd == "extract":
+        return extract_main(args)
+    if args.cmd == "verify":
+        return verify_main(args)
     return 0
 
 
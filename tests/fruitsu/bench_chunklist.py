@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from rich import print
+
+from fruitsu.chunklist import Chunklist, ChunklistChunk, ChunklistHeader
+
+
+def synth_chunklist(path: str, chunk_sz: int) -> bytes:
+    entries = []
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_sz):
+            entries.append(
+                ChunklistChunk.build(
+                    {
+                        "chunk_size": len(chunk),
+                        "chunk_sha256": hashlib.sha256(chunk).digest(),
+                    }
+                )
+            )
+    hdr = ChunklistHeader.build(
+        {
+            "cl_header_size": 36,
+            "cl_file_ver": 1,
+            "cl_chunk_method": 1,
+            "cl_sig_method": 0,
+            "__unused1": 0,
+            "cl_chunk_count": len(entries),
+            "cl_chunk_offset": 36,
+            "cl_sig_offset": 0,
+        }
+    )
+    return hdr + b"".join(entries)
+
+
+def bench_read(path: str, chunk_sz: int) -> float:
+    t = time.perf_counter()
+    with open(path, "rb", buffering=0) as f:
+        buf = bytearray(chunk_sz)
+        while f.readinto(buf):
+            pass
+    return time.perf_counter() - t
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="chunklist verification benchmark")
+    parser.add_argument(
+        "payload", nargs="?", help="payload to verify (default: synthetic)"
+    )
+    parser.add_argument("-s", "--size-mib", type=int, default=512)
+    parser.add_argument("-c", "--chunk-mib", type=int, default=10)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+    chunk_sz = args.chunk_mib * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.payload
+        if path is None:
+            path = os.path.join(tmp_dir, "payload.bin")
+            with open(path, "wb") as f:
+                for _ in range(args.size_mib):
+                    f.write(os.urandom(1024 * 1024))
+        cl = Chunklist.from_buffer(synth_chunklist(path, chunk_sz))
+        size = cl.total_size
+        elapsed = bench_read(path, chunk_sz)
+        print(f"sequential read: {size / elapsed / 2**20:.0f} MiB/s")
+        for workers in sorted({1, args.jobs or os.cpu_count() or 1}):
+            with open(path, "rb") as f:
+                stats = cl.verify(f, workers=workers)
+            assert stats.ok
+            print(
+                f"verify {workers} threads: {stats.chunks} chunks "
+                f"{stats.throughput / 2**20:.0f} MiB/s"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from fruitsu.dmg import DMG
+from rich import print
+from test_dmg import _make_udif
+
+
+def synth_image(size: int) -> bytes:
+    rng = random.Random(1234)
+    words = [rng.randbytes(rng.randrange(1, 12)) for _ in range(256)]
+    buf = bytearray()
+    while len(buf) < size:
+        buf += rng.choice(words)
+    return bytes(buf[:size])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="DMG conversion scaling benchmark")
+    parser.add_argument("-s", "--size-mib", type=int, default=256)
+    parser.add_argument("-c", "--codec", default="zlib")
+    parser.add_argument(
+        "-j", "--jobs", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()]
+    )
+    args = parser.parse_args()
+    image = synth_image(args.size_mib * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dmg_path = os.path.join(tmp_dir, "synth.dmg")
+        with open(dmg_path, "wb") as f:
+            f.write(_make_udif(image, [args.codec], chunk_sectors=2048))
+        out_path = os.path.join(tmp_dir, "synth.img")
+        print(f"cpus: {os.cpu_count()} image: {args.size_mib} MiB codec: {args.codec}")
+        for jobs in sorted(set(args.jobs)):
+            with open(dmg_path, "rb") as dmg_fh:
+                stats = DMG(dmg_fh).convert(out_path, workers=jobs)
+            print(
+                f"jobs: {jobs:3} {stats.elapsed:.2f} s "
+                f"{stats.throughput / (1024 * 1024):.1f} MiB/s"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench_xar import synth_toc, synth_xar
+from fruitsu.fs import INode
+from fruitsu.xar import XARFS
+from rich import print
+
+
+def scan_lookup(self, path):
+    # per-call linear child scans, what INode.lookup did before the path index
+    ino = self.table.root if path.startswith("/") else self
+    for part in path.split("/"):
+        if part in ("", "."):
+            continue
+        if part == "..":
+            ino = ino.parent or ino
+            continue
+        for child in ino.children:
+            if child.name == part:
+                ino = child
+                break
+        else:
+            return None
+    return ino
+
+
+def bench_walk(xar_path: str, label: str) -> None:
+    xarfs = XARFS(xar_path)
+    t = time.perf_counter()
+    num = sum(1 for _ in xarfs.walk.files())
+    print(f"{label}: fs.walk {num} files in {time.perf_counter() - t:.2f} s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="pyfilesystem walk benchmark")
+    parser.add_argument("-n", "--entries", type=int, default=200_000)
+    parser.add_argument("-w", "--dir-width", type=int, default=1000)
+    parser.add_argument("--skip-before", action="store_true")
+    args = parser.parse_args()
+    xml = synth_toc(args.entries, args.dir_width)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xar_path = os.path.join(tmp_dir, "synth.xar")
+        with open(xar_path, "wb") as f:
+            f.write(synth_xar(xml))
+        bench_walk(xar_path, "path index")
+        if not args.skip_before:
+            orig_lookup = INode.lookup
+            INode.lookup = scan_lookup
+            try:
+                bench_walk(xar_path, "linear scan")
+            finally:
+                INode.lookup = orig_lookup
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
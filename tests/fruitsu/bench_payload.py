@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import lzma
+import os
+import random
+import stat
+import sys
+import time
+
+from rich import print
+
+from fruitsu.payload import CpioOdcHeader, PbzxChunkHeader, PbzxHeader, iter_payload
+
+
+def synth_cpio(size: int, file_sz: int) -> bytes:
+    rng = random.Random(24)
+    words = [rng.randbytes(rng.randrange(2, 12)) for _ in range(256)]
+    blob = b"".join(rng.choice(words) for _ in range(file_sz // 6 + 1))[:file_sz]
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        name = f"./usr/share/file{i}\0".encode()
+        out += CpioOdcHeader.build(
+            {
+                "c_dev": 1,
+                "c_ino": i,
+                "c_mode": stat.S_IFREG | 0o644,
+                "c_uid": 0,
+                "c_gid": 0,
+                "c_nlink": 1,
+                "c_rdev": 0,
+                "c_mtime": 0,
+                "c_namesize": len(name),
+                "c_filesize": file_sz,
+            }
+        )
+        out += name + blob
+        i += 1
+    name = b"TRAILER!!!\0"
+    out += CpioOdcHeader.build(
+        {
+            "c_dev": 0,
+            "c_ino": 0,
+            "c_mode": 0,
+            "c_uid": 0,
+            "c_gid": 0,
+            "c_nlink": 1,
+            "c_rdev": 0,
+            "c_mtime": 0,
+            "c_namesize": len(name),
+            "c_filesize": 0,
+        }
+    )
+    return bytes(out + name)
+
+
+def synth_pbzx(buf: bytes, chunk_sz: int) -> bytes:
+    out = bytearray(PbzxHeader.build({"flags": chunk_sz}))
+    for i in range(0, len(buf), chunk_sz):
+        chunk = buf[i : i + chunk_sz]
+        comp = lzma.compress(chunk, lzma.FORMAT_XZ, preset=1)
+        out += PbzxChunkHeader.build(
+            {"uncompressed_size": len(chunk), "compressed_size": len(comp)}
+        )
+        out += comp
+    return bytes(out)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="pbzx Payload listing benchmark")
+    parser.add_argument(
+        "payload", nargs="?", help="Payload to list (default: synthetic)"
+    )
+    parser.add_argument("-s", "--size-mib", type=int, default=256)
+    parser.add_argument("-c", "--chunk-mib", type=int, default=16)
+    parser.add_argument("-f", "--file-kib", type=int, default=64)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+    if args.payload is None:
+        cpio = synth_cpio(args.size_mib * 2**20, args.file_kib * 1024)
+        buf = synth_pbzx(cpio, args.chunk_mib * 2**20)
+    else:
+        with open(args.payload, "rb") as f:
+            buf = f.read()
+    for workers in sorted({1, args.jobs or os.cpu_count() or 1}):
+        t = time.perf_counter()
+        n = total = 0
+        for entry in iter_payload(io.BytesIO(buf), workers):
+            n += 1
+            total += entry.size
+        elapsed = time.perf_counter() - t
+        print(
+            f"list {workers} workers: {n} entries {total / 2**20:.0f} MiB "
+            f"in {elapsed:.3f}s ({total / elapsed / 2**20:.0f} MiB/s)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
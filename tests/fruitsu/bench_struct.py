@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+
+from rich import print
+
+from fruitsu.dmg import BLKXTable, BLKXTableFast
+from fruitsu.hfs import (
+    BTNodeDescriptor,
+    BTNodeDescriptorFast,
+    HFSPlusVolumeHeader,
+    HFSPlusVolumeHeaderFast,
+)
+from fruitsu.xar import XARHeader, XARHeaderFast
+
+
+def synth_blkx(num_chunks: int) -> bytes:
+    chksum = {"chksum_type": 0, "chksum_sz": 0, "chksum": [0] * 32}
+    return BLKXTable.build(
+        {
+            "version": 1,
+            "sector_num": 0,
+            "sector_count": num_chunks * 64,
+            "data_off": 0,
+            "buffers_needed": 0,
+            "block_descriptors": 0,
+            "chksum": chksum,
+            "num_block_chunks": num_chunks,
+            "block_chunks": [
+                {
+                    "entry_type": "zlib",
+                    "comment": 0,
+                    "sector_num": i * 64,
+                    "sector_count": 64,
+                    "compressed_off": i * 4096,
+                    "compressed_sz": 4096,
+                }
+                for i in range(num_chunks)
+            ],
+        }
+    )
+
+
+def timed(label: str, fn, *args) -> float:
+    t = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - t
+    print(f"{label}: {elapsed * 1000:.1f} ms")
+    return elapsed
+
+
+def bench_records(label: str, slow, fast, buf: bytes, n: int) -> None:
+    def run(parse):
+        for _ in range(n):
+            parse(buf)
+
+    slow_t = timed(f"{label} construct x{n}", run, slow.parse)
+    fast_t = timed(f"{label} fast x{n}", run, fast.parse)
+    print(f"{label} speedup: {slow_t / fast_t:.1f}x")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="record decoding benchmark")
+    parser.add_argument("-c", "--chunks", type=int, default=50_000)
+    parser.add_argument("-n", "--records", type=int, default=20_000)
+    args = parser.parse_args()
+    blkx_buf = synth_blkx(args.chunks)
+    assert BLKXTableFast.parse(blkx_buf) == BLKXTable.parse(blkx_buf)
+    bench_records(
+        f"blkx table ({args.chunks} chunks)", BLKXTable, BLKXTableFast, blkx_buf, 1
+    )
+    vh_buf = HFSPlusVolumeHeader.build(
+        HFSPlusVolumeHeader.parse(bytes(b"H+") + bytes(510))
+    )
+    bench_records(
+        "HFS+ volume header",
+        HFSPlusVolumeHeader,
+        HFSPlusVolumeHeaderFast,
+        vh_buf,
+        args.records,
+    )
+    node_buf = bytes(8) + b"\xff\x01" + bytes(4)
+    bench_records(
+        "B-tree node descriptor",
+        BTNodeDescriptor,
+        BTNodeDescriptorFast,
+        node_buf,
+        args.records,
+    )
+    xar_buf = bytes.fromhex("78617221001c0001") + bytes(16) + bytes.fromhex("00000001")
+    bench_records("XAR header", XARHeader, XARHeaderFast, xar_buf, args.records)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import resource
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from rich import print
+
+from fruitsu.index_cache import IndexCache
+from fruitsu.xar import XARTOC, XARFile
+
+
+def synth_toc(num_entries: int, files_per_dir: int = 64) -> bytes:
+    parts = [b'<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>']
+    parts.append(b"<creation-time>2022-02-12T04:57:16</creation-time>")
+    parts.append(b'<checksum style="sha1"><offset>0</offset><size>20</size></checksum>')
+    off = 20
+    i = 0
+    d = 0
+    while i < num_entries:
+        parts.append(b"<file><type>directory</type><mode>0755</mode>")
+        i += 1
+        for _ in range(min(files_per_dir, num_entries - i)):
+            parts.append(
+                (
+                    "<file><data>"
+                    f"<length>100</length><offset>{off}</offset><size>200</size>"
+                    '<encoding style="application/x-gzip"/>'
+                    '<extracted-checksum style="sha1">'
+                    "a5b28fc13c275377ab0d6936beb44cb452076431</extracted-checksum>"
+                    '<archived-checksum style="sha1">'
+                    "ffee66225e448f08eda821ba0dff15b7aa3d27c4</archived-checksum>"
+                    "</data>"
+                    "<mtime>2022-02-12T02:54:04Z</mtime><uid>501</uid><gid>20</gid>"
+                    f"<mode>0644</mode><type>file</type><name>f{i}.txt</name></file>"
+                ).encode()
+            )
+            off += 100
+            i += 1
+        parts.append(f"<name>d{d}</name></file>".encode())
+        d += 1
+    parts.append(b"</toc></xar>")
+    return b"".join(parts)
+
+
+def bench_untangle(xml: bytes) -> None:
+    try:
+        import untangle
+    except ImportError:
+        print("untangle not installed, skipping legacy parser")
+        return
+    t = time.perf_counter()
+    untangle.parse(xml.decode())
+    print(f"untangle: {time.perf_counter() - t:.2f} s")
+
+
+def bench_streaming(xml: bytes, chunk_sz: int) -> None:
+    t = time.perf_counter()
+    chunks = (xml[i : i + chunk_sz] for i in range(0, len(xml), chunk_sz))
+    toc = XARTOC.from_chunks(chunks)
+    elapsed = time.perf_counter() - t
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    num = sum(1 for _ in toc.walk())
+    print(f"streaming: {elapsed:.2f} s entries: {num} peak RSS: {peak / 1024:.1f} MiB")
+
+
+def synth_xar(xml: bytes) -> bytes:
+    toc_comp = zlib.compress(xml)
+    hdr = struct.pack(">IHHQQI", 0x78617221, 28, 1, len(toc_comp), len(xml), 1)
+    return hdr + toc_comp + hashlib.sha1(toc_comp).digest()
+
+
+def bench_index_cache(xml: bytes) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xar_path = os.path.join(tmp_dir, "synth.xar")
+        with open(xar_path, "wb") as f:
+            f.write(synth_xar(xml))
+        cache = IndexCache(os.path.join(tmp_dir, "cache"))
+        for label in ("cold", "warm"):
+            t = time.perf_counter()
+            with open(xar_path, "rb") as f:
+                XARFile(f.raw, index_cache=cache)
+            print(f"{label} open: {time.perf_counter() - t:.2f} s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="XAR TOC parser benchmark")
+    parser.add_argument("-n", "--entries", type=int, default=500_000)
+    parser.add_argument("-c", "--chunk-size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+    xml = synth_toc(args.entries)
+    print(f"synthetic TOC: {args.entries} entries {len(xml) / 2**20:.1f} MiB")
+    bench_streaming(xml, args.chunk_size)
+    bench_index_cache(xml)
+    bench_untangle(xml)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
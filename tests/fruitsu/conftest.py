@@ -0,0 +1,173 @@
+import collections
+import hashlib
+import http.server
+import importlib.resources
+import re
+import threading
+from typing import Final, Generator
+
+import pytest
+from attrs import define, field
+
+
+@define
+class RangeRequest:
+    method: str
+    path: str
+    range: str | None
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "RangeHTTPServer"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _load(self) -> bytes | None:
+        path = self.path.lstrip("/")
+        if path not in self.server.files:
+            self.send_error(404)
+            return None
+        return self.server.files[path]
+
+    def do_HEAD(self) -> None:
+        self.server.log.append(RangeRequest("HEAD", self.path, None))
+        buf = self._load()
+        if buf is None:
+            return
+        self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{hashlib.sha1(buf).hexdigest()}"')
+        self.send_header("Content-Length", str(len(buf)))
+        self.end_headers()
+
+    def _fault(self) -> str | None:
+        faults = self.server.faults.get(self.path.lstrip("/"))
+        try:
+            return faults.popleft() if faults else None
+        except IndexError:
+            return None
+
+    def do_GET(self) -> None:
+        rng = self.headers.get("Range")
+        self.server.log.append(RangeRequest("GET", self.path, rng))
+        buf = self._load()
+        if buf is None:
+            return
+        fault = self._fault()
+        if fault == "error":
+            self.send_error(503)
+            return
+        if rng is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(buf)))
+            self.end_headers()
+            self.wfile.write(buf)
+            return
+        m = re.fullmatch(r"bytes=(\d+-\d+(?:,\d+-\d+)*)", rng)
+        if m is None:
+            self.send_error(416)
+            return
+        spans = []
+        for r in m.group(1).split(","):
+            start, end = map(int, r.split("-"))
+            if end >= len(buf) or start > end:
+                self.send_error(416)
+                return
+            spans.append((start, end))
+        if len(spans) == 1 or not self.server.multipart:
+            start, end = min(s for s, _ in spans), max(e for _, e in spans)
+            body = buf[start : end + 1]
+            if fault == "long":
+                # more body than the Content-Range claims
+                body += bytes(4096)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(buf)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if fault == "corrupt":
+                body = bytes([body[0] ^ 0xFF]) + body[1:]
+            elif fault == "truncate":
+                # drop the connection halfway through the body
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+            return
+        boundary = "FRUITSU_BOUNDARY"
+        body = b""
+        for start, end in spans:
+            body += (
+                f"--{boundary}\r\n"
+                "Content-Type: application/octet-stream\r\n"
+                f"Content-Range: bytes {start}-{end}/{len(buf)}\r\n\r\n"
+            ).encode()
+            body += buf[start : end + 1] + b"\r\n"
+        body += f"--{boundary}--\r\n".encode()
+        self.send_response(206)
+        self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RangeHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    files: dict[str, bytes]
+    log: list[RangeRequest]
+    # per file faults consumed one per GET: "error", "corrupt", "truncate"
+    # or "long"
+    faults: dict[str, collections.deque[str]]
+    multipart: bool = True
+
+
+@define
+class RangeServer:
+    httpd: Final[RangeHTTPServer]
+    thread: Final[threading.Thread] = field(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    @property
+    def log(self) -> list[RangeRequest]:
+        return self.httpd.log
+
+    @property
+    def gets(self) -> list[RangeRequest]:
+        return [r for r in self.log if r.method == "GET"]
+
+    def add(self, name: str, buf: bytes) -> str:
+        self.httpd.files[name] = buf
+        return self.url(name)
+
+    def inject(self, name: str, *faults: str) -> None:
+        self.httpd.faults.setdefault(name, collections.deque()).extend(faults)
+
+    def url(self, name: str) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def range_server() -> Generator[RangeServer, None, None]:
+    httpd = RangeHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    httpd.files = {}
+    httpd.log = []
+    httpd.faults = {}
+    test_dir = importlib.resources.files(__package__)
+    for p in test_dir.iterdir():
+        if p.is_file() and p.name.endswith((".xar", ".dmg", ".img", ".zip")):
+            httpd.files[p.name] = p.read_bytes()
+    srv = RangeServer(httpd)
+    yield srv
+    srv.shutdown()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import asyncio
+import importlib.resources
+import sys
+
+import pytest
+from fruitsu.dmg import DMGMetadata
+from fruitsu.fs import DirEntType
+from fruitsu.io_ext import HTTPFile
+from fruitsu.xar import XARFile
+from rich import print
+
+aio = pytest.importorskip("fruitsu.aio")
+
+
+def test_async_http_file(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "hello.dmg").read_bytes()
+
+    async def run():
+        async with aio.shared_session(4) as ses:
+            afh = await aio.AsyncHTTPFile.open(range_server.url("hello.dmg"), ses)
+            assert afh.sz == len(local_buf)
+            assert await afh.pread(100, 50) == local_buf[100:150]
+            assert await afh.seek(-512, 2) == len(local_buf) - 512
+            assert await afh.read(4) == b"koly"
+            assert afh.tell() == len(local_buf) - 508
+
+    asyncio.run(run())
+
+
+def test_async_open_xar_and_dmg(range_server):
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "hello-gz.xar", "rb") as xar_fh:
+        local_xar = XARFile(xar_fh.raw)
+    with open(test_dir / "hello.dmg", "rb") as dmg_fh:
+        local_meta = DMGMetadata.from_file(dmg_fh)
+
+    async def run():
+        async with aio.shared_session(8) as ses:
+            xars = await asyncio.gather(
+                *(
+                    aio.open_xar_metadata(range_server.url("hello-gz.xar"), ses)
+                    for _ in range(50)
+                )
+            )
+            meta = await aio.open_dmg_metadata(range_server.url("hello.dmg"), ses)
+        return xars, meta
+
+    xars, meta = asyncio.run(run())
+    names = [n.name for n in local_xar.toc.rootfs.descendants]
+    for xar in xars:
+        assert [n.name for n in xar.toc.rootfs.descendants] == names
+    assert meta.hdr == local_meta.hdr
+    assert len(meta.blkx_tables) == len(local_meta.blkx_tables)
+    print(f"requests: {len(range_server.log)}")
+    # HEAD, header and TOC for each package, HEAD, trailer and plist for the DMG
+    assert len(range_server.log) == 50 * 3 + 3
+    # the parsed metadata turns into a sync XARFile without reparsing
+    xar = XARFile(HTTPFile(range_server.url("hello-gz.xar")), meta=xars[0])
+    assert xar.toc is xars[0].toc
+    for path, ino in local_xar.toc.walk():
+        if ino.type == DirEntType.REG:
+            remote_ino = xar.toc.rootfs.lookup("/".join(path))
+            with xar.open_member(remote_ino, verify=True) as f:
+                assert len(f.read()) == ino.size and f.verified
+    with pytest.raises(TypeError):
+        XARFile(HTTPFile(range_server.url("hello-gz.xar")), hdr=None)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import hashlib
+import random
+import sys
+
+import pytest
+from rich import print
+
+from fruitsu.chunklist import (
+    CHUNKLIST_MAGIC,
+    Chunklist,
+    ChunklistChunk,
+    ChunklistHeader,
+    get_arg_parser,
+    real_main,
+)
+from fruitsu.io_ext import HTTPFile
+
+
+def make_chunklist(payload, chunk_sz, signature=bytes(range(256))):
+    chunks = [payload[i : i + chunk_sz] for i in range(0, len(payload), chunk_sz)]
+    body = b"".join(
+        ChunklistChunk.build(
+            {"chunk_size": len(c), "chunk_sha256": hashlib.sha256(c).digest()}
+        )
+        for c in chunks
+    )
+    hdr = ChunklistHeader.build(
+        {
+            "cl_header_size": 36,
+            "cl_file_ver": 1,
+            "cl_chunk_method": 1,
+            "cl_sig_method": 1,
+            "__unused1": 0,
+            "cl_chunk_count": len(chunks),
+            "cl_chunk_offset": 36,
+            "cl_sig_offset": 36 + len(body),
+        }
+    )
+    return hdr + body + signature
+
+
+@pytest.fixture
+def payload():
+    return random.Random(21).randbytes(3 * 1024 * 1024 + 12345)
+
+
+def test_chunklist_parse(payload):
+    buf = make_chunklist(payload, 256 * 1024)
+    assert int.from_bytes(buf[:4], "little") == CHUNKLIST_MAGIC
+    assert buf[:4] == b"CNKL"
+    cl = Chunklist.from_buffer(buf)
+    assert cl.hdr.cl_chunk_count == len(cl.chunks) == 13
+    assert cl.total_size == len(payload)
+    assert cl.signature == bytes(range(256))
+    assert cl.chunk_index(0) == 0
+    assert cl.chunk_index(256 * 1024) == 1
+    assert cl.chunk_index(len(payload) - 1) == 12
+    with pytest.raises(ValueError):
+        cl.chunk_index(len(payload))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_chunklist_verify(tmp_path, payload, workers):
+    cl = Chunklist.from_buffer(make_chunklist(payload, 256 * 1024))
+    path = tmp_path / "payload.bin"
+    path.write_bytes(payload)
+    progress = []
+    with open(path, "rb") as f:
+        stats = cl.verify(f, workers=workers, progress=progress.append)
+    print(f"stats: {stats} throughput: {stats.throughput / 2**20:.0f} MiB/s")
+    assert stats.ok and stats.bad_chunk is None
+    assert stats.chunks == 13 and stats.bytes_hashed == len(payload)
+    assert len(progress) == 13
+    # the first of several corrupted chunks is the one reported
+    bad = bytearray(payload)
+    bad[5 * 256 * 1024 + 77] ^= 1
+    bad[9 * 256 * 1024] ^= 1
+    path.write_bytes(bad)
+    with open(path, "rb") as f:
+        stats = cl.verify(f, workers=workers)
+    assert not stats.ok
+    assert (stats.bad_chunk, stats.bad_offset) == (5, 5 * 256 * 1024)
+    assert stats.chunks == 5
+    # a truncated payload fails at its partial last chunk
+    path.write_bytes(payload[:-100])
+    with open(path, "rb") as f:
+        stats = cl.verify(f, workers=workers)
+    assert stats.bad_chunk == 12 and stats.src_size == len(payload) - 100
+
+
+def test_chunklist_verify_remote(range_server, payload):
+    cl = Chunklist.from_buffer(make_chunklist(payload, 512 * 1024))
+    url = range_server.add("payload.pkg", payload)
+    stats = cl.verify(HTTPFile(url), workers=4)
+    assert stats.ok and stats.chunks == 7
+    bad = bytearray(payload)
+    bad[-1] ^= 0xFF
+    url = range_server.add("bad.pkg", bytes(bad))
+    stats = cl.verify(HTTPFile(url), workers=4)
+    assert stats.bad_chunk == 6 and stats.bad_offset == 6 * 512 * 1024
+
+
+def test_chunklist_cli(tmp_path, payload, capsys):
+    (tmp_path / "payload.bin").write_bytes(payload)
+    (tmp_path / "payload.chunklist").write_bytes(make_chunklist(payload, 1 << 20))
+    args = get_arg_parser().parse_args(
+        [
+            "verify",
+            str(tmp_path / "payload.chunklist"),
+            str(tmp_path / "payload.bin"),
+            "-j",
+            "2",
+        ]
+    )
+    assert real_main(args) == 0
+    assert "verified 4 chunks" in capsys.readouterr().out
+    (tmp_path / "payload.bin").write_bytes(payload[:1000] + b"X" + payload[1001:])
+    assert real_main(args) == 1
+    assert "bad chunk 0 at offset 0" in capsys.readouterr().out
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import bz2
+import io
+import lzma
+import random
+import sys
+import zlib
+
+import pytest
+from fruitsu.compression import (
+    DecompressingRawIO,
+    adc_decompress,
+    lzfse_decompress,
+    lzvn_decompress,
+)
+from fruitsu.io_ext import OffsetRawIOBase
+from rich import print
+
+
+def _test_payload(size):
+    rng = random.Random(1234)
+    words = [rng.randbytes(rng.randrange(1, 12)) for _ in range(64)]
+    buf = bytearray()
+    while len(buf) < size:
+        buf += rng.choice(words)
+    return bytes(buf[:size])
+
+
+@pytest.mark.parametrize(
+    "codec,compress",
+    [
+        ("zlib", zlib.compress),
+        (
+            "bzip2",
+            lambda b: bz2.compress(b[: len(b) // 2]) + bz2.compress(b[len(b) // 2 :]),
+        ),
+        (
+            "lzma",
+            lambda b: lzma.compress(b[: len(b) // 3]) + lzma.compress(b[len(b) // 3 :]),
+        ),
+    ],
+)
+def test_decompressing_seeks(codec, compress):
+    payload = _test_payload(1536 * 1024)
+    src = OffsetRawIOBase(io.BytesIO(compress(payload)))
+    raw = DecompressingRawIO(
+        src,
+        len(payload),
+        codec,
+        src_chunk_sz=16 * 1024,
+        out_chunk_sz=64 * 1024,
+        checkpoint_interval=128 * 1024,
+    )
+    f = io.BufferedReader(raw)
+    assert f.read(1000) == payload[:1000]
+    f.seek(len(payload) - 5000)
+    assert f.read() == payload[-5000:]
+    restores = raw.restores
+    print(f"{codec} checkpoints: {[cp.out_off for cp in raw.checkpoints]}")
+    for off in (1_300_000, 900_000, 12345, 1_500_000, 500_000):
+        f.seek(off)
+        assert f.read(4096) == payload[off : off + 4096]
+    if codec == "zlib":
+        assert len(raw.checkpoints) > 8
+    else:
+        # only stream boundaries can be checkpointed for bz2 and xz
+        assert len(raw.checkpoints) == 2
+    assert raw.restores > restores
+    f.seek(0)
+    assert f.read() == payload
+
+
+def test_adc_vectors():
+    # literal "ab", 2-byte match len 4 dist 2, 3-byte match len 5 dist 1
+    src = b"\x81ab" + b"\x04\x01" + b"\x41\x00\x00"
+    assert adc_decompress(src, 11) == b"abababbbbbb"
+    with pytest.raises(ValueError):
+        adc_decompress(b"\x04\x10", 3)
+
+
+LZVN_EOS = b"\x06" + b"\0" * 7
+
+
+def test_lzvn_vectors():
+    # sml_d: 3 literals then a len 4 dist 3 match, sml_m len 5, lrg_l 20 literals
+    src = b"\xc8\x03abc" + b"\xf5" + b"\xe0\x04" + b"x" * 20 + LZVN_EOS
+    assert lzvn_decompress(src, 32) == b"abc" * 4 + b"x" * 20
+    # med_d: 1 literal then len 16 dist 1, pre_d reuses dist 1 with 1 literal
+    med = bytes([0xA0 | 1 << 3 | (16 - 3) >> 2, ((16 - 3) & 3) | 1 << 2, 0])
+    pre = bytes([1 << 6 | 0 << 3 | 6])
+    src = med + b"z" + pre + b"y" + b"\x0e" + LZVN_EOS
+    assert lzvn_decompress(src, 32) == b"z" * 17 + b"y" * 4
+    # lrg_d: len 3 dist 0x102
+    src = b"\xe0\xf2" + bytes(range(256)) * 1 + b"\x01" * 2 + b"\x07\x02\x01" + LZVN_EOS
+    out = lzvn_decompress(src, 512)
+    assert out[-3:] == out[-3 - 0x102 : -0x102]
+    for bad in [b"\x70", b"\xd0"]:
+        with pytest.raises(ValueError, match="invalid LZVN opcode"):
+            lzvn_decompress(bad + LZVN_EOS, 8)
+    # operands and literals running past the end of the input
+    for bad in [b"\x07\x02", b"\xa0\x01", b"\xe0", b"\xe5hel", b"\xc8\x03ab"]:
+        with pytest.raises(ValueError, match="truncated LZVN stream"):
+            lzvn_decompress(bad, 32)
+    # long matches stop at the first op past out_sz
+    src = b"\x00\x01" + b"\xf0\xff" * 10000 + LZVN_EOS
+    with pytest.raises(ValueError, match="overflow: 275 > 8"):
+        lzvn_decompress(b"\xe1a" + src, 8)
+
+
+def test_lzfse_uncompressed_and_lzvn_blocks():
+    payload = b"\xe5hello" + LZVN_EOS
+    src = (
+        b"bvx-"
+        + (6).to_bytes(4, "little")
+        + b"world "
+        + b"bvxn"
+        + (5).to_bytes(4, "little")
+        + len(payload).to_bytes(4, "little")
+        + payload
+        + b"bvx$"
+    )
+    assert lzfse_decompress(src, 11) == b"world hello"
+    with pytest.raises(ValueError):
+        lzfse_decompress(src[:-4], 11)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
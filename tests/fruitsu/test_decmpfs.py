@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import io
+import random
+import struct
+import sys
+import zlib
+
+import pytest
+from rich import print
+
+from fruitsu.decmpfs import (
+    DECMPFS_CHUNK_SZ,
+    DecmpfsFile,
+    DecmpfsHeader,
+    DecmpfsType,
+    decode_decmpfs_chunk,
+)
+from fruitsu.io_ext import FancyRawIOBase
+
+
+def decmpfs_xattr(cmp_type, size, payload=b""):
+    hdr = DecmpfsHeader.build({"compression_type": cmp_type, "uncompressed_size": size})
+    return hdr + payload
+
+
+def lzvn_literals(buf):
+    # literal-only LZVN stream, enough to exercise the decoder
+    out = bytearray()
+    for i in range(0, len(buf), 271):
+        piece = buf[i : i + 271]
+        if len(piece) < 16:
+            out += bytes([0xE0 | len(piece)])
+        else:
+            out += bytes([0xE0, len(piece) - 16])
+        out += piece
+    return bytes(out + b"\x06" + bytes(7))
+
+
+def zlib_rsrc(chunks):
+    # resource fork header, then the 'cmpf' resource with its block table
+    tbl = struct.pack("<I", len(chunks))
+    off = 4 + 8 * len(chunks)
+    for c in chunks:
+        tbl += struct.pack("<II", off, len(c))
+        off += len(c)
+    data = tbl + b"".join(chunks)
+    res = struct.pack(">I", len(data)) + data
+    hdr = struct.pack(">IIII", 0x100, 0x100 + len(res), len(res), 0x32)
+    return hdr.ljust(0x100, b"\0") + res + bytes(0x32)
+
+
+def offset_rsrc(chunks):
+    offs = [4 * (len(chunks) + 1)]
+    for c in chunks:
+        offs.append(offs[-1] + len(c))
+    return struct.pack(f"<{len(offs)}I", *offs) + b"".join(chunks)
+
+
+def split_chunks(buf):
+    return [buf[i : i + DECMPFS_CHUNK_SZ] for i in range(0, len(buf), DECMPFS_CHUNK_SZ)]
+
+
+def synth_data(size, seed=1):
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randrange(2, 12)) for _ in range(64)]
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(words)
+    return bytes(out[:size])
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzvn", "lzfse", "raw"])
+def test_decmpfs_rsrc_random_access(codec):
+    data = synth_data(20 * DECMPFS_CHUNK_SZ + 1234)
+    chunks = split_chunks(data)
+    if codec == "zlib":
+        # every other chunk stored, flagged by a 0xFF first byte
+        enc = [zlib.compress(c) if i % 2 else b"\xff" + c for i, c in enumerate(chunks)]
+        rsrc, cmp_type = zlib_rsrc(enc), DecmpfsType.zlib_rsrc
+    elif codec == "lzvn":
+        enc = [lzvn_literals(c) if i % 2 else b"\x06" + c for i, c in enumerate(chunks)]
+        rsrc, cmp_type = offset_rsrc(enc), DecmpfsType.lzvn_rsrc
+    elif codec == "lzfse":
+        # uncompressed LZFSE blocks decode without liblzfse
+        enc = [
+            b"bvx-" + struct.pack("<I", len(c)) + c + b"bvx$" if i % 2 else b"\xff" + c
+            for i, c in enumerate(chunks)
+        ]
+        rsrc, cmp_type = offset_rsrc(enc), DecmpfsType.lzfse_rsrc
+    else:
+        rsrc, cmp_type = offset_rsrc(chunks), DecmpfsType.raw_rsrc
+    src = FancyRawIOBase(io.BytesIO(rsrc))
+    f = DecmpfsFile.from_xattr(decmpfs_xattr(cmp_type, len(data)), src)
+    assert f.num_chunks == len(chunks) and f.codec == codec
+    # 4 KiB from the middle decodes exactly one chunk
+    mid = len(data) // 2
+    assert f.pread(mid, 4096) == data[mid : mid + 4096]
+    assert f.stats.fetches == 1
+    assert f.pread(mid + 100, 100) == data[mid + 100 : mid + 200]
+    assert f.stats.fetches == 1 and f.stats.hits == 1
+    # straddling a chunk boundary touches both chunks
+    off = 7 * DECMPFS_CHUNK_SZ - 10
+    assert f.pread(off, 20) == data[off : off + 20]
+    assert f.stats.fetches == 3
+    assert f.read() == data
+    assert f.stats.fetches == len(chunks)
+    f.seek(-5, io.SEEK_END)
+    assert f.read() == data[-5:]
+    with pytest.raises(ValueError):
+        f.pread(len(data) - 1, 2)
+    print(f"{codec}: {f.stats}")
+
+
+def test_decmpfs_cache_bound():
+    data = synth_data(8 * DECMPFS_CHUNK_SZ, seed=2)
+    rsrc = zlib_rsrc([zlib.compress(c) for c in split_chunks(data)])
+    f = DecmpfsFile.from_xattr(
+        decmpfs_xattr(DecmpfsType.zlib_rsrc, len(data)),
+        FancyRawIOBase(io.BytesIO(rsrc)),
+        cache_max_bytes=2 * DECMPFS_CHUNK_SZ,
+    )
+    assert f.read() == data
+    assert f.stats.evictions == 6
+    assert f._cur_bytes <= 2 * DECMPFS_CHUNK_SZ
+    assert f.pread(0, 10) == data[:10]
+    assert f.stats.fetches == 9
+
+
+@pytest.mark.parametrize(
+    "cmp_type,encode",
+    [
+        (DecmpfsType.raw_xattr, lambda b: b),
+        (DecmpfsType.zlib_xattr, zlib.compress),
+        (DecmpfsType.zlib_xattr, lambda b: b"\xff" + b),
+        (DecmpfsType.lzvn_xattr, lzvn_literals),
+        (DecmpfsType.lzvn_xattr, lambda b: b"\x06" + b),
+    ],
+)
+def test_decmpfs_inline(cmp_type, encode):
+    data = synth_data(3000, seed=3)
+    f = DecmpfsFile.from_xattr(decmpfs_xattr(cmp_type, len(data), encode(data)))
+    assert f.inline is not None and f.num_chunks == 1
+    assert f.pread(1000, 500) == data[1000:1500]
+    assert f.read() == data
+    assert f.stats.fetches == 1
+
+
+def test_decmpfs_errors():
+    with pytest.raises(ValueError):
+        DecmpfsFile.from_xattr(decmpfs_xattr(13, 10))
+    with pytest.raises(ValueError):
+        DecmpfsFile.from_xattr(decmpfs_xattr(DecmpfsType.zlib_rsrc, 10))
+    with pytest.raises(ValueError):
+        decode_decmpfs_chunk("zlib", zlib.compress(b"abc"), 4)
+    # a table shorter than the file size says is rejected up front
+    rsrc = offset_rsrc([b"\x06" + bytes(DECMPFS_CHUNK_SZ)])
+    with pytest.raises(ValueError):
+        DecmpfsFile.from_xattr(
+            decmpfs_xattr(DecmpfsType.lzvn_rsrc, 2 * DECMPFS_CHUNK_SZ),
+            FancyRawIOBase(io.BytesIO(rsrc)),
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
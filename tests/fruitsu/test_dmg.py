@@ -1,25 +1,354 @@
 #!/usr/bin/env python3
 
+import bz2
+import hashlib
 import importlib.resources
+import io
+import lzma
+import multiprocessing
+import multiprocessing.util
+import os
+import plistlib
+import random
+import struct
 import sys
+import zlib
 
-import fruitsu.dmg
 import pytest
 from rich import print
 
+import fruitsu.dmg
+from fruitsu.dmg import (
+    DMG,
+    SECTOR_SIZE,
+    BLKXTable,
+    UDIFResourceFile,
+    get_arg_parser,
+    real_main,
+)
+from fruitsu.hfs import HFS
+from fruitsu.io_ext import HTTPFile, OffsetRawIOBase
+from fruitsu.xar import XARFile
+
 
 def inc(x):
     return x + 1
 
 
-def test_dmg():
+def test_dmg(tmp_path, monkeypatch):
     test_dir = importlib.resources.files(__package__)
     hello_dmg_path = test_dir / "hello.dmg"
     # hello_dmg_path = test_dir / 'InstallESD.dmg'
+    monkeypatch.chdir(tmp_path)
     with open(hello_dmg_path, "rb") as dmg_fh:
         dmg = fruitsu.dmg.DMG(dmg_fh)
         print(f"dmg: {dmg}")
         dmg.dump()
+        # printing only, nothing lands in the working directory
+        assert list(tmp_path.iterdir()) == []
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        dmg.dump(out_dir)
+    num_tables = len(dmg.meta.blkx_tables)
+    assert sorted(p.name for p in out_dir.iterdir()) == sorted(
+        [*(f"dump-{i}.img" for i in range(num_tables)), "dump-whole.img"]
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_dmg_convert(workers, tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    out_path = tmp_path / "hello.img"
+    with open(test_dir / "hello.dmg", "rb") as dmg_fh:
+        stats = DMG(dmg_fh).convert(out_path, workers=workers)
+    print(f"stats: {stats}")
+    assert out_path.read_bytes() == (test_dir / "hello-full.img").read_bytes()
+    assert stats.bytes_out + stats.hole_bytes == stats.total_bytes
+    assert stats.hole_bytes > 0
+
+
+def _report_worker_fds(report_path):
+    fd_closed = False
+    try:
+        os.fstat(fruitsu.dmg._worker_fd)
+    except OSError:
+        fd_closed = True
+    with open(report_path, "w") as f:
+        f.write(f"{fd_closed} {fruitsu.dmg._worker_src._mm.closed}")
+
+
+def _convert_worker_exit(src_path, out_path, report_path):
+    fruitsu.dmg._convert_worker_init(src_path, out_path)
+    # runs after the worker's own cleanup, which is registered at priority 0
+    multiprocessing.util.Finalize(
+        None, _report_worker_fds, args=(report_path,), exitpriority=-1
+    )
+
+
+def test_dmg_convert_worker_cleanup(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    out_path = tmp_path / "hello.img"
+    out_path.touch()
+    report_path = tmp_path / "report.txt"
+    proc = multiprocessing.Process(
+        target=_convert_worker_exit,
+        args=(str(test_dir / "hello.dmg"), str(out_path), str(report_path)),
+    )
+    proc.start()
+    proc.join(60)
+    assert proc.exitcode == 0
+    # the output fd and the source mapping are released when the worker exits
+    assert report_path.read_text() == "True True"
+
+
+def _adc_literals(buf):
+    out = bytearray()
+    for off in range(0, len(buf), 128):
+        piece = buf[off : off + 128]
+        out += bytes([0x80 | (len(piece) - 1)]) + piece
+    return bytes(out)
+
+
+def _lzfse_lzvn_literals(buf):
+    lzvn = bytearray()
+    for off in range(0, len(buf), 271):
+        piece = buf[off : off + 271]
+        if len(piece) < 16:
+            lzvn += bytes([0xE0 | len(piece)]) + piece
+        else:
+            lzvn += bytes([0xE0, len(piece) - 16]) + piece
+    lzvn += b"\x06" + b"\0" * 7
+    hdr = b"bvxn" + len(buf).to_bytes(4, "little") + len(lzvn).to_bytes(4, "little")
+    return hdr + lzvn + b"bvx$"
+
+
+CHUNK_ENCODERS = {
+    "raw": bytes,
+    "zlib": zlib.compress,
+    "bzip2": bz2.compress,
+    "lzma": lzma.compress,
+    "adc": _adc_literals,
+    "lzfse": _lzfse_lzvn_literals,
+    "zero": lambda buf: b"",
+}
+
+
+def _make_udif(image, codecs, chunk_sectors=64):
+    nsec = len(image) // 512
+    data = bytearray()
+    chunks = []
+    for sec in range(0, nsec, chunk_sectors):
+        cnt = min(chunk_sectors, nsec - sec)
+        raw = image[sec * 512 : (sec + cnt) * 512]
+        if raw == bytes(len(raw)):
+            ty = "zero"
+        else:
+            ty = codecs[0]
+            codecs = codecs[1:] + codecs[:1]
+        enc = CHUNK_ENCODERS[ty](raw)
+        chunks.append((ty, sec, cnt, len(data), len(enc)))
+        data += enc
+    chunks.append(("terminator", nsec, 0, len(data), 0))
+    chksum = {"chksum_type": 0, "chksum_sz": 0, "chksum": [0] * 32}
+    mish = BLKXTable.build(
+        {
+            "version": 1,
+            "sector_num": 0,
+            "sector_count": nsec,
+            "data_off": 0,
+            "buffers_needed": 0,
+            "block_descriptors": 0,
+            "chksum": chksum,
+            "num_block_chunks": len(chunks),
+            "block_chunks": [
+                {
+                    "entry_type": ty,
+                    "comment": 0,
+                    "sector_num": sec,
+                    "sector_count": cnt,
+                    "compressed_off": off,
+                    "compressed_sz": sz,
+                }
+                for ty, sec, cnt, off, sz in chunks
+            ],
+        }
+    )
+    blkx = {"Attributes": "0x0050", "CFName": "disk", "Data": mish, "ID": "0"}
+    plist = plistlib.dumps({"resource-fork": {"blkx": [blkx | {"Name": "disk"}]}})
+    trailer = UDIFResourceFile.build(
+        {
+            "version": 4,
+            "flags": 1,
+            "running_data_fork_off": 0,
+            "data_fork_off": 0,
+            "data_fork_sz": len(data),
+            "rsrc_fork_off": 0,
+            "rsc_fork_sz": 0,
+            "seg_num": 1,
+            "seg_count": 1,
+            "seg_id": bytes(16),
+            "data_chksum": chksum,
+            "plist_off": len(data),
+            "plist_sz": len(plist),
+            "external": bytes(64),
+            "codesign_off": 0,
+            "codesign_sz": 0,
+            "chksum": chksum,
+            "image_variant": 1,
+            "sector_count": nsec,
+        }
+    )
+    return bytes(data) + plist + trailer
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_dmg_convert_all_codecs(workers, tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    image = (test_dir / "hello-full.img").read_bytes()
+    dmg_path = tmp_path / "codecs.dmg"
+    dmg_path.write_bytes(
+        _make_udif(image, ["zlib", "bzip2", "lzma", "lzfse", "adc", "raw"])
+    )
+    out_path = tmp_path / "codecs.img"
+    with open(dmg_path, "rb") as dmg_fh:
+        dmg = DMG(dmg_fh)
+        types = {str(c.entry_type) for c in dmg.meta.blkx_tables[0].block_chunks}
+        seen = []
+        stats = dmg.convert(
+            out_path,
+            progress=lambda st: seen.append(st.bytes_out + st.hole_bytes),
+            workers=workers,
+            batch_sz=1,
+            max_inflight_bytes=64 * 1024,
+        )
+    assert seen == sorted(seen) and len(seen) >= 6
+    assert types == set(CHUNK_ENCODERS) | {"terminator"}
+    assert out_path.read_bytes() == image
+    assert stats.bytes_out + stats.hole_bytes == len(image)
+
+
+def test_dmg_convert_cli(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    out_path = tmp_path / "cli.img"
+    args = get_arg_parser().parse_args(
+        ["convert", str(test_dir / "hello.dmg"), str(out_path), "-j", "2"]
+    )
+    assert real_main(args) == 0
+    assert out_path.read_bytes() == (test_dir / "hello-full.img").read_bytes()
+
+
+def test_dmg_block_device():
+    test_dir = importlib.resources.files(__package__)
+    image = (test_dir / "hello-full.img").read_bytes()
+    with open(test_dir / "hello.dmg", "rb") as dmg_fh:
+        dev = DMG(dmg_fh).block_device()
+        assert dev.sz == len(image)
+        assert dev.read() == image
+        assert dev.read(16) == b""
+        rng = random.Random(0)
+        for _ in range(200):
+            off = rng.randrange(len(image))
+            size = rng.randrange(min(len(image) - off, 256 * 1024) + 1)
+            assert dev.pread(off, size) == image[off : off + size]
+        dev.seek(-1000, io.SEEK_END)
+        assert dev.read(4096) == image[-1000:]
+        assert dev[1024:512] == image[1024:1536]
+        with pytest.raises(ValueError):
+            dev.pread(len(image) - 10, 20)
+
+
+def test_dmg_block_device_cache(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    image = (test_dir / "hello-full.img").read_bytes()
+    dmg_path = tmp_path / "codecs.dmg"
+    dmg_path.write_bytes(_make_udif(image, ["zlib", "bzip2", "lzma"]))
+    chunk_sz = 64 * SECTOR_SIZE
+    with open(dmg_path, "rb") as dmg_fh:
+        dev = DMG(dmg_fh).block_device(cache_max_bytes=2 * chunk_sz)
+        off = next(r.out_off for r in dev._runs if r.type == "zlib")
+        assert dev.pread(off + 100, 16) == image[off + 100 : off + 116]
+        assert dev.stats.misses == 1
+        assert dev.pread(off, 32) == image[off : off + 32]
+        assert dev.stats.misses == 1 and dev.stats.hits == 1
+        assert dev.read() == image
+        assert dev.stats.evictions > 0
+        assert dev._cur_bytes <= 2 * chunk_sz
+
+
+def test_dmg_block_device_hfs():
+    test_dir = importlib.resources.files(__package__)
+    part = (test_dir / "hello-hfs-part.img").read_bytes()
+    with open(test_dir / "hello.dmg", "rb") as dmg_fh:
+        dev = DMG(dmg_fh).block_device()
+        part_fh = OffsetRawIOBase(dev, 40 * SECTOR_SIZE, len(part))
+        assert part_fh.read() == part
+        assert dev.partition(4).pread(0, len(part)) == part
+        vol = HFS(part_fh)
+        print(f"vol.hdr: {vol.hdr}")
+        assert vol.hdr.blockSize == 4096
+
+
+def _make_xar(name, buf):
+    digest = hashlib.sha1(buf).hexdigest()
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>'
+        '<checksum style="sha1"><offset>0</offset><size>20</size></checksum>'
+        f'<file id="1"><data><length>{len(buf)}</length><offset>20</offset>'
+        f"<size>{len(buf)}</size>"
+        '<encoding style="application/octet-stream"/>'
+        f'<extracted-checksum style="sha1">{digest}</extracted-checksum>'
+        f'<archived-checksum style="sha1">{digest}</archived-checksum>'
+        f"</data><name>{name}</name><type>file</type></file></toc></xar>"
+    ).encode()
+    toc_comp = zlib.compress(xml)
+    hdr = struct.pack(">IHHQQI", 0x78617221, 28, 1, len(toc_comp), len(xml), 1)
+    return hdr + toc_comp + hashlib.sha1(toc_comp).digest() + buf
+
+
+def _check_remote_hfs(dmg, image):
+    dev = dmg.block_device()
+    part_off = 40 * SECTOR_SIZE
+    vol = HFS(OffsetRawIOBase(dev, part_off, 3712 * SECTOR_SIZE))
+    assert vol.hdr.blockSize == 4096
+    off = part_off + 64 * 1024
+    assert dev.pread(off, 8192) == image[off : off + 8192]
+
+
+def test_dmg_remote(range_server):
+    test_dir = importlib.resources.files(__package__)
+    image = (test_dir / "hello-full.img").read_bytes()
+    dmg_buf = _make_udif(image, ["raw", "zlib"])
+    url = range_server.add("remote.dmg", dmg_buf)
+    http_fh = HTTPFile(url, cache_blksz=4096)
+    dmg = DMG(http_fh)
+    assert dmg.partition_names == ["disk"]
+    _check_remote_hfs(dmg, image)
+    fetched = http_fh.cache_stats.fetched_bytes
+    print(f"fetched {fetched} of {len(dmg_buf)} bytes")
+    assert fetched < len(dmg_buf) // 4
+
+
+def test_dmg_remote_in_xar(range_server):
+    test_dir = importlib.resources.files(__package__)
+    image = (test_dir / "hello-full.img").read_bytes()
+    dmg_buf = _make_udif(image, ["raw", "zlib"])
+    url = range_server.add("nested.pkg", _make_xar("inner.dmg", dmg_buf))
+    http_fh = HTTPFile(url, cache_blksz=4096)
+    xar = XARFile(http_fh)
+    ino = xar.toc.rootfs.lookup("/inner.dmg")
+    dmg = DMG(xar.open_member(ino))
+    assert dmg.sz == len(dmg_buf)
+    _check_remote_hfs(dmg, image)
+    fetched = http_fh.cache_stats.fetched_bytes
+    print(f"fetched {fetched} of {len(dmg_buf)} bytes")
+    assert fetched < len(dmg_buf) // 4
+
+
+def test_dmg_list_cli(range_server, capsys):
+    url = range_server.url("hello.dmg")
+    assert real_main(get_arg_parser().parse_args(["list", url])) == 0
+    out = capsys.readouterr().out
+    assert "4: 'disk image (Apple_HFS : 4)' sector 40 count 3712" in out
 
 
 if __name__ == "__main__":
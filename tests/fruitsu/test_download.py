@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import hashlib
+import random
+import sys
+
+import pytest
+from rich import print
+
+from fruitsu.chunklist import Chunklist, ChunklistChunk, ChunklistHeader
+from fruitsu.download import (
+    DownloadJournalHeader,
+    ResumableDownload,
+    download,
+    journal_path,
+)
+from fruitsu.io_ext import HTTPFile
+
+CHUNK_SZ = 256 * 1024
+
+
+def make_chunklist(payload, chunk_sz):
+    chunks = [payload[i : i + chunk_sz] for i in range(0, len(payload), chunk_sz)]
+    body = b"".join(
+        ChunklistChunk.build(
+            {"chunk_size": len(c), "chunk_sha256": hashlib.sha256(c).digest()}
+        )
+        for c in chunks
+    )
+    hdr = ChunklistHeader.build(
+        {
+            "cl_header_size": 36,
+            "cl_file_ver": 1,
+            "cl_chunk_method": 1,
+            "cl_sig_method": 0,
+            "__unused1": 0,
+            "cl_chunk_count": len(chunks),
+            "cl_chunk_offset": 36,
+            "cl_sig_offset": 0,
+        }
+    )
+    return Chunklist.from_buffer(hdr + body)
+
+
+def range_gets(srv, name):
+    return [r.range for r in srv.log if r.method == "GET" and r.path == f"/{name}"]
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def payload():
+    return random.Random(22).randbytes(10 * CHUNK_SZ + 4321)
+
+
+def test_download_verified(range_server, tmp_path, payload):
+    url = range_server.add("payload.pkg", payload)
+    cl = make_chunklist(payload, CHUNK_SZ)
+    dest = tmp_path / "payload.pkg"
+    # each fault hits one GET, all of them recover within the retry budget
+    range_server.inject(
+        "payload.pkg", "error", "corrupt", "truncate", "corrupt", "long"
+    )
+    progress = []
+    stats = download(
+        url, dest, cl, progress=progress.append, workers=4, retries=4, retry_delay=0
+    )
+    print(f"stats: {stats} throughput: {stats.throughput / 2**20:.0f} MiB/s")
+    assert stats.ok and stats.failed == []
+    assert stats.chunks == 11 and stats.resumed_chunks == 0
+    assert stats.retries == 5
+    assert stats.bytes_fetched == len(payload)
+    assert len(progress) == 11
+    assert dest.read_bytes() == payload
+    # the journal is dropped once the download is complete
+    assert not journal_path(dest).exists()
+    assert len(range_gets(range_server, "payload.pkg")) == 16
+
+
+def _crash_at(n):
+    def crash(stats):
+        if stats.chunks == n:
+            raise Crash
+
+    return crash
+
+
+def test_download_resume(range_server, tmp_path, payload):
+    url = range_server.add("payload.pkg", payload)
+    cl = make_chunklist(payload, CHUNK_SZ)
+    dest = tmp_path / "payload.pkg"
+
+    with pytest.raises(Crash):
+        ResumableDownload(HTTPFile(url), dest, cl, workers=1).run(_crash_at(4))
+    assert dest.stat().st_size == len(payload)
+    jpath = journal_path(dest)
+    jbuf = jpath.read_bytes()
+    hdr_sz = DownloadJournalHeader.sizeof()
+    assert len(jbuf) == hdr_sz + 4 * 8
+    # a torn trailing record is ignored
+    jpath.write_bytes(jbuf + b"\x05\x00\x00")
+    range_server.log.clear()
+    stats = ResumableDownload(HTTPFile(url), dest, cl, workers=4).run()
+    assert stats.ok
+    assert stats.resumed_chunks == 4 and stats.chunks == 7
+    assert stats.bytes_fetched == len(payload) - 4 * CHUNK_SZ
+    # journaled chunks were neither fetched nor rehashed
+    gets = range_gets(range_server, "payload.pkg")
+    assert len(gets) == 7
+    assert not any(
+        g.startswith(f"bytes={i * CHUNK_SZ}-") for g in gets for i in range(4)
+    )
+    assert dest.read_bytes() == payload
+
+
+def test_download_failures(range_server, tmp_path, payload):
+    url = range_server.add("payload.pkg", payload)
+    cl = make_chunklist(payload, CHUNK_SZ)
+    dest = tmp_path / "payload.pkg"
+    range_server.inject("payload.pkg", *["error"] * 3)
+    stats = download(url, dest, cl, workers=1, retries=2, retry_delay=0)
+    # the first chunk exhausted its retries, everything else landed
+    assert not stats.ok and stats.failed == [0]
+    assert stats.chunks == 10
+    assert journal_path(dest).exists()
+    range_server.log.clear()
+    stats = download(url, dest, cl, workers=1, retry_delay=0)
+    assert stats.ok and stats.resumed_chunks == 10 and stats.chunks == 1
+    assert range_gets(range_server, "payload.pkg") == [f"bytes=0-{CHUNK_SZ - 1}"]
+    assert dest.read_bytes() == payload
+
+
+def test_download_stale_journal(range_server, tmp_path, payload):
+    dest = tmp_path / "payload.pkg"
+    url = range_server.add("payload.pkg", payload)
+    with pytest.raises(Crash):
+        download(url, dest, workers=1, chunk_sz=CHUNK_SZ, progress=_crash_at(3))
+    # the remote object changed so the old journal no longer applies
+    payload2 = bytes(reversed(payload))
+    url = range_server.add("payload.pkg", payload2)
+    range_server.log.clear()
+    stats = download(url, dest, workers=2, chunk_sz=CHUNK_SZ)
+    assert stats.ok and stats.resumed_chunks == 0 and stats.chunks == 11
+    assert dest.read_bytes() == payload2
+    # a journal without its data file starts over too
+    with pytest.raises(Crash):
+        download(url, dest, workers=1, chunk_sz=CHUNK_SZ, progress=_crash_at(3))
+    dest.unlink()
+    stats = download(url, dest, workers=2, chunk_sz=CHUNK_SZ)
+    assert stats.ok and stats.resumed_chunks == 0
+    assert dest.read_bytes() == payload2
+    with pytest.raises(ValueError):
+        ResumableDownload(HTTPFile(url), dest, make_chunklist(payload[:-1], CHUNK_SZ))
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import importlib.resources
+import sys
+
+import pytest
+from construct import (
+    ConstError,
+    Int8ub,
+    Int16ub,
+    Int32ub,
+    Int32ul,
+    Padding,
+    StreamError,
+    Struct,
+)
+from rich import print
+
+from fruitsu.dmg import DMG, BLKXChunkEntry, BLKXTable, BLKXTableFast
+from fruitsu.fast_struct import FastStruct
+from fruitsu.hfs import (
+    BTNodeDescriptor,
+    BTNodeDescriptorFast,
+    HFSPlusVolumeHeader,
+    HFSPlusVolumeHeaderFast,
+)
+from fruitsu.xar import XARHeader, XARHeaderFast
+
+
+def test_fast_struct_blkx():
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "hello.dmg", "rb") as dmg_fh:
+        blkx = DMG(dmg_fh).meta.plist["resource-fork"]["blkx"]
+    for blk_info in blkx:
+        fast = BLKXTableFast.parse(blk_info["Data"])
+        slow = BLKXTable.parse(blk_info["Data"])
+        assert fast == slow
+        assert [str(c.entry_type) for c in fast.block_chunks] == [
+            str(c.entry_type) for c in slow.block_chunks
+        ]
+    chunks_buf = BLKXChunkEntry[len(slow.block_chunks)].build(slow.block_chunks)
+    entries = FastStruct(BLKXChunkEntry).parse_array(chunks_buf, len(slow.block_chunks))
+    assert entries == slow.block_chunks
+    bad = b"xxxx" + blkx[0]["Data"][4:]
+    with pytest.raises(ConstError):
+        BLKXTableFast.parse(bad)
+    with pytest.raises(StreamError):
+        BLKXTableFast.parse(blkx[0]["Data"][:-8])
+
+
+def test_fast_struct_hfs():
+    test_dir = importlib.resources.files(__package__)
+    part = (test_dir / "hello-hfs-part.img").read_bytes()
+    hdr = HFSPlusVolumeHeaderFast.parse(part, 1024)
+    print(f"hdr: {hdr}")
+    assert hdr == HFSPlusVolumeHeader.parse(part[1024:])
+    assert hdr.createDate == HFSPlusVolumeHeader.parse(part[1024:]).createDate
+    cat_off = hdr.catalogFile.extents[0].startBlock * hdr.blockSize
+    desc = BTNodeDescriptorFast.parse(part, cat_off)
+    assert desc == BTNodeDescriptor.parse(part[cat_off:])
+    assert desc.kind == "kBTHeaderNode"
+    with pytest.raises(StreamError):
+        HFSPlusVolumeHeaderFast.parse(part[1024:1100])
+
+
+@pytest.mark.parametrize("name", ["etc.xar", "hello-gz.xar", "hello-nocomp.xar"])
+def test_fast_struct_xar(name):
+    test_dir = importlib.resources.files(__package__)
+    buf = (test_dir / name).read_bytes()
+    hdr = XARHeaderFast.parse(buf)
+    assert hdr == XARHeader.parse(buf)
+    assert hdr.cksum_alg == XARHeader.parse(buf).cksum_alg
+
+
+def test_fast_struct_mixed_byte_order():
+    with pytest.raises(TypeError):
+        FastStruct(Struct("a" / Int32ub, "b" / Int32ul))
+    con = Struct("a" / Int32ub, Padding(2), "b" / Int16ub, "c" / Int8ub)
+    fast = FastStruct(con)
+    assert fast.fixed_sz == 9
+    buf = bytes(range(9))
+    assert fast.parse(buf) == con.parse(buf)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
@@ -4,6 +4,7 @@ import importlib.resources
 import sys
 
 import pytest
+from fruitsu.fs import DirEntType, INode, INodeTable
 from rich import print
 
 
@@ -13,6 +14,83 @@ def test_fs():
     print(hello_dmg_path)
 
 
+def _sample_tree():
+    root = INode.root_node()
+    a = root.add_child("a", DirEntType.DIR)
+    b = root.add_child("b", DirEntType.DIR)
+    # interleaved inserts still give contiguous child ranges
+    for i in range(3):
+        a.add_child(f"a{i}", DirEntType.REG).size = i
+        b.add_child(f"b{i}", DirEntType.REG).size = 10 + i
+    b.add_child("link", DirEntType.LNK)
+    return root
+
+
+def test_inode_table():
+    root = _sample_tree()
+    table = root.table
+    assert len(table) == 10
+    assert [c.name for c in root.children] == ["a", "b"]
+    assert [n.name for n in root.descendants] == [
+        "a",
+        "a0",
+        "a1",
+        "a2",
+        "b",
+        "b0",
+        "b1",
+        "b2",
+        "link",
+    ]
+    b2 = root.lookup("/b/b2")
+    assert (b2.size, b2.type, b2.size_comp, b2.data_off) == (
+        12,
+        DirEntType.REG,
+        None,
+        None,
+    )
+    assert b2.parent == root.lookup("b")
+    assert root.lookup("/a/../b/./b1").size == 11
+    assert root.lookup("/a/missing") is None
+    assert root.parent is None
+    assert list(table.child_range(table.root.lookup("b").idx)) == [4, 6, 8, 9]
+    root.dump()
+
+
+def test_inode_table_sections_roundtrip():
+    root = _sample_tree()
+    sections = [memoryview(s) for s in root.table.to_sections()]
+    loaded = INodeTable.from_sections(INode, sections)
+    assert [(n.name, n.type, n.size) for n in loaded.root.descendants] == [
+        (n.name, n.type, n.size) for n in root.descendants
+    ]
+    # loaded tables stay appendable
+    loaded.root.lookup("a").add_child("new", DirEntType.REG)
+    assert [c.name for c in loaded.root.lookup("a").children][-1] == "new"
+    assert loaded.root.lookup("/a/a1").name == "a1"
+
+
+def test_inode_path_index():
+    root = _sample_tree()
+    table = root.table
+    index = table.path_index()
+    assert index.paths["/b/b1"] == root.lookup("/b/b1").idx
+    assert table.path_index() is index
+    assert root.lookup("b/b1") == root.lookup("/b/b1/")
+    assert root.lookup("b").lookup("b1") == root.lookup("/b/b1")
+    assert root.lookup("b").lookup("../a/a0").name == "a0"
+    # mutation invalidates the index
+    root.lookup("/a").add_child("late", DirEntType.REG)
+    assert table.path_index() is not index
+    assert root.lookup("/a/late").name == "late"
+    root.lookup("/a/late").name = "renamed"
+    assert root.lookup("/a/late") is None
+    assert root.lookup("/a/renamed") is not None
+    # duplicate names resolve to the first entry
+    root.add_child("a", DirEntType.REG)
+    assert root.lookup("/a").is_dir and root.lookup("/a/a0") is not None
+
+
 if __name__ == "__main__":
     args = sys.argv
     print(f"pytest.main args: {args}")
@@ -1,21 +1,674 @@
 #!/usr/bin/env python3
 
+import collections
+import datetime
+import hashlib
 import importlib.resources
+import io
+import random
+import struct
 import sys
+import time
+import zlib
 
-import fruitsu.hfs
+import fs.copy
 import pytest
+from fs.errors import FileExpected, ResourceNotFound, ResourceReadOnly
 from rich import print
 
+import fruitsu.hfs
+from fruitsu.decmpfs import DecmpfsHeader, DecmpfsType
+from fruitsu.hfs import (
+    HFS,
+    HFSFS,
+    BTHeaderRec,
+    BTNodeDescriptor,
+    BTree,
+    CatalogBTree,
+    CatalogKey,
+    CatalogRecordType,
+    ExtentsBTree,
+    HFSFork,
+    HFSPlusCatalogFile,
+    HFSPlusCatalogFolder,
+    HFSPlusForkData,
+    HFSPlusVolumeHeader,
+    hfs_decompose,
+    hfs_fold_name,
+)
+from fruitsu.io_ext import FancyRawIOBase
+
 
-def test_dmg():
+def test_dmg(tmp_path, monkeypatch):
     test_dir = importlib.resources.files(__package__)
     hello_hfs_part_path = test_dir / "hello-hfs-part.img"
     # hello_hfs_part_path = test_dir / 'InstallESD.dmg'
+    monkeypatch.chdir(tmp_path)
     with open(hello_hfs_part_path, "rb") as hfs_fh:
         hfs = fruitsu.hfs.HFS(hfs_fh)
         print(f"hfs: {hfs}")
         hfs.dump()
+        # dumping never writes into the working directory
+        assert list(tmp_path.iterdir()) == []
+        sz = hfs.dump_catalog(tmp_path / "catalog.bin")
+    cat_buf = (tmp_path / "catalog.bin").read_bytes()
+    assert len(cat_buf) == sz == hfs.hdr.catalogFile.logicalSize
+    assert BTNodeDescriptor.parse(cat_buf).kind == "kBTHeaderNode"
+
+
+def test_hfs_catalog():
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "hello-hfs-part.img", "rb") as hfs_fh:
+        cat = HFS(hfs_fh).catalog
+        root = cat.lookup("/")
+        assert root.folderID == 2 and root.valence == 3
+        assert cat.thread(2).nodeName == "hello_dmg_rootfs"
+        names = [name for name, _ in cat.children(2)]
+        assert "hello" in names
+        rec = cat.lookup("/hello/world.txt")
+        assert rec.recordType == CatalogRecordType.file
+        assert rec.dataFork.logicalSize == 14
+        assert cat.path_of(rec.fileID) == "/hello/world.txt"
+        assert cat.lookup("/HELLO/World.TXT") == rec
+        assert cat.lookup("/hello/world.txt/x") is None
+        assert cat.lookup("/nope") is None
+        print(f"stats: {cat.stats}")
+        assert cat.stats.fetches == 1
+
+
+_EPOCH = datetime.datetime(2024, 1, 1)
+_BSD_INFO = {
+    "ownerID": 0,
+    "groupID": 0,
+    "adminFlags": 0,
+    "ownerFlags": 0,
+    "fileMode": 0o100644,
+    "special": 0,
+}
+_FORK = {
+    "logicalSize": 0,
+    "clumpSize": 0,
+    "totalBlocks": 0,
+    "extents": [{"startBlock": 0, "blockCount": 0}] * 8,
+}
+
+
+def _folder(folder_id, valence):
+    return HFSPlusCatalogFolder.build(
+        {
+            "recordType": CatalogRecordType.folder,
+            "flags": 0,
+            "valence": valence,
+            "folderID": folder_id,
+            **dict.fromkeys(
+                (
+                    "createDate",
+                    "contentModDate",
+                    "attributeModDate",
+                    "accessDate",
+                    "backupDate",
+                ),
+                _EPOCH,
+            ),
+            "permissions": {**_BSD_INFO, "fileMode": 0o40755},
+            "userInfo": bytes(16),
+            "finderInfo": bytes(16),
+            "textEncoding": 0,
+            "folderCount": 0,
+        }
+    )
+
+
+def _fork(size, extents, block_size):
+    return {
+        **_FORK,
+        "logicalSize": size,
+        "totalBlocks": -(-size // block_size) if extents else 0,
+        "extents": [
+            {"startBlock": start, "blockCount": cnt}
+            for start, cnt in list(extents) + [(0, 0)] * (8 - len(extents))
+        ],
+    }
+
+
+def _file(file_id, size, extents=(), block_size=4096, rsrc=(0, ()), owner_flags=0):
+    return HFSPlusCatalogFile.build(
+        {
+            "recordType": CatalogRecordType.file,
+            "flags": 0,
+            "reserved1": 0,
+            "fileID": file_id,
+            **dict.fromkeys(
+                (
+                    "createDate",
+                    "contentModDate",
+                    "attributeModDate",
+                    "accessDate",
+                    "backupDate",
+                ),
+                _EPOCH,
+            ),
+            "permissions": {**_BSD_INFO, "ownerFlags": owner_flags},
+            "userInfo": bytes(16),
+            "finderInfo": bytes(16),
+            "textEncoding": 0,
+            "reserved2": 0,
+            "dataFork": _fork(size, extents, block_size),
+            "resourceFork": _fork(*rsrc, block_size),
+        }
+    )
+
+
+def _thread(rec_type, parent_id, name):
+    units = name.encode("utf-16-be")
+    return struct.pack(">hhIH", rec_type, 0, parent_id, len(units) // 2) + units
+
+
+def _cat_key(parent_id, name):
+    units = name.encode("utf-16-be")
+    return struct.pack(">HIH", 6 + len(units), parent_id, len(units) // 2) + units
+
+
+def _node(kind, height, records, node_size, flink=0, blink=0):
+    desc = BTNodeDescriptor.build(
+        {
+            "fLink": flink,
+            "bLink": blink,
+            "kind": kind,
+            "height": height,
+            "numRecords": len(records),
+            "reserved": 0,
+        }
+    )
+    body = bytearray(desc)
+    offsets = []
+    for rec in records:
+        offsets.append(len(body))
+        body += rec
+    offsets.append(len(body))
+    tail = struct.pack(f">{len(offsets)}H", *reversed(offsets))
+    assert len(body) + len(tail) <= node_size
+    return bytes(body) + bytes(node_size - len(body) - len(tail)) + tail
+
+
+def _pack_level(records, node_size):
+    # greedily fill nodes, leaving room for the offset table
+    groups, cur, cur_sz = [], [], 14 + 2
+    for key, rec in records:
+        if cur and cur_sz + len(rec) + 2 > node_size:
+            groups.append(cur)
+            cur, cur_sz = [], 14 + 2
+        cur.append((key, rec))
+        cur_sz += len(rec) + 2
+    groups.append(cur)
+    return groups
+
+
+def _make_btree(leaf_recs, node_size):
+    # leaf_recs are (sort key, key + data) with big, variable length keys
+    leaf_recs = sorted(leaf_recs, key=lambda r: r[0])
+    nodes: dict[int, bytes] = {}
+    next_num = 1
+    level = _pack_level(leaf_recs, node_size)
+    first_leaf = next_num
+    nums = list(range(next_num, next_num + len(level)))
+    next_num += len(level)
+    for i, group in enumerate(level):
+        flink = nums[i + 1] if i + 1 < len(nums) else 0
+        blink = nums[i - 1] if i > 0 else 0
+        nodes[nums[i]] = _node(
+            "kBTLeafNode", 1, [r for _, r in group], node_size, flink, blink
+        )
+    height = 1
+    while len(level) > 1:
+        height += 1
+        index_recs = []
+        for num, group in zip(nums, level):
+            key_buf = group[0][1][: 2 + struct.unpack(">H", group[0][1][:2])[0]]
+            index_recs.append((group[0][0], key_buf + struct.pack(">I", num)))
+        level = _pack_level(index_recs, node_size)
+        nums = list(range(next_num, next_num + len(level)))
+        next_num += len(level)
+        for i, group in enumerate(level):
+            flink = nums[i + 1] if i + 1 < len(nums) else 0
+            nodes[nums[i]] = _node(
+                "kBTIndexNode", height, [r for _, r in group], node_size, flink
+            )
+    hdr_rec = BTHeaderRec.build(
+        {
+            "treeDepth": height,
+            "rootNode": nums[0],
+            "leafRecords": len(leaf_recs),
+            "firstLeafNode": first_leaf,
+            "lastLeafNone": first_leaf + len(_pack_level(leaf_recs, node_size)) - 1,
+            "nodeSize": node_size,
+            "maxKeyLength": 516,
+            "totalNodes": next_num,
+            "freeNodes": 0,
+            "reserved1": 0,
+            "clumpSize": 0,
+            "btreeType": 0,
+            "keyCompareType": 0xCF,
+            "attributes": 6,
+            "reserved3": [0] * 16,
+        }
+    )
+    nodes[0] = _node("kBTHeaderNode", 0, [hdr_rec, bytes(128), bytes(64)], node_size)
+    return b"".join(nodes[i] for i in range(next_num)), height
+
+
+def _make_catalog(entries, node_size=512):
+    # entries are (parent_id, name, record data), emitted as a valid catalog
+    # B-tree sorted with the reader's own case-folding order
+    leaf_recs = [
+        (CatalogKey(parent, name).sort_key(), _cat_key(parent, name) + data)
+        for parent, name, data in entries
+    ]
+    return _make_btree(leaf_recs, node_size)
+
+
+def _synth_catalog(num_files):
+    rng = random.Random(7)
+    names = [f"File{i:05d}-{rng.randrange(1 << 30):x}.txt" for i in range(num_files)]
+    entries = [
+        (1, "vol", _folder(2, num_files + 1)),
+        (2, "", _thread(CatalogRecordType.folder_thread, 1, "vol")),
+        (2, "Sub\u200cDir", _folder(3, 1)),
+        (3, "", _thread(CatalogRecordType.folder_thread, 2, "Sub\u200cDir")),
+        (3, "Straße.txt", _file(99, 5)),
+        (99, "", _thread(CatalogRecordType.file_thread, 3, "Straße.txt")),
+    ]
+    for i, name in enumerate(names):
+        entries.append((2, name, _file(100 + i, i)))
+        entries.append((100 + i, "", _thread(CatalogRecordType.file_thread, 2, name)))
+    return entries, names
+
+
+def test_hfs_catalog_btree_deep():
+    entries, names = _synth_catalog(1000)
+    buf, height = _make_catalog(entries)
+    assert height >= 3
+    cat = CatalogBTree(FancyRawIOBase(io.BytesIO(buf)), cache_max_bytes=16 * 512)
+    assert cat.header.treeDepth == height
+    rng = random.Random(3)
+    for i in rng.sample(range(len(names)), 100):
+        fetches = cat.stats.fetches
+        name = names[i]
+        rec = cat.lookup("/" + (name.upper() if i % 2 else name))
+        assert rec is not None and rec.fileID == 100 + i
+        assert rec.dataFork.logicalSize == i
+        # one root-to-leaf descent per component plus the root thread
+        assert cat.stats.fetches - fetches <= 2 * height
+        assert cat.path_of(rec.fileID) == "/" + name
+    assert cat.stats.evictions > 0
+    assert cat._cur_bytes <= 16 * 512
+    assert cat.lookup("/SUBDIR/STRASSE.TXT") is None
+    assert cat.lookup("/subdir/straße.txt").fileID == 99
+    assert cat.lookup("/Nope.txt") is None
+    children = [name for name, _ in cat.children(2)]
+    assert len(children) == len(names) + 1
+    assert children == sorted(children, key=lambda n: CatalogKey(2, n).sort_key())
+
+
+def test_hfs_catalog_cache_hot():
+    entries, names = _synth_catalog(1000)
+    buf, height = _make_catalog(entries)
+    cat = CatalogBTree(FancyRawIOBase(io.BytesIO(buf)))
+    for name in names:
+        assert cat.lookup("/" + name) is not None
+    fetches = cat.stats.fetches
+    for name in names[::7]:
+        assert cat.lookup("/" + name) is not None
+    assert cat.stats.fetches == fetches
+    assert cat.stats.hits > 0
+    # the base class has no key codec so it can't be opened on its own
+    with pytest.raises(TypeError):
+        BTree(FancyRawIOBase(io.BytesIO(buf)))
+
+
+# one folder's names as stored on disk, in TN1150 FastUnicodeCompare order
+TN1150_ORDER = [
+    "A\u0308pfel.txt",
+    "Ca\u0301fe\u0301.txt",
+    "I\u0307stanbul.txt",
+    "ko\u200dala.txt",
+    *(f"n{i:02d}.txt" for i in range(12)),
+    "Zebra.txt",
+    "\u00dftrasse.txt",
+    "\u00c6ther.txt",
+    "\u10a0.txt",
+    "\u1e9eig.txt",
+    "\u2126m.txt",
+    "\u212aelvin.txt",
+    "\u24b6.txt",
+    "\U0001f600.txt",
+    "\uf900.txt",
+]
+
+
+def test_hfs_name_folding():
+    # the whole one unit in, one unit out table, ignorables as 0
+    folded = [ord(f) if (f := hfs_fold_name(chr(u))) else 0 for u in range(0x10000)]
+    assert (
+        hashlib.sha256(struct.pack(">65536H", *folded)).hexdigest()
+        == "b8e22686df0e37d75ab4e0d24c83cf92a5cab407cb6ff722fa54384d6544be46"
+    )
+    assert hfs_fold_name("\u00c6\u10a0\u0130\u0000") == "\u00e6\u10d0\u0130\uffff"
+    assert hfs_fold_name("\u212a\u00c0\u1e9e\u24b6") == "\u212a\u00c0\u1e9e\u24b6"
+    assert hfs_decompose("\u00c5\u1e0b\u0323") == "A\u030ad\u0323\u0307"
+    assert hfs_decompose("\u2126\uf900\u00c5") == "\u2126\uf900A\u030a"
+    assert hfs_decompose("\uac01") == "\u1100\u1161\u11a8"
+
+
+def test_hfs_catalog_non_ascii():
+    # sort keys are the known on-disk order, not the reader's own folding
+    leaf_recs = [
+        ((1, 0), _cat_key(1, "vol") + _folder(2, len(TN1150_ORDER))),
+        ((2, -1), _cat_key(2, "") + _thread(CatalogRecordType.folder_thread, 1, "vol")),
+    ]
+    for i, name in enumerate(TN1150_ORDER):
+        thread = _thread(CatalogRecordType.file_thread, 2, name)
+        leaf_recs.append(((2, i), _cat_key(2, name) + _file(100 + i, i)))
+        leaf_recs.append(((100 + i, -1), _cat_key(100 + i, "") + thread))
+    buf, height = _make_btree(leaf_recs, 512)
+    assert height >= 3
+    cat = CatalogBTree(FancyRawIOBase(io.BytesIO(buf)))
+    assert [name for name, _ in cat.children(2)] == TN1150_ORDER
+    for i, name in enumerate(TN1150_ORDER):
+        assert cat.lookup("/" + name).fileID == 100 + i
+    found = {
+        "/\u00c4pfel.txt": 0,
+        "/\u00e4PFEL.TXT": 0,
+        "/C\u00e1f\u00e9.txt": 1,
+        "/\u0130stanbul.txt": 2,
+        "/koala.txt": 3,
+        "/\u00e6ther.txt": 18,
+        "/\u10d0.txt": 19,
+    }
+    for path, i in found.items():
+        assert cat.lookup(path).fileID == 100 + i
+    # letters TN1150 leaves unfolded only match themselves
+    for path in ["/kelvin.txt", "/\u03c9m.txt", "/\u00dfig.txt", "/\u24d0.txt"]:
+        assert cat.lookup(path) is None
+    assert cat.path_of(100 + TN1150_ORDER.index("\uf900.txt")) == "/\uf900.txt"
+
+
+def _extent_key(file_id, fork_type, start_block):
+    return struct.pack(">HBBII", 10, fork_type, 0, file_id, start_block)
+
+
+def _extent_rec(extents):
+    extents = list(extents) + [(0, 0)] * (8 - len(extents))
+    return b"".join(struct.pack(">II", start, cnt) for start, cnt in extents)
+
+
+def _fork_data(size, extents, total_blocks):
+    return HFSPlusForkData.parse(
+        struct.pack(">QII", size, 0, total_blocks) + _extent_rec(extents[:8])
+    )
+
+
+def test_hfs_fork_extents():
+    blk = 512
+    rng = random.Random(5)
+    # 30 scattered single and multi block extents, some physically adjacent
+    phys_blocks = list(range(200))
+    rng.shuffle(phys_blocks)
+    extents, lblk = [], 0
+    for i in range(30):
+        cnt = rng.randrange(1, 4)
+        start = phys_blocks[i] * 4
+        extents.append((start, cnt))
+        lblk += cnt
+    extents[3] = (extents[2][0] + extents[2][1], extents[3][1])
+    vol = bytearray(rng.randbytes(800 * 4 * blk))
+    expected = b"".join(vol[s * blk : (s + c) * blk] for s, c in extents)
+    size = len(expected) - 100
+    overflow, nblks = [], sum(c for _, c in extents[:8])
+    for i in range(8, len(extents), 8):
+        group = extents[i : i + 8]
+        overflow.append(((7, 0, nblks), _extent_key(7, 0, nblks) + _extent_rec(group)))
+        nblks += sum(c for _, c in group)
+    # another file's and the resource fork's records must be skipped
+    overflow.append(((6, 0, 0), _extent_key(6, 0, 0) + _extent_rec([(1, 1)])))
+    overflow.append(((7, 0xFF, 0), _extent_key(7, 0xFF, 0) + _extent_rec([(1, 1)])))
+    ext_buf, height = _make_btree(overflow, 512)
+    ext_tree = ExtentsBTree(FancyRawIOBase(io.BytesIO(ext_buf)))
+    fork = HFSFork.from_fork_data(
+        FancyRawIOBase(io.BytesIO(bytes(vol))),
+        blk,
+        _fork_data(size, extents, lblk),
+        7,
+        extents_btree=ext_tree,
+    )
+    # adjacent extents are coalesced into one entry
+    assert len(fork.extents) < len(extents)
+    assert sum(c for _, _, c in fork.extents) == lblk
+    assert fork.read() == expected[:size]
+    for _ in range(300):
+        off = rng.randrange(size)
+        n = rng.randrange(min(size - off, 4 * blk) + 1)
+        assert bytes(fork.pread(off, n)) == expected[off : off + n]
+    with pytest.raises(ValueError):
+        fork.pread(size - 10, 20)
+    with pytest.raises(ValueError):
+        HFSFork.from_fork_data(vol, blk, _fork_data(size, extents, lblk), 7)
+
+
+def test_hfs_fork_volume():
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "hello-hfs-part.img", "rb") as hfs_fh:
+        hfs = HFS(hfs_fh)
+        assert hfs.cat_file.sz == hfs.hdr.catalogFile.logicalSize
+        assert hfs.extents is not None and hfs.attributes_file is not None
+        rec = hfs.catalog.lookup("/hello/world.txt")
+        data = hfs.open_data_fork(rec).read()
+        root = test_dir / "hello_dmg_rootfs"
+        assert bytes(data) == (root / "hello" / "world.txt").read_bytes()
+        assert hfs.open_resource_fork(rec).read() == b""
+
+
+def _attr_key(file_id, name):
+    units = name.encode("utf-16-be")
+    return (
+        struct.pack(">HHIIH", 12 + len(units), 0, file_id, 0, len(units) // 2) + units
+    )
+
+
+def _make_volume(files, block_size=4096, rsrc=None, xattrs=None):
+    # files are (path, data), each data fork split into up to 8 extents laid
+    # out back to front so reads have to follow the extent map; rsrc and
+    # xattrs map paths to resource forks and inline attributes
+    rsrc, xattrs = rsrc or {}, xattrs or {}
+    vol_hdr = (
+        importlib.resources.files(__package__) / "hello-hfs-part.img"
+    ).read_bytes()
+    hdr = HFSPlusVolumeHeader.parse(vol_hdr[1024:1536])
+    folder_ids = {"": 2}
+    valences = collections.Counter()
+    entries = []
+    data = bytearray(block_size)
+
+    def folder_id(path):
+        if path not in folder_ids:
+            parent, _, name = path.rpartition("/")
+            pid = folder_id(parent)
+            fid = folder_ids[path] = 16 + len(folder_ids) + len(files)
+            valences[pid] += 1
+            entries.append((pid, name, fid))
+        return folder_ids[path]
+
+    def place(buf):
+        nblks = -(-len(buf) // block_size)
+        pieces = min(nblks, 8)
+        bounds = [nblks * j // pieces for j in range(pieces + 1)] if nblks else [0]
+        extents = [None] * pieces
+        for j in reversed(range(pieces)):
+            lo, hi = bounds[j] * block_size, bounds[j + 1] * block_size
+            extents[j] = (len(data) // block_size, bounds[j + 1] - bounds[j])
+            data.extend(buf[lo:hi].ljust(hi - lo, b"\0"))
+        return extents
+
+    recs, attr_recs = [], []
+    for i, (path, buf) in enumerate(files):
+        parent, _, name = path.strip("/").rpartition("/")
+        pid = folder_id(parent)
+        valences[pid] += 1
+        file_id = 16 + i
+        rsrc_buf = rsrc.get(path, b"")
+        attrs = xattrs.get(path, {})
+        for attr_name, attr_buf in attrs.items():
+            attr_recs.append(
+                (
+                    (file_id, attr_name, 0),
+                    _attr_key(file_id, attr_name)
+                    + struct.pack(">IQI", 0x10, 0, len(attr_buf))
+                    + attr_buf,
+                )
+            )
+        rec = _file(
+            file_id,
+            len(buf),
+            place(buf),
+            block_size,
+            (len(rsrc_buf), place(rsrc_buf)),
+            0x20 if "com.apple.decmpfs" in attrs else 0,
+        )
+        recs.append((pid, name, rec))
+        recs.append((file_id, "", _thread(CatalogRecordType.file_thread, pid, name)))
+    recs += [
+        (1, "vol", _folder(2, valences[2])),
+        (2, "", _thread(CatalogRecordType.folder_thread, 1, "vol")),
+    ]
+    for pid, name, fid in entries:
+        recs.append((pid, name, _folder(fid, valences[fid])))
+        recs.append((fid, "", _thread(CatalogRecordType.folder_thread, pid, name)))
+    cat_buf, _ = _make_catalog(recs, block_size)
+    hdr.extentsFile = hdr.attributesFile = {**_FORK}
+    if attr_recs:
+        attr_buf, _ = _make_btree(attr_recs, block_size)
+        hdr.attributesFile = _fork(len(attr_buf), place(attr_buf), block_size)
+    cat_blks = len(cat_buf) // block_size
+    hdr.catalogFile = _fork(
+        len(cat_buf), [(len(data) // block_size, cat_blks)], block_size
+    )
+    hdr.blockSize = block_size
+    hdr.totalBlocks = len(data) // block_size + cat_blks
+    data[1024:1536] = HFSPlusVolumeHeader.build(hdr)
+    return bytes(data + cat_buf)
+
+
+def test_hfs_fs_copy(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    rootfs_dir = test_dir / "hello_dmg_rootfs"
+    with HFSFS(str(test_dir / "hello-hfs-part.img")) as hfs_fs:
+        assert hfs_fs.listdir("/") == ["hello"]
+        info = hfs_fs.getinfo("/hello/world.txt", ["access"])
+        assert info.size == 14 and info.permissions.mode == 0o644
+        assert hfs_fs.getinfo("/").is_dir
+        with pytest.raises(ResourceNotFound):
+            hfs_fs.getinfo("/\0\0\0\0HFS+ Private Data")
+        with pytest.raises(ResourceReadOnly):
+            hfs_fs.openbin("/hello/world.txt", "w")
+        with pytest.raises(FileExpected):
+            hfs_fs.openbin("/hello")
+        fs.copy.copy_fs(hfs_fs, str(tmp_path))
+    copied = sorted(p.relative_to(tmp_path) for p in tmp_path.rglob("*"))
+    # the image only holds the hello/ subtree of the rootfs
+    assert [str(p) for p in copied] == ["hello", "hello/world.txt"]
+    for p in copied:
+        if (tmp_path / p).is_file():
+            assert (tmp_path / p).read_bytes() == (rootfs_dir / str(p)).read_bytes()
+
+
+def test_hfs_fs_synth(tmp_path):
+    rng = random.Random(11)
+    files = [
+        (f"d{i % 7}/sub{i % 3}/f{i:04d}.bin", rng.randbytes(rng.randrange(40_000)))
+        for i in range(300)
+    ]
+    files += [(f"flat/e{i:04d}", b"") for i in range(1000)]
+    img = _make_volume(files)
+    hfs_fs = HFSFS(FancyRawIOBase(io.BytesIO(img)))
+    cat = hfs_fs.hfs.catalog
+    reads = cat.stats.hits + cat.stats.misses
+    infos = list(hfs_fs.scandir("/flat"))
+    assert len(infos) == 1000 and all(i.size == 0 and not i.is_dir for i in infos)
+    # one descent then a sequential walk of the folder's leaves, a lookup per
+    # child would be a thousand descents
+    node_reads = cat.stats.hits + cat.stats.misses - reads
+    assert node_reads < 1000 // 10
+    assert [i.name for i in infos] == sorted(i.name for i in infos)
+    assert [i.name for i in hfs_fs.scandir("/flat", page=(10, 20))] == [
+        i.name for i in infos[10:20]
+    ]
+    t = time.perf_counter()
+    fs.copy.copy_fs(hfs_fs, str(tmp_path))
+    elapsed = time.perf_counter() - t
+    total = sum(len(buf) for _, buf in files)
+    print(
+        f"copied {len(files)} files {total} bytes in {elapsed:.3f}s "
+        f"({total / elapsed / (1024 * 1024):.1f} MiB/s)"
+    )
+    for path, buf in files:
+        assert (tmp_path / path).read_bytes() == buf
+    with hfs_fs.openbin(files[5][0]) as f:
+        f.seek(12345)
+        assert f.read(1000) == files[5][1][12345:13345]
+
+
+def _zlib_rsrc(chunks):
+    # resource fork holding one 'cmpf' resource with its block table
+    tbl = struct.pack("<I", len(chunks))
+    off = 4 + 8 * len(chunks)
+    for c in chunks:
+        tbl += struct.pack("<II", off, len(c))
+        off += len(c)
+    res = tbl + b"".join(chunks)
+    return (
+        struct.pack(">I", 0x100).ljust(0x100, b"\0") + struct.pack(">I", len(res)) + res
+    )
+
+
+def test_hfs_decmpfs():
+    rng = random.Random(13)
+    words = [rng.randbytes(rng.randrange(2, 10)) for _ in range(50)]
+    big = b"".join(rng.choice(words) for _ in range(600_000))[: 50 * 65536 + 777]
+    small = b"small file " * 300
+    chunks = [zlib.compress(big[i : i + 65536]) for i in range(0, len(big), 65536)]
+    big_hdr = DecmpfsHeader.build(
+        {"compression_type": DecmpfsType.zlib_rsrc, "uncompressed_size": len(big)}
+    )
+    small_hdr = DecmpfsHeader.build(
+        {"compression_type": DecmpfsType.zlib_xattr, "uncompressed_size": len(small)}
+    )
+    img = _make_volume(
+        [("bin/big", b""), ("bin/small", b""), ("plain.txt", b"plain\n")],
+        rsrc={"bin/big": _zlib_rsrc(chunks)},
+        xattrs={
+            "bin/big": {"com.apple.decmpfs": big_hdr, "com.apple.quarantine": b"q"},
+            "bin/small": {"com.apple.decmpfs": small_hdr + zlib.compress(small)},
+        },
+    )
+    hfs_fs = HFSFS(FancyRawIOBase(io.BytesIO(img)))
+    hfs = hfs_fs.hfs
+    rec = hfs.catalog.lookup("/bin/big")
+    assert hfs.listxattr(rec.fileID) == ["com.apple.decmpfs", "com.apple.quarantine"]
+    assert hfs.getxattr(rec.fileID, "com.apple.quarantine") == b"q"
+    assert hfs.getxattr(rec.fileID, "com.apple.nope") is None
+    assert hfs.file_size(rec) == len(big) and rec.dataFork.logicalSize == 0
+    assert hfs_fs.getinfo("/bin/big").size == len(big)
+    assert [i.size for i in hfs_fs.scandir("/bin")] == [len(big), len(small)]
+    with hfs_fs.openbin("/bin/big") as f:
+        # 4 KiB in the middle decompresses a single chunk
+        f.seek(len(big) // 2)
+        assert f.read(4096) == big[len(big) // 2 : len(big) // 2 + 4096]
+        assert f.raw.src.stats.fetches == 1
+        f.seek(0)
+        assert f.read() == big
+    assert hfs_fs.readbytes("/bin/small") == small
+    assert hfs_fs.readbytes("/plain.txt") == b"plain\n"
+    assert hfs.file_size(hfs.catalog.lookup("/plain.txt")) == 6
 
 
 if __name__ == "__main__":
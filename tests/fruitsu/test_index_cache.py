@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import importlib.resources
+import os
+import sys
+
+import pytest
+from fruitsu.dmg import DMG, DMGMetadata
+from fruitsu.fs import DirEntType
+from fruitsu.index_cache import IndexCache
+from fruitsu.io_ext import HTTPFile
+from fruitsu.xar import XARFile
+from rich import print
+
+XAR_ATTRS = (
+    "name",
+    "type",
+    "size",
+    "size_comp",
+    "data_off",
+    "data_len",
+    "encoding",
+    "link",
+    "mode",
+    "uid",
+    "gid",
+    "mtime",
+    "ctime",
+    "atime",
+    "extracted_cksum",
+    "archived_cksum",
+)
+
+
+def _toc_snapshot(xar):
+    toc = xar.toc
+    snap = [(toc.cksum_style, toc.cksum_off, toc.cksum_sz, toc.creation_time)]
+    for path, ino in toc.walk():
+        snap.append((path, *(getattr(ino, a) for a in XAR_ATTRS)))
+    return snap
+
+
+@pytest.mark.parametrize("name", ["etc.xar", "hello-gz.xar"])
+def test_index_cache_xar(name, tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    cache = IndexCache(tmp_path / "cache")
+    with open(test_dir / name, "rb") as f:
+        cold = XARFile(f.raw, index_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    with open(test_dir / name, "rb") as f:
+        warm = XARFile(f.raw, index_cache=cache)
+        for _, ino in warm.toc.walk():
+            if ino.type == DirEntType.REG:
+                with warm.open_member(ino) as m:
+                    assert len(m.read()) == ino.size
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert _toc_snapshot(warm) == _toc_snapshot(cold)
+
+
+def test_index_cache_invalidation(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    xar_path = tmp_path / "hello.xar"
+    xar_path.write_bytes((test_dir / "hello-bz2.xar").read_bytes())
+    cache = IndexCache(tmp_path / "cache")
+    with open(xar_path, "rb") as f:
+        XARFile(f.raw, index_cache=cache)
+    st = os.stat(xar_path)
+    os.utime(xar_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    with open(xar_path, "rb") as f:
+        XARFile(f.raw, index_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    # truncated entries are treated as misses and rewritten
+    for entry_path in cache._entries():
+        entry_path.write_bytes(entry_path.read_bytes()[:40])
+    with open(xar_path, "rb") as f:
+        xar = XARFile(f.raw, index_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert len(list(xar.toc.walk())) == 17
+    with open(xar_path, "rb") as f:
+        XARFile(f.raw, index_cache=cache)
+    assert cache.hits == 1
+
+
+def test_index_cache_toc_checksum(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    xar_path = tmp_path / "hello.xar"
+    xar_path.write_bytes((test_dir / "hello-bz2.xar").read_bytes())
+    cache = IndexCache(tmp_path / "cache")
+    with open(xar_path, "rb") as f:
+        heap_off = XARFile(f.raw, index_cache=cache).heap_off
+    # a rewritten TOC checksum with the same size and mtime is a new key
+    st = os.stat(xar_path)
+    with open(xar_path, "r+b") as f:
+        f.seek(heap_off)
+        cksum = f.read(1)
+        f.seek(heap_off)
+        f.write(bytes([cksum[0] ^ 0xFF]))
+    os.utime(xar_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    with open(xar_path, "rb") as f:
+        XARFile(f.raw, index_cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_index_cache_dmg(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    cache = IndexCache(tmp_path / "cache")
+    with open(test_dir / "hello.dmg", "rb") as f:
+        cold = DMGMetadata.from_file(f, cache)
+    with open(test_dir / "hello.dmg", "rb") as f:
+        warm = DMG(f, index_cache=cache).meta
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert warm == cold
+    assert len(warm.blkx_tables) == 8
+
+
+def test_index_cache_remote_xar(range_server, tmp_path):
+    cache = IndexCache(tmp_path / "cache")
+    url = range_server.url("etc.xar")
+    cold = XARFile(HTTPFile(url, cache_blksz=4096), index_cache=cache)
+    cold_gets = len(range_server.gets)
+    warm = XARFile(HTTPFile(url, cache_blksz=4096), index_cache=cache)
+    warm_gets = len(range_server.gets) - cold_gets
+    print(f"cold GETs: {cold_gets} warm GETs: {warm_gets}")
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert warm_gets < cold_gets
+    assert _toc_snapshot(warm) == _toc_snapshot(cold)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
@@ -1,9 +1,21 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import importlib.resources
+import io
 import sys
+import tracemalloc
 
 import pytest
-from fruitsu.io_ext import HTTPFile
+from fruitsu.hfs import HFS
+from fruitsu.io_ext import (
+    BlockCache,
+    FancyRawIOBase,
+    HTTPFile,
+    MmapRawIOBase,
+    OffsetRawIOBase,
+)
+from fruitsu.xar import XARFile
 from rich import print
 
 
@@ -16,6 +28,234 @@ def test_https():
     print(f"hdr: {hdr.hex()}")
 
 
+def test_block_cache_merges_misses():
+    buf = bytes(range(256)) * 64
+    fetches = []
+
+    def fetch(off, size):
+        fetches.append((off, size))
+        return buf[off : off + size]
+
+    cache = BlockCache(fetch, len(buf), blksz=256, readahead_max=0)
+    assert cache.read(0, 10) == buf[:10]
+    assert cache.read(600, 10) == buf[600:610]
+    assert cache.read(0, 1024) == buf[:1024]
+    # blocks 1 and 3 were missing and get fetched as separate runs
+    assert fetches == [(0, 256), (512, 256), (256, 256), (768, 256)]
+    assert cache.read(100, 800) == buf[100:900]
+    assert len(fetches) == 4
+    assert cache.stats.hits == 1
+
+
+def test_block_cache_lru_budget():
+    buf = bytes(4096)
+    cache = BlockCache(
+        lambda off, size: buf[off : off + size],
+        len(buf),
+        blksz=512,
+        max_bytes=1024,
+        readahead_max=0,
+    )
+    for off in range(0, 4096, 512):
+        cache.read(off, 512)
+    assert cache.stats.evictions == 6
+    cache.read(3584, 1)
+    assert cache.stats.hits == 1
+    cache.read(0, 1)
+    assert cache.stats.misses == 9
+
+
+def test_block_cache_readahead():
+    buf = bytes(1024 * 1024)
+    fetches = []
+
+    def fetch(off, size):
+        fetches.append((off, size))
+        return buf[off : off + size]
+
+    cache = BlockCache(fetch, len(buf), blksz=4096, readahead_max=256 * 1024)
+    for off in range(0, len(buf), 512):
+        assert cache.read(off, 512) == buf[off : off + 512]
+    assert len(fetches) < 16
+    assert sum(sz for _, sz in fetches) == len(buf)
+
+
+def test_http_block_cache(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "etc.xar").read_bytes()
+    fh = HTTPFile(range_server.url("etc.xar"), cache_blksz=4096)
+    assert fh.sz == len(local_buf)
+    for off in range(0, 64 * 1024, 100):
+        fh.seek(off)
+        assert fh.read(100) == local_buf[off : off + 100]
+    print(f"stats: {fh.cache_stats}")
+    assert len(range_server.gets) < 10
+    assert fh.seek(-16, 2) == len(local_buf) - 16
+    assert fh[len(local_buf) - 16 : 16] == local_buf[-16:]
+
+
+def test_http_xar_remote(range_server):
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "etc.xar", "rb") as xar_fh:
+        local_xar = XARFile(xar_fh.raw)
+    remote_xar = XARFile(HTTPFile(range_server.url("etc.xar")))
+    assert [n.name for n in remote_xar.toc.rootfs.descendants] == [
+        n.name for n in local_xar.toc.rootfs.descendants
+    ]
+    assert len(range_server.gets) <= 2
+
+
+def test_http_offset_subfile(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "hello.dmg").read_bytes()
+    fh = OffsetRawIOBase(HTTPFile(range_server.url("hello.dmg")), 512, 1024)
+    assert fh.read(16) == local_buf[512:528]
+    assert fh[100:100] == local_buf[612:712]
+
+
+def test_http_fetch_ranges_parallel(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "etc.xar").read_bytes()
+    fh = HTTPFile(range_server.url("etc.xar"), parallel_split_sz=64 * 1024)
+    buf = fh.fetch_ranges([(0, len(local_buf))])
+    assert buf == local_buf
+    assert len(range_server.gets) == (len(local_buf) + 0xFFFF) // 0x10000
+    spans = [(off, 1000) for off in range(500_000, 0, -37_000)]
+    buf = fh.fetch_ranges(spans)
+    assert buf == b"".join(local_buf[off : off + sz] for off, sz in spans)
+
+
+def test_http_fetch_ranges_multipart(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "etc.xar").read_bytes()
+    fh = HTTPFile(range_server.url("etc.xar"), multipart=True, max_ranges_per_request=4)
+    spans = [(off, 333) for off in range(0, 700_000, 70_000)]
+    buf = bytearray(len(spans) * 333)
+    fh.fetch_ranges(spans, buf)
+    assert buf == b"".join(local_buf[off : off + sz] for off, sz in spans)
+    assert len(range_server.gets) == 3
+    range_server.httpd.multipart = False
+    assert fh.fetch_ranges(spans) == buf
+
+
+def test_http_large_read_bypasses_cache(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "hello-full.img").read_bytes()
+    fh = HTTPFile(
+        range_server.url("hello-full.img"),
+        parallel_min_sz=1024 * 1024,
+        parallel_split_sz=256 * 1024,
+    )
+    assert fh.read() == local_buf
+    assert fh.cache_stats.fetches == 0
+    assert len(range_server.gets) == 8
+
+
+def test_pread_nested_subfiles():
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "hello-full.img").read_bytes()
+    with open(test_dir / "hello-full.img", "rb") as img_fh:
+        fh = OffsetRawIOBase(img_fh)
+        part = fh.subfile(20480, 3712 * 512)
+        sub = OffsetRawIOBase(part, 1024, 512)
+        assert sub.pread(0, 2) == b"H+"
+        assert sub.pread(100, 50) == local_buf[20480 + 1124 : 20480 + 1174]
+        buf = bytearray(512)
+        assert sub.readinto_at(0, buf) == 512
+        assert buf == local_buf[21504:22016]
+        assert sub[0:2] == b"H+"
+        # positional reads never move any file position
+        assert img_fh.tell() == 0 and fh.tell() == 0 and sub.tell() == 0
+        assert sub.seek(-2, io.SEEK_END) == 510
+        assert sub.read() == local_buf[22014:22016]
+        with pytest.raises(ValueError):
+            sub.pread(500, 13)
+
+
+def test_pread_non_fd_source():
+    buf = bytes(range(256))
+    fh = FancyRawIOBase(io.BytesIO(buf))
+    assert fh.size() == 256
+    assert fh.pread(16, 4) == buf[16:20]
+    assert OffsetRawIOBase(fh, 8, 8)[2:2] == buf[10:12]
+
+
+class DetachedFdBytesIO(io.BytesIO):
+    # fileno() on a closed file object raises ValueError rather than OSError
+    def fileno(self):
+        raise ValueError("I/O operation on closed file")
+
+
+def test_pread_fileno_value_error():
+    buf = bytes(range(256))
+    fh = FancyRawIOBase(DetachedFdBytesIO(buf))
+    assert fh._fileno() is None
+    assert fh.size() == 256
+    assert fh.pread(16, 4) == buf[16:20]
+    rbuf = bytearray(4)
+    assert fh.readinto_at(32, rbuf) == 4 and rbuf == buf[32:36]
+
+
+def test_pread_threads():
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "etc.xar").read_bytes()
+    with open(test_dir / "etc.xar", "rb") as xar_fh:
+        fh = OffsetRawIOBase(xar_fh).subfile(1000)
+        offs = list(range(0, len(local_buf) - 5000, 997))
+
+        def check(off):
+            return fh.pread(off, 3000) == local_buf[1000 + off : 4000 + off]
+
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            assert all(pool.map(check, offs))
+
+
+def test_http_pread_threads(range_server):
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "etc.xar").read_bytes()
+    fh = OffsetRawIOBase(HTTPFile(range_server.url("etc.xar"), cache_blksz=4096))
+    offs = list(range(0, len(local_buf) - 5000, 4999))
+
+    def check(off):
+        return fh.pread(off, 3000) == local_buf[off : off + 3000]
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        assert all(pool.map(check, offs))
+    # the HEAD request is the only one not issued by the block cache
+    assert fh.fh.cache_stats.fetches == len(range_server.log) - 1
+
+
+def test_mmap_zero_copy_views():
+    test_dir = importlib.resources.files(__package__)
+    local_buf = (test_dir / "hello-full.img").read_bytes()
+    with open(test_dir / "hello-full.img", "rb") as img_fh:
+        mfh = MmapRawIOBase(img_fh)
+        part = OffsetRawIOBase(mfh).subfile(20480, 3712 * 512)
+        tracemalloc.start()
+        view = part[0 : part.sz]
+        nested = part.subfile(1024, 512).read(2)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert isinstance(view, memoryview) and isinstance(nested, memoryview)
+        assert peak < 64 * 1024
+        assert view == local_buf[20480 : 20480 + 3712 * 512]
+        assert nested == b"H+"
+        buf = bytearray(1000)
+        assert part.readinto(buf) == 1000
+        assert buf == local_buf[20480:21480]
+        assert HFS(part).hdr.blockSize == 4096
+        del view, nested
+        mfh.close()
+
+
+def test_mmap_xar():
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "etc.xar", "rb") as xar_fh:
+        mfh = MmapRawIOBase(xar_fh)
+        xar = XARFile(mfh)
+        assert len(xar.toc.rootfs.descendants) == 303
+
+
 if __name__ == "__main__":
     args = sys.argv
     print(f"pytest.main args: {args}")
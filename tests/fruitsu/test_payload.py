@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import random
+import stat
+import struct
+import sys
+import zlib
+
+import pytest
+from rich import print
+
+from fruitsu.fs import DirEntType
+from fruitsu.payload import (
+    CpioNewcHeader,
+    CpioOdcHeader,
+    PbzxChunkHeader,
+    PbzxHeader,
+    get_arg_parser,
+    iter_payload,
+    iter_pbzx,
+    real_main,
+)
+from fruitsu.xar import XARFS, XARHeader
+
+CHUNK_SZ = 64 * 1024
+
+
+def make_cpio(entries, fmt="odc"):
+    # entries are (name, mode, data) with the link target as symlink data
+    out = bytearray()
+    for ino, (name, mode, data) in enumerate([*entries, ("TRAILER!!!", 0, b"")]):
+        name_buf = name.encode() + b"\0"
+        if fmt == "odc":
+            out += CpioOdcHeader.build(
+                {
+                    "c_dev": 1,
+                    "c_ino": ino,
+                    "c_mode": mode,
+                    "c_uid": 0,
+                    "c_gid": 80,
+                    "c_nlink": 1,
+                    "c_rdev": 0,
+                    "c_mtime": 1700000000,
+                    "c_namesize": len(name_buf),
+                    "c_filesize": len(data),
+                }
+            )
+            out += name_buf + data
+        else:
+            out += CpioNewcHeader.build(
+                {
+                    "c_magic": b"070701",
+                    "c_ino": ino,
+                    "c_mode": mode,
+                    "c_uid": 0,
+                    "c_gid": 80,
+                    "c_nlink": 1,
+                    "c_mtime": 1700000000,
+                    "c_filesize": len(data),
+                    "c_devmajor": 1,
+                    "c_devminor": 2,
+                    "c_rdevmajor": 0,
+                    "c_rdevminor": 0,
+                    "c_namesize": len(name_buf),
+                    "c_check": 0,
+                }
+            )
+            out += name_buf + bytes(-(len(out) + len(name_buf)) % 4)
+            out += data + bytes(-len(data) % 4)
+    return bytes(out)
+
+
+def make_pbzx(buf, chunk_sz=CHUNK_SZ):
+    out = bytearray(PbzxHeader.build({"flags": chunk_sz}))
+    for i in range(0, len(buf), chunk_sz):
+        chunk = buf[i : i + chunk_sz]
+        comp = lzma.compress(chunk, lzma.FORMAT_XZ, preset=1)
+        # incompressible chunks are stored as is
+        data = comp if len(comp) < len(chunk) else chunk
+        out += PbzxChunkHeader.build(
+            {"uncompressed_size": len(chunk), "compressed_size": len(data)}
+        )
+        out += data
+    return bytes(out)
+
+
+def make_xar(name, data):
+    # single member flat package, TOC checksum at the start of the heap
+    cksum_len = 20
+    sha1 = hashlib.sha1(data).hexdigest()
+    toc = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>'
+        '<checksum style="sha1"><offset>0</offset><size>20</size></checksum>'
+        f'<file id="1"><name>{name}</name><type>file</type><data>'
+        f"<length>{len(data)}</length><offset>{cksum_len}</offset>"
+        f"<size>{len(data)}</size>"
+        '<encoding style="application/octet-stream"/>'
+        f'<archived-checksum style="sha1">{sha1}</archived-checksum>'
+        f'<extracted-checksum style="sha1">{sha1}</extracted-checksum>'
+        "</data></file></toc></xar>"
+    ).encode()
+    toc_comp = zlib.compress(toc)
+    hdr = XARHeader.build(
+        {
+            "magic": 0x78617221,
+            "size": 28,
+            "version": 1,
+            "toc_length_compressed": len(toc_comp),
+            "toc_length_uncompressed": len(toc),
+            "cksum_alg": "sha1",
+        }
+    )
+    return hdr + toc_comp + hashlib.sha1(toc_comp).digest() + data
+
+
+def synth_entries(seed=24):
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randrange(2, 12)) for _ in range(64)]
+    entries = [(".", stat.S_IFDIR | 0o755, b""), ("./usr", stat.S_IFDIR | 0o755, b"")]
+    for i in range(40):
+        size = rng.choice([0, 1, 100, 5000, CHUNK_SZ + 17, 3 * CHUNK_SZ])
+        if i % 3:
+            data = b"".join(rng.choice(words) for _ in range(size // 6 + 1))[:size]
+        else:
+            data = rng.randbytes(size)
+        entries.append((f"./usr/file{i}", stat.S_IFREG | 0o644, data))
+    entries.append(("./usr/link", stat.S_IFLNK | 0o755, b"file1"))
+    return entries
+
+
+def check_entries(got, entries):
+    assert [e.name for e in got] == [name for name, _, _ in entries]
+    for e, (_, mode, data) in zip(got, entries):
+        assert e.mode == mode and e.gid == 80 and e.mtime == 1700000000
+        if stat.S_ISLNK(mode):
+            assert e.type == DirEntType.LNK and e.link == data.decode()
+        else:
+            assert e.size == len(data)
+
+
+def read_payload(fh, entries, workers=4, read_every=1):
+    # data is only valid while the entry is current, read it as we go
+    got = []
+    for i, e in enumerate(iter_payload(fh, workers)):
+        if e.type == DirEntType.REG and e.size and i % read_every == 0:
+            with e.open() as f:
+                assert f.read() == entries[i][2]
+        got.append(e)
+    return got
+
+
+@pytest.mark.parametrize("read_every", [1, 3])
+def test_payload_pbzx_xar(tmp_path, read_every):
+    entries = synth_entries()
+    cpio = make_cpio(entries)
+    pbzx = make_pbzx(cpio)
+    assert len(cpio) > 20 * CHUNK_SZ
+    path = tmp_path / "test.pkg"
+    path.write_bytes(make_xar("Payload", pbzx))
+    # XARFS member -> pbzx chunk decoder -> cpio entry iterator
+    xfs = XARFS(str(path))
+    with xfs.openbin("Payload") as fh:
+        got = read_payload(fh, entries, read_every=read_every)
+    check_entries(got, entries)
+    assert got[0].path == "." and got[2].path == "usr/file0"
+
+
+@pytest.mark.parametrize(
+    "fmt,compress",
+    [
+        ("odc", lambda b: b),
+        ("newc", lambda b: b),
+        ("newc", make_pbzx),
+        ("odc", gzip.compress),
+        ("odc", bz2.compress),
+        ("newc", lambda b: lzma.compress(b, lzma.FORMAT_XZ)),
+    ],
+)
+def test_payload_formats(fmt, compress):
+    entries = synth_entries(seed=25)
+    got = read_payload(io.BytesIO(compress(make_cpio(entries, fmt))), entries)
+    check_entries(got, entries)
+    if fmt == "newc":
+        assert got[0].dev == os.makedev(1, 2)
+
+
+def test_payload_pbzx_bounded():
+    # in order output with a bounded read-ahead of compressed chunks
+    buf = random.Random(26).randbytes(32 * CHUNK_SZ)
+    fh = io.BytesIO(make_pbzx(buf))
+    it = iter_pbzx(fh, workers=4, max_inflight=3)
+    first = next(it)
+    assert first == buf[:CHUNK_SZ]
+    # stored chunks are 16 byte headers plus the data
+    assert fh.tell() <= 12 + 4 * (16 + CHUNK_SZ)
+    rest = b"".join(it)
+    assert first + rest == buf
+    it.close()
+
+
+def test_payload_errors():
+    cpio = make_cpio(synth_entries(seed=27))
+    pbzx = make_pbzx(cpio)
+    with pytest.raises(ValueError):
+        list(iter_payload(io.BytesIO(pbzx[:-100])))
+    with pytest.raises(ValueError):
+        list(iter_payload(io.BytesIO(cpio[: len(cpio) // 2])))
+    with pytest.raises(ValueError):
+        list(iter_payload(io.BytesIO(b"not a cpio archive at all")))
+    # a chunk whose size disagrees with its header
+    bad = bytearray(make_pbzx(bytes(CHUNK_SZ)))
+    bad[12:20] = struct.pack(">Q", CHUNK_SZ + 1)
+    with pytest.raises(ValueError):
+        list(iter_pbzx(io.BytesIO(bytes(bad))))
+
+
+def test_payload_cli(tmp_path, capsys):
+    entries = synth_entries(seed=28)
+    path = tmp_path / "test.pkg"
+    path.write_bytes(make_xar("Payload", make_pbzx(make_cpio(entries))))
+    args = get_arg_parser().parse_args(["list", str(path), "-m", "Payload", "-j", "2"])
+    assert real_main(args) == 0
+    # XARFile prints its header first
+    out = capsys.readouterr().out.splitlines()[-len(entries) :]
+    assert out[0].split() == ["drwxr-xr-x", "0", "."]
+    assert out[2].split() == ["-rw-r--r--", str(len(entries[2][2])), "usr/file0"]
+    assert out[-1].endswith("usr/link -> file1")
+    args = get_arg_parser().parse_args(["list", str(path), "-m", "Nope"])
+    assert real_main(args) == 1
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
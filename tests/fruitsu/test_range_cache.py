@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import random
+import subprocess
+import sys
+
+import pytest
+from rich import print
+
+from fruitsu.io_ext import HTTPFile
+from fruitsu.range_cache import RangeCache
+from fruitsu.xar import XARFile
+
+BLKSZ = 4096
+
+# reads a few scattered ranges through a shared cache from another process
+READER = """
+import sys
+from fruitsu.io_ext import HTTPFile
+from fruitsu.range_cache import RangeCache
+cache = RangeCache(sys.argv[1], blksz=4096)
+f = HTTPFile(sys.argv[2], cache_blksz=4096, readahead_max=0, range_cache=cache)
+for off in range(0, f.sz - 100, 50000):
+    sys.stdout.buffer.write(f.pread(off, 100))
+"""
+
+
+def range_gets(srv):
+    return [r for r in srv.log if r.method == "GET"]
+
+
+def test_range_cache_remote_xar(range_server, tmp_path):
+    cache = RangeCache(tmp_path / "cache", blksz=BLKSZ)
+    url = range_server.url("etc.xar")
+    cold = XARFile(HTTPFile(url, cache_blksz=BLKSZ, range_cache=cache))
+    cold_gets = len(range_gets(range_server))
+    cold_names = [path for path, _ in cold.toc.walk()]
+    assert cache.misses and cache.stores and not cache.hits
+    range_server.log.clear()
+    # a fresh HTTPFile starts with an empty memory cache but a warm disk one
+    warm = XARFile(HTTPFile(url, cache_blksz=BLKSZ, range_cache=cache))
+    print(f"cold GETs: {cold_gets} warm GETs: {len(range_gets(range_server))}")
+    assert range_gets(range_server) == []
+    assert [path for path, _ in warm.toc.walk()] == cold_names
+    assert cache.hits
+    assert cache.usage == cache.stored_bytes
+
+
+def test_range_cache_validator(range_server, tmp_path):
+    cache = RangeCache(tmp_path / "cache", blksz=BLKSZ)
+    rng = random.Random(23)
+    payload = rng.randbytes(10 * BLKSZ)
+    url = range_server.add("payload.bin", payload)
+    f = HTTPFile(url, cache_blksz=BLKSZ, range_cache=cache)
+    assert f.pread(5000, 3000) == payload[5000:8000]
+    assert (cache.hits, cache.misses, cache.stores) == (0, 1, 1)
+    # same URL, new ETag: the old blocks must not be served
+    payload2 = rng.randbytes(10 * BLKSZ)
+    url = range_server.add("payload.bin", payload2)
+    range_server.log.clear()
+    f = HTTPFile(url, cache_blksz=BLKSZ, range_cache=cache)
+    assert f.pread(5000, 3000) == payload2[5000:8000]
+    assert len(range_gets(range_server)) == 1
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_range_cache_lru(tmp_path):
+    cache = RangeCache(tmp_path / "cache", max_bytes=8 * BLKSZ, blksz=BLKSZ)
+    payload = random.Random(24).randbytes(64 * BLKSZ + 123)
+    fetches = []
+
+    def fetch(off, size):
+        fetches.append((off, size))
+        return payload[off : off + size]
+
+    key = cache.entry_key("http://example.com/payload", '"etag"')
+    sz = len(payload)
+    # the tail block is short
+    assert cache.read(key, sz, sz - 100, 100, fetch) == payload[-100:]
+    assert fetches == [(64 * BLKSZ, 123)]
+    for blk in range(8):
+        assert (
+            cache.read(key, sz, blk * BLKSZ, 10, fetch) == payload[blk * BLKSZ :][:10]
+        )
+    assert cache.evictions and cache.usage <= 8 * BLKSZ
+    # the tail block was least recently used so it is gone
+    fetches.clear()
+    assert cache.read(key, sz, sz - 10, 10, fetch) == payload[-10:]
+    assert fetches == [(64 * BLKSZ, 123)]
+    # while the most recently used blocks survived
+    fetches.clear()
+    assert (
+        cache.read(key, sz, 6 * BLKSZ, 2 * BLKSZ, fetch)
+        == payload[6 * BLKSZ : 8 * BLKSZ]
+    )
+    assert fetches == []
+    cache.clear()
+    assert cache.usage == 0
+    assert cache.read(key, sz, 0, 1, fetch) == payload[:1]
+    assert fetches == [(0, BLKSZ)]
+
+
+def test_range_cache_processes(range_server, tmp_path):
+    payload = random.Random(25).randbytes(1024 * 1024)
+    url = range_server.add("payload.bin", payload)
+    root = tmp_path / "cache"
+    expected = b"".join(
+        payload[off : off + 100] for off in range(0, len(payload) - 100, 50000)
+    )
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", READER, str(root), url], stdout=subprocess.PIPE
+        )
+        for _ in range(4)
+    ]
+    for proc in procs:
+        out, _ = proc.communicate(timeout=60)
+        assert proc.returncode == 0 and out == expected
+    # racing writers stored each block once
+    cache = RangeCache(root, blksz=BLKSZ)
+    assert cache.usage == 21 * BLKSZ
+    range_server.log.clear()
+    f = HTTPFile(url, cache_blksz=BLKSZ, readahead_max=0, range_cache=cache)
+    assert f.pread(250000, 100) == payload[250000:250100]
+    assert range_gets(range_server) == []
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    print(f"pytest.main args: {args}")
+    sys.exit(pytest.main(args))
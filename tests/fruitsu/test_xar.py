@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
+import hashlib
 import importlib.resources
+import os
 import sys
+import zlib
 
 import pytest
-from fruitsu.xar import XARFile
 from rich import print
 
+from fruitsu.fs import DirEntType
+from fruitsu.xar import XARFS, XARTOC, XARFile, XARHeader, get_arg_parser, real_main
+
 
 def test_xar_etc():
     test_dir = importlib.resources.files(__package__)
@@ -18,6 +23,269 @@ def test_xar_etc():
         xar.toc.rootfs.dump()
 
 
+@pytest.mark.parametrize("variant", ["gz", "bz2", "std", "nocomp"])
+def test_xar_openbin(variant):
+    test_dir = importlib.resources.files(__package__)
+    rootfs_dir = test_dir / "hello_dmg_rootfs"
+    xarfs = XARFS(str(test_dir / f"hello-{variant}.xar"))
+    files = list(xarfs.walk.files())
+    assert len(files) == 6
+    for path in files:
+        with xarfs.openbin(path) as f:
+            assert f.read() == (rootfs_dir / path.lstrip("/")).read_bytes()
+
+
+def test_xar_toc_metadata():
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / "hello-gz.xar", "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+    toc = xar.toc
+    assert (toc.cksum_style, toc.cksum_off, toc.cksum_sz) == ("sha1", 0, 20)
+    assert toc.creation_time == 1644641836.0
+    ino = toc.rootfs.lookup("/root.txt")
+    assert (ino.data_off, ino.data_len, ino.size, ino.size_comp) == (82, 25, 17, 25)
+    assert ino.encoding == "application/x-gzip"
+    assert (ino.mode, ino.uid, ino.gid) == (0o644, 501, 20)
+    assert ino.mtime == 1644634444.0
+    assert ino.extracted_cksum == ("sha1", "a5b28fc13c275377ab0d6936beb44cb452076431")
+    assert ino.archived_cksum == ("sha1", "ffee66225e448f08eda821ba0dff15b7aa3d27c4")
+    link = toc.rootfs.lookup("/hola/mundo.txt")
+    assert link.link == "../hello/world.txt"
+    assert link.data_off is None
+    nowhere = toc.rootfs.lookup("/sometimes/the/road/leads/nowhere")
+    assert nowhere.is_dir and nowhere.mode == 0o775
+
+
+def test_xar_toc_streaming_deep():
+    depth = 2000
+    xml = (
+        "<xar><toc>"
+        + "<file><type>directory</type><name>d</name>" * depth
+        + "</file>" * depth
+        + "</toc></xar>"
+    ).encode()
+    # tiny chunks split tags and text across feeds
+    toc = XARTOC.from_chunks(xml[i : i + 7] for i in range(0, len(xml), 7))
+    ino = toc.rootfs
+    for _ in range(depth):
+        (ino,) = ino.children
+        assert ino.name == "d" and ino.is_dir
+    assert not ino.children
+
+
+def _tree_snapshot(root):
+    snap = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            if os.path.islink(path):
+                snap[rel] = ("link", os.readlink(path))
+            elif os.path.isfile(path):
+                with open(path, "rb") as f:
+                    snap[rel] = ("file", f.read())
+    return snap
+
+
+@pytest.mark.parametrize("variant", ["gz", "bz2", "std", "nocomp"])
+@pytest.mark.parametrize("stream_min_sz", [1, 64 * 1024 * 1024])
+def test_xar_extract_all(variant, stream_min_sz, tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    with open(test_dir / f"hello-{variant}.xar", "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+        seen = []
+        stats = xar.extract_all(
+            tmp_path,
+            workers=4,
+            progress=lambda st: seen.append(st.files),
+            stream_min_sz=stream_min_sz,
+        )
+    print(f"stats: {stats} throughput: {stats.throughput:.0f} B/s")
+    assert _tree_snapshot(tmp_path) == _tree_snapshot(test_dir / "hello_dmg_rootfs")
+    assert os.path.isdir(tmp_path / "sometimes/the/road/leads/nowhere")
+    assert seen == list(range(1, 6))
+    assert (stats.files, stats.links, stats.dirs) == (5, 1, 11)
+    assert stats.bytes_out == stats.total_bytes
+
+
+def make_hardlink_xar(data):
+    # the link entry comes first and refers forward to the original's id
+    comp = zlib.compress(data)
+    arc, ext = hashlib.sha1(comp).hexdigest(), hashlib.sha1(data).hexdigest()
+    toc = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>'
+        '<checksum style="sha1"><offset>0</offset><size>20</size></checksum>'
+        '<file id="1"><name>bin</name><type>directory</type>'
+        '<file id="2"><name>alias</name><type link="3">hardlink</type></file>'
+        "</file>"
+        '<file id="3"><name>orig</name><type link="original">hardlink</type><data>'
+        f"<length>{len(comp)}</length><offset>20</offset><size>{len(data)}</size>"
+        '<encoding style="application/x-gzip"/>'
+        f'<archived-checksum style="sha1">{arc}</archived-checksum>'
+        f'<extracted-checksum style="sha1">{ext}</extracted-checksum>'
+        "</data></file></toc></xar>"
+    ).encode()
+    toc_comp = zlib.compress(toc)
+    hdr = XARHeader.build(
+        {
+            "magic": 0x78617221,
+            "size": 28,
+            "version": 1,
+            "toc_length_compressed": len(toc_comp),
+            "toc_length_uncompressed": len(toc),
+            "cksum_alg": "sha1",
+        }
+    )
+    return hdr + toc_comp + hashlib.sha1(toc_comp).digest() + comp
+
+
+def test_xar_hardlink(tmp_path):
+    data = b"hardlinked\n" * 1000
+    xar_path = tmp_path / "links.xar"
+    xar_path.write_bytes(make_hardlink_xar(data))
+    with open(xar_path, "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+        orig = xar.toc.rootfs.lookup("orig")
+        alias = xar.toc.rootfs.lookup("bin/alias")
+        assert alias.type == DirEntType.REG and alias.hardlink == orig.ino
+        assert orig.hardlink is None and alias.size == len(data)
+        with xar.open_member(alias, verify=True) as f:
+            assert f.read() == data and f.verified
+        # the shared data is only hashed once
+        report = xar.verify(extracted=True)
+        assert report.ok and report.total == 2
+        stats = xar.extract_all(tmp_path / "out")
+    assert (stats.files, stats.links) == (1, 1)
+    orig_st = os.stat(tmp_path / "out/orig")
+    assert os.stat(tmp_path / "out/bin/alias").st_ino == orig_st.st_ino
+    assert orig_st.st_nlink == 2
+    assert (tmp_path / "out/bin/alias").read_bytes() == data
+    assert XARFS(str(xar_path)).readbytes("bin/alias") == data
+    with pytest.raises(ValueError):
+        XARTOC.from_xml(
+            '<xar><toc><file id="1"><name>a</name><type link="9">hardlink</type>'
+            "</file></toc></xar>"
+        )
+
+
+def test_xar_extract_cli(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    args = get_arg_parser().parse_args(
+        ["extract", str(test_dir / "etc.xar"), str(tmp_path), "-j", "2"]
+    )
+    assert real_main(args) == 0
+    xarfs = XARFS(str(test_dir / "etc.xar"))
+    for path in xarfs.walk.files():
+        if xarfs.getinfo(path, namespaces=["link"]).is_link:
+            continue
+        with xarfs.openbin(path) as f:
+            assert f.read() == (tmp_path / path.lstrip("/")).read_bytes()
+
+
+def make_xar(name, data, cksum=None):
+    # single uncompressed member, TOC checksum at the start of the heap
+    cksum = cksum or hashlib.sha1(data).hexdigest()
+    toc = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<xar><toc>'
+        '<checksum style="sha1"><offset>0</offset><size>20</size></checksum>'
+        f'<file id="1"><name>{name}</name><type>file</type><data>'
+        f"<length>{len(data)}</length><offset>20</offset><size>{len(data)}</size>"
+        '<encoding style="application/octet-stream"/>'
+        f'<archived-checksum style="sha1">{cksum}</archived-checksum>'
+        f'<extracted-checksum style="sha1">{cksum}</extracted-checksum>'
+        "</data></file></toc></xar>"
+    ).encode()
+    toc_comp = zlib.compress(toc)
+    hdr = XARHeader.build(
+        {
+            "magic": 0x78617221,
+            "size": 28,
+            "version": 1,
+            "toc_length_compressed": len(toc_comp),
+            "toc_length_uncompressed": len(toc),
+            "cksum_alg": "sha1",
+        }
+    )
+    return hdr + toc_comp + hashlib.sha1(toc_comp).digest() + data
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("name", ["etc", "hello-gz", "hello-bz2", "hello-std"])
+def test_xar_verify(name, workers):
+    test_dir = importlib.resources.files(__package__)
+    progress = []
+    with open(test_dir / f"{name}.xar", "rb") as xar_fh:
+        xar = XARFile(xar_fh.raw)
+        report = xar.verify(workers=workers, progress=progress.append)
+        assert report.ok and report.toc_ok and report.toc_style == "sha1"
+        assert report.checked == report.total == len(progress)
+        archived = report.total, report.bytes_hashed
+        report = xar.verify(workers=workers, extracted=True)
+    print(f"{name}: {report}")
+    # every checked member has both an archived and an extracted checksum
+    assert report.ok and report.checked == report.total == 2 * archived[0]
+    assert report.bytes_hashed > archived[1]
+    if name == "etc":
+        # a few members carry no checksums at all
+        assert len(report.skipped) == 5 and report.total == 512
+
+
+def test_xar_verify_corrupt(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    buf = bytearray((test_dir / "hello-gz.xar").read_bytes())
+    with open(test_dir / "hello-gz.xar", "rb") as xar_fh:
+        heap_off = XARFile(xar_fh.raw).heap_off
+    # the TOC checksum slot and one byte of root.txt's deflate stream
+    buf[heap_off] ^= 0xFF
+    buf[heap_off + 82 + 10] ^= 0xFF
+    (tmp_path / "bad.xar").write_bytes(buf)
+    with open(tmp_path / "bad.xar", "rb") as xar_fh:
+        report = XARFile(xar_fh.raw).verify(workers=2, extracted=True)
+    assert not report.ok and report.toc_ok is False
+    bad = {(m.kind, m.path) for m in report.mismatches}
+    assert bad == {("toc", ""), ("archived", "root.txt"), ("extracted", "root.txt")}
+    assert report.checked == report.total == 10
+
+
+def test_xar_openbin_verify(tmp_path):
+    test_dir = importlib.resources.files(__package__)
+    xarfs = XARFS(str(test_dir / "hello-bz2.xar"))
+    for path in xarfs.walk.files():
+        with xarfs.openbin(path, buffering=0, verify=True) as f:
+            f.read()
+            assert f.verified
+    data = bytes(range(256)) * 1000
+    (tmp_path / "good.xar").write_bytes(make_xar("data.bin", data))
+    xarfs = XARFS(str(tmp_path / "good.xar"))
+    with xarfs.openbin("data.bin", verify=True) as f:
+        assert f.read() == data
+        assert f.raw.verified
+    # a seek away from the hashed prefix gives up instead of re-reading
+    with xarfs.openbin("data.bin", buffering=0, verify=True) as f:
+        f.seek(100)
+        f.read()
+        assert f.verified is None
+    bad = make_xar("data.bin", data[:-1] + b"X", hashlib.sha1(data).hexdigest())
+    (tmp_path / "bad.xar").write_bytes(bad)
+    xarfs = XARFS(str(tmp_path / "bad.xar"))
+    with xarfs.openbin("data.bin", verify=True) as f:
+        f.read(1000)
+        with pytest.raises(ValueError, match="checksum mismatch"):
+            f.read()
+
+
+def test_xar_verify_cli(tmp_path, capsys):
+    test_dir = importlib.resources.files(__package__)
+    args = get_arg_parser().parse_args(["verify", str(test_dir / "etc.xar"), "-x"])
+    assert real_main(args) == 0
+    assert "512 member checksums, 0 bad, 5 unchecked" in capsys.readouterr().out
+    data = b"payload" * 100
+    (tmp_path / "bad.xar").write_bytes(make_xar("p", data, "00" * 20))
+    args = get_arg_parser().parse_args(["verify", str(tmp_path / "bad.xar")])
+    assert real_main(args) == 1
+    assert f"p (archived): sha1 expected {'00' * 20}" in capsys.readouterr().out
+
+
 if __name__ == "__main__":
     args = sys.argv
     print(f"pytest.main args: {args}")